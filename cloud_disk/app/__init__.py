@@ -1,28 +1,109 @@
+from .config import Config
+
+# ================= 服务器模式 =================
+# 协程服务器需要在导入其他模块之前给标准库打补丁
+if Config.SERVER_MODE == 'gevent':
+    try:
+        from gevent import monkey
+        monkey.patch_all()
+    except ImportError:
+        print("未安装gevent，使用默认的werkzeug服务器")
+        Config.SERVER_MODE = 'werkzeug'
+elif Config.SERVER_MODE == 'eventlet':
+    try:
+        import eventlet
+        eventlet.monkey_patch()
+    except ImportError:
+        print("未安装eventlet，使用默认的werkzeug服务器")
+        Config.SERVER_MODE = 'werkzeug'
+elif Config.SERVER_MODE != 'werkzeug':
+    print(f"未知的服务器模式 {Config.SERVER_MODE}，使用默认的werkzeug服务器")
+    Config.SERVER_MODE = 'werkzeug'
+
 import os
 import sys
 import time
-import webbrowser
 import atexit
 import signal
 import threading
 from flask import Flask
 from flask_socketio import SocketIO
-from .config import Config
-from .utils import get_local_ip, find_available_port
-from .models import FileWatcher
+from .utils import get_local_ip, find_available_port, set_listing_source, set_dir_usage_source
+from .models import FileWatcher, ListingBroadcaster
+from .search import SearchIndex
+from .catalog import Catalog
+from .usage import UsageIndex
+from .thumbnails import ThumbnailService
+from .hls import HlsService
+from .hashing import HashIndex
+from .uploads import ChunkedUploadManager, UploadRequest, UploadAdmission
+from .jobs import JobManager
+from .fileops import trash_folder, purge_trash
+from .metrics import instrument_app, JOBS_ACTIVE, UPLOAD_RESERVED
+from .compression import enable_compression
+from .throttle import TransferScheduler, enable_throttling
 
 # ================= Flask应用初始化 =================
 app = Flask(__name__, 
             template_folder='../templates',
             static_folder='static')
 app.config.from_object(Config)
+# 上传的文件边接收边写入磁盘
+app.request_class = UploadRequest
+# 记录各路由的耗时和流量，由 /metrics 输出
+instrument_app(app)
+# 上传下载限速和每个设备的并发传输数，目录列表等交互请求优先（在压缩之后执行，按实际大小计流量）
+transfer_scheduler = TransferScheduler()
+enable_throttling(app, transfer_scheduler)
+# 按客户端支持的算法压缩JSON和文本响应（在统计之前执行，统计的是实际发送的字节数）
+enable_compression(app)
 
 # SocketIO初始化
-socketio = SocketIO(app, cors_allowed_origins="*")
+socketio = SocketIO(app, cors_allowed_origins="*",
+                    async_mode='threading' if Config.SERVER_MODE == 'werkzeug' else Config.SERVER_MODE)
 
-# 初始化文件监控器
+# 初始化目录增量广播和文件监控器
+listing_broadcaster = ListingBroadcaster(socketio)
 file_watcher = FileWatcher(Config.UPLOAD_FOLDER, socketio)
 
+# 元数据目录，需在广播之前收到变化通知，广播时才不会读到过期的记录
+catalog = Catalog()
+file_watcher.add_listener(catalog.update_dirs)
+set_listing_source(catalog.list_dir)
+file_watcher.add_listener(listing_broadcaster.notify_many)
+
+# 文件夹累计占用，上传、删除和文件监控的变化都经由目录广播通知
+usage_index = UsageIndex()
+listing_broadcaster.add_listener(usage_index.update_dirs)
+set_dir_usage_source(usage_index.get)
+
+# 文件名搜索索引，由文件监控增量更新
+search_index = SearchIndex()
+file_watcher.add_listener(search_index.update_dirs)
+
+# 内容哈希索引，用于秒传和查找重复文件
+hash_index = HashIndex()
+file_watcher.add_listener(hash_index.update_dirs)
+hash_index.add_listener(catalog.set_hashes)
+
+# 缩略图，发现新图片时在后台预生成
+thumbnails = ThumbnailService(hash_index.digest)
+file_watcher.add_listener(thumbnails.pregenerate_dirs)
+
+# 视频边转码边播放，与缩略图共用内容指纹
+video_streams = HlsService(thumbnails.fingerprint)
+
+# 可续传的分块上传
+chunked_uploads = ChunkedUploadManager()
+
+# 上传准入控制，写入前确认磁盘空间和共享文件夹配额（配额按目录占用统计计算）
+upload_admission = UploadAdmission(lambda: usage_index.get('')[0] if usage_index.ready else None)
+UPLOAD_RESERVED.function = lambda: upload_admission.reserved
+
+# 后台任务（删除等耗时操作）
+jobs = JobManager(socketio)
+JOBS_ACTIVE.function = lambda: len(jobs.active())
+
 # 确保共享目录存在
 os.makedirs(Config.UPLOAD_FOLDER, exist_ok=True)
 
@@ -33,6 +114,12 @@ def exit_handler():
     """退出时的清理操作"""
     print("\n正在安全关闭服务...")
     file_watcher.stop()
+    catalog.stop()
+    usage_index.stop()
+    search_index.stop()
+    hash_index.stop()
+    thumbnails.stop()
+    video_streams.stop()
     print("资源清理完成")
     # 注意：不再清理共享文件夹中的文件
     os._exit(0)
@@ -52,8 +139,77 @@ def run_server(port):
     print(f"手机访问: http://{local_ip}:{port}")
     print(f"共享目录: {os.path.abspath(Config.UPLOAD_FOLDER)}\n")
     
-    # 启动文件监控
+    # 启动文件监控（共享目录可能在导入后被修改）
+    file_watcher.base_path = Config.UPLOAD_FOLDER
     file_watcher.start()
     
-    # 启动Flask服务器（不自动打开浏览器，由主程序控制）
-    socketio.run(app, host='0.0.0.0', port=port, debug=False, allow_unsafe_werkzeug=True)
\ No newline at end of file
+    # 打开元数据目录，后台与磁盘对账
+    catalog.start(Config.UPLOAD_FOLDER)
+    
+    # 后台并行统计文件夹占用
+    usage_index.start(Config.UPLOAD_FOLDER)
+    
+    # 后台加载或构建搜索索引
+    search_index.start(Config.UPLOAD_FOLDER)
+    
+    # 后台计算文件哈希
+    hash_index.start(Config.UPLOAD_FOLDER)
+    
+    # 加载缩略图缓存
+    thumbnails.start()
+    
+    # 加载视频转码片段缓存
+    video_streams.start()
+    
+    # 清理上次未完成的删除
+    if os.listdir(trash_folder()):
+        jobs.submit('purge', purge_trash, description='清理未完成的删除')
+    
+    # 启动服务器（不自动打开浏览器，由主程序控制）
+    if Config.SERVER_MODE == 'gevent':
+        _run_gevent(port)
+    elif Config.SERVER_MODE == 'eventlet':
+        _run_eventlet(port)
+    else:
+        socketio.run(app, host='0.0.0.0', port=port, debug=False, allow_unsafe_werkzeug=True)
+
+def _run_gevent(port):
+    """使用gevent协程服务器运行"""
+    from gevent import pywsgi
+    from gevent.pool import Pool
+    try:
+        from geventwebsocket.handler import WebSocketHandler as BaseHandler
+    except ImportError:
+        # 由simple_websocket提供WebSocket支持
+        BaseHandler = pywsgi.WSGIHandler
+    
+    class Handler(BaseHandler):
+        def handle(self):
+            # 空闲或卡住的连接超时后断开，不再占用并发名额
+            if Config.SERVER_KEEPALIVE:
+                self.socket.settimeout(Config.SERVER_KEEPALIVE)
+            super().handle()
+        
+        def read_request(self, raw_requestline):
+            result = super().read_request(raw_requestline)
+            if not Config.SERVER_KEEPALIVE:
+                self.close_connection = True
+            return result
+    
+    spawn = Pool(Config.SERVER_WORKERS) if Config.SERVER_WORKERS else 'default'
+    server = pywsgi.WSGIServer(('0.0.0.0', port), app, handler_class=Handler, spawn=spawn,
+                               backlog=Config.SERVER_BACKLOG, log=None)
+    print(f"使用gevent服务器，最大并发连接数: {Config.SERVER_WORKERS or '不限'}")
+    server.serve_forever()
+
+def _run_eventlet(port):
+    """使用eventlet协程服务器运行"""
+    import eventlet
+    import eventlet.wsgi
+    
+    sock = eventlet.listen(('0.0.0.0', port), backlog=Config.SERVER_BACKLOG)
+    print(f"使用eventlet服务器，最大并发连接数: {Config.SERVER_WORKERS or '不限'}")
+    eventlet.wsgi.server(sock, app, log_output=False,
+                         max_size=Config.SERVER_WORKERS or 1000000,
+                         keepalive=Config.SERVER_KEEPALIVE or False,
+                         socket_timeout=Config.SERVER_KEEPALIVE or None)
\ No newline at end of file
@@ -0,0 +1,336 @@
+import os
+import time
+import sqlite3
+import threading
+from .config import Config
+
+# 数据库结构版本，结构变化时递增以触发重建
+SCHEMA_VERSION = 1
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS entries (
+    path TEXT PRIMARY KEY,
+    parent TEXT NOT NULL,
+    name TEXT NOT NULL,
+    is_dir INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    hash TEXT
+);
+CREATE INDEX IF NOT EXISTS entries_parent ON entries(parent);
+CREATE TABLE IF NOT EXISTS dirs (
+    path TEXT PRIMARY KEY,
+    mtime_ns INTEGER NOT NULL
+);
+'''
+
+# 扫描多少个目录提交一次事务
+COMMIT_BATCH = 50
+
+
+def _join(rel_dir, name):
+    return os.path.join(rel_dir, name) if rel_dir else name
+
+
+def _subtree_range(rel_dir):
+    """目录下所有后代路径的范围 [low, high)，可直接利用主键索引"""
+    prefix = rel_dir + os.sep
+    return prefix, prefix[:-1] + chr(ord(os.sep) + 1)
+
+
+class Catalog:
+    """共享目录的元数据目录（SQLite，WAL模式）
+
+    保存每个文件和文件夹的大小、修改时间和内容哈希，以及每个目录扫描时的
+    mtime。目录的mtime与记录一致时，列表直接由索引查询得到，无需读取目录；
+    文件监控通知变化的目录由后台线程重新扫描，另外定期与磁盘对账。启动时
+    先stat已知的目录，不必等待遍历整个目录树；原地改写文件不会改变目录的
+    mtime，对账时在后台逐项核对每个目录中的条目。
+    """
+
+    def __init__(self):
+        self.base_path = None
+        self.db_file = None
+        self.ready = False
+        self.running = False
+        self.thread = None
+        # 写连接只在持有lock时使用；读连接单独一个，WAL模式下读写互不阻塞
+        self.lock = threading.Lock()
+        self.read_lock = threading.Lock()
+        # 保护待扫描目录和失效目录（不能用写锁，扫描期间也要能及时响应）
+        self.state_lock = threading.Lock()
+        self._writer = None
+        self._reader = None
+        self._event = threading.Event()
+        self._pending = set()
+        # 已收到变化通知但尚未重新扫描的目录 -> 通知次数，期间不使用记录的列表
+        self._stale = {}
+
+    # ================= 生命周期 =================
+    def start(self, base_path):
+        """打开数据库并启动后台同步线程"""
+        if self.running or not Config.CATALOG_ENABLED:
+            return
+        self.base_path = os.path.normpath(os.path.abspath(base_path))
+        self.db_file = Config.share_data_path('catalog.sqlite3')
+        try:
+            self._writer = self._connect()
+            self._init_schema()
+            self._reader = self._connect()
+        except sqlite3.Error as e:
+            print(f"元数据目录打开失败，将直接读取磁盘: {e}")
+            return
+        self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """停止后台线程并关闭数据库"""
+        if not self.running:
+            return
+        self.running = False
+        self._event.set()
+        if self.thread:
+            self.thread.join()
+        with self.lock:
+            self._writer.close()
+        with self.read_lock:
+            self._reader.close()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_file, timeout=30, isolation_level=None, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    def _init_schema(self):
+        conn = self._writer
+        version = conn.execute('PRAGMA user_version').fetchone()[0]
+        if version != SCHEMA_VERSION:
+            conn.execute('DROP TABLE IF EXISTS entries')
+            conn.execute('DROP TABLE IF EXISTS dirs')
+        conn.executescript(SCHEMA)
+        conn.execute(f'PRAGMA user_version={SCHEMA_VERSION}')
+
+    def _run(self):
+        try:
+            self.reconcile()
+        except Exception as e:
+            print(f"元数据目录同步出错: {e}")
+        self.ready = True
+        last_reconcile = time.monotonic()
+        while self.running:
+            timeout = max(0.0, last_reconcile + Config.CATALOG_RECONCILE_INTERVAL - time.monotonic())
+            self._event.wait(timeout)
+            self._event.clear()
+            if not self.running:
+                break
+            with self.state_lock:
+                rel_dirs, self._pending = self._pending, set()
+                stale = dict(self._stale)
+            try:
+                with self.lock:
+                    for rel_dir in sorted(rel_dirs):
+                        self._add_tree(rel_dir)
+                if time.monotonic() - last_reconcile >= Config.CATALOG_RECONCILE_INTERVAL:
+                    self.reconcile()
+                    last_reconcile = time.monotonic()
+            except Exception as e:
+                print(f"元数据目录同步出错: {e}")
+            with self.state_lock:
+                # 扫描期间又收到通知的目录保持失效，等待下一轮
+                for rel_dir, count in stale.items():
+                    if self._stale.get(rel_dir) == count:
+                        del self._stale[rel_dir]
+
+    # ================= 同步 =================
+    def update_dirs(self, rel_dirs):
+        """目录发生变化（文件监控回调），立即停止使用其记录并安排重新扫描"""
+        if not self.running:
+            return
+        with self.state_lock:
+            for rel_dir in rel_dirs:
+                self._stale[rel_dir] = self._stale.get(rel_dir, 0) + 1
+            self._pending.update(rel_dirs)
+        self._event.set()
+
+    def reconcile(self):
+        """与磁盘对账：先重新扫描mtime与记录不一致的目录，再逐项核对其余目录，目录为空时全量构建"""
+        started = time.time()
+        with self.read_lock:
+            known = self._reader.execute('SELECT path, mtime_ns FROM dirs').fetchall()
+            # 上次构建中途退出时，已记录但尚未扫描的子目录
+            unscanned = [row[0] for row in self._reader.execute(
+                'SELECT entries.path FROM entries LEFT JOIN dirs ON dirs.path = entries.path '
+                'WHERE entries.is_dir = 1 AND dirs.path IS NULL')]
+        if not any(rel_dir == '' for rel_dir, _ in known):
+            with self.lock:
+                count = self._add_tree('')
+            print(f"元数据目录构建完成: {count} 个目录，用时 {time.time() - started:.1f} 秒")
+            return
+        changed = unscanned
+        for rel_dir, mtime_ns in known:
+            if not self.running:
+                return
+            try:
+                if os.stat(os.path.join(self.base_path, rel_dir)).st_mtime_ns == mtime_ns:
+                    continue
+            except OSError:
+                pass
+            changed.append(rel_dir)
+        with self.lock:
+            for rel_dir in sorted(changed):
+                self._add_tree(rel_dir)
+        changed = set(changed)
+        self._verify_dirs(sorted(rel_dir for rel_dir, _ in known if rel_dir not in changed))
+
+    def _verify_dirs(self, rel_dirs):
+        """重新扫描mtime未变的目录，只更新与磁盘不一致的条目
+
+        文件被原地改写（或在服务停止期间被修改）时目录的mtime不变，只比较目录
+        mtime发现不了。每批目录单独一个事务，批次之间释放锁。
+        """
+        conn = self._writer
+        for start in range(0, len(rel_dirs), COMMIT_BATCH):
+            if not self.running:
+                return
+            with self.lock:
+                new_dirs = []
+                conn.execute('BEGIN')
+                try:
+                    for rel_dir in rel_dirs[start:start + COMMIT_BATCH]:
+                        new_dirs.extend(self._update_dir(rel_dir))
+                    conn.execute('COMMIT')
+                except BaseException:
+                    conn.execute('ROLLBACK')
+                    raise
+                # 核对期间新出现的子目录
+                for rel_dir in new_dirs:
+                    self._add_tree(rel_dir)
+            time.sleep(0)
+
+    def _add_tree(self, rel_dir):
+        """重新扫描目录，并递归扫描其中新出现的子目录，返回扫描的目录数（需持有lock）"""
+        conn = self._writer
+        stack = [rel_dir]
+        count = 0
+        conn.execute('BEGIN')
+        try:
+            while stack:
+                stack.extend(self._update_dir(stack.pop()))
+                count += 1
+                if count % COMMIT_BATCH == 0:
+                    conn.execute('COMMIT')
+                    # 让出执行权，协程服务器模式下构建目录时不会长时间阻塞请求
+                    time.sleep(0)
+                    if not self.running:
+                        return count
+                    conn.execute('BEGIN')
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        return count
+
+    def _update_dir(self, rel_dir):
+        """扫描单个目录的直接子项并更新记录，返回新出现的子目录"""
+        conn = self._writer
+        abs_dir = os.path.join(self.base_path, rel_dir) if rel_dir else self.base_path
+        current = {}
+        try:
+            mtime_ns = os.stat(abs_dir).st_mtime_ns
+            with os.scandir(abs_dir) as entries:
+                for entry in entries:
+                    if not rel_dir and entry.name == Config.INTERNAL_FOLDER_NAME:
+                        continue
+                    try:
+                        is_dir = entry.is_dir()
+                        stat = entry.stat()
+                    except OSError:
+                        continue
+                    current[entry.name] = (int(is_dir), 0 if is_dir else stat.st_size, stat.st_mtime_ns)
+        except OSError:
+            # 目录已被删除或移走，其自身的条目由父目录的扫描负责移除
+            self._delete_tree(rel_dir)
+            return []
+
+        existing = {row[0]: tuple(row[1:]) for row in conn.execute(
+            'SELECT name, is_dir, size, mtime_ns FROM entries WHERE parent = ?', (rel_dir,))}
+        for name, record in existing.items():
+            if name not in current or current[name][0] != record[0]:
+                path = _join(rel_dir, name)
+                conn.execute('DELETE FROM entries WHERE path = ?', (path,))
+                if record[0]:
+                    self._delete_tree(path)
+
+        new_dirs = []
+        for name, record in current.items():
+            old = existing.get(name)
+            if old == record:
+                continue
+            path = _join(rel_dir, name)
+            if old is not None and old[0] == record[0]:
+                # 内容可能已变化，哈希作废
+                conn.execute('UPDATE entries SET size = ?, mtime_ns = ?, hash = NULL WHERE path = ?',
+                             (record[1], record[2], path))
+            else:
+                conn.execute('INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, NULL)',
+                             (path, rel_dir, name) + record)
+                if record[0]:
+                    new_dirs.append(path)
+
+        # 最近一秒内修改过的目录，同一时间戳内可能还有后续修改，记录为无效，使用时会重新扫描
+        if time.time() - mtime_ns / 1e9 <= 1:
+            mtime_ns = -1
+        conn.execute('INSERT OR REPLACE INTO dirs VALUES (?, ?)', (rel_dir, mtime_ns))
+        return new_dirs
+
+    def _delete_tree(self, rel_dir):
+        """删除目录下的所有记录"""
+        conn = self._writer
+        if not rel_dir:
+            conn.execute('DELETE FROM entries')
+            conn.execute('DELETE FROM dirs')
+            return
+        low, high = _subtree_range(rel_dir)
+        conn.execute('DELETE FROM entries WHERE path >= ? AND path < ?', (low, high))
+        conn.execute('DELETE FROM dirs WHERE path = ? OR (path >= ? AND path < ?)', (rel_dir, low, high))
+
+    def set_hashes(self, records):
+        """记录文件的内容哈希（哈希索引回调），records为 (相对路径, 大小, mtime_ns, 哈希)"""
+        if not self.running or not records:
+            return
+        with self.lock:
+            conn = self._writer
+            conn.execute('BEGIN')
+            conn.executemany('UPDATE entries SET hash = ? WHERE path = ? AND size = ? AND mtime_ns = ?',
+                             [(digest, path, size, mtime_ns) for path, size, mtime_ns, digest in records])
+            conn.execute('COMMIT')
+
+    # ================= 查询 =================
+    def list_dir(self, base_path, rel_dir, mtime_ns):
+        """目录的记录与磁盘一致时返回 [(名称, 是否文件夹, 大小, mtime_ns)]，否则返回None"""
+        if not self.running or os.path.normpath(base_path) != self.base_path:
+            return None
+        if rel_dir in self._stale:
+            return None
+        with self.read_lock:
+            conn = self._reader
+            conn.execute('BEGIN')
+            try:
+                row = conn.execute('SELECT mtime_ns FROM dirs WHERE path = ?', (rel_dir,)).fetchone()
+                if row is None or row[0] != mtime_ns:
+                    rows = None
+                else:
+                    rows = conn.execute('SELECT name, is_dir, size, mtime_ns FROM entries WHERE parent = ?',
+                                        (rel_dir,)).fetchall()
+            finally:
+                conn.execute('COMMIT')
+        if rows is None:
+            if row is not None and self.ready:
+                # 记录已过期（例如未被监控到的修改），安排重新扫描
+                with self.state_lock:
+                    self._pending.add(rel_dir)
+                self._event.set()
+            return None
+        return rows
\ No newline at end of file
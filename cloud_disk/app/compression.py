@@ -0,0 +1,182 @@
+import gzip
+import zlib
+import hashlib
+import threading
+from itertools import chain
+from collections import OrderedDict
+from flask import request
+from .config import Config
+from .metrics import cache_result
+
+# 可选的压缩算法，未安装对应的包时不参与协商
+try:
+    import brotli
+except ImportError:
+    try:
+        import brotlicffi as brotli
+    except ImportError:
+        brotli = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+def available_encodings():
+    """按优先顺序列出可用的压缩算法（客户端同样接受时优先使用靠前的）"""
+    encodings = []
+    if zstandard is not None:
+        encodings.append('zstd')
+    if brotli is not None:
+        encodings.append('br')
+    encodings.append('gzip')
+    return [e for e in encodings if e in Config.COMPRESS_ENCODINGS]
+
+
+def compress(data, encoding):
+    level = Config.COMPRESS_LEVELS.get(encoding)
+    if encoding == 'zstd':
+        return zstandard.ZstdCompressor(level=level or 3).compress(data)
+    if encoding == 'br':
+        return brotli.compress(data, quality=level if level is not None else 4)
+    return gzip.compress(data, compresslevel=level or 6, mtime=0)
+
+
+class _Compressor:
+    """流式压缩，统一各算法的接口"""
+
+    def __init__(self, encoding):
+        level = Config.COMPRESS_LEVELS.get(encoding)
+        self.encoding = encoding
+        if encoding == 'zstd':
+            self.obj = zstandard.ZstdCompressor(level=level or 3).compressobj()
+        elif encoding == 'br':
+            self.obj = brotli.Compressor(quality=level if level is not None else 4)
+        else:
+            self.obj = zlib.compressobj(level or 6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data):
+        if self.encoding == 'br':
+            return self.obj.process(data)
+        return self.obj.compress(data)
+
+    def flush(self):
+        if self.encoding == 'br':
+            return self.obj.finish()
+        return self.obj.flush()
+
+
+def _compress_stream(chunks, encoding):
+    compressor = _Compressor(encoding)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+class CompressedCache:
+    """未变化的目录列表复用压缩结果
+
+    键为 (请求路径和参数, 压缩算法)，值记录目录版本号和原始内容的摘要。文件夹
+    累计大小等变化不会增加目录版本号，所以命中还要求摘要一致；计算摘要比重新
+    压缩快得多。
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.total_size = 0
+
+    def get(self, key, version, digest):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] != version or entry[1] != digest:
+                return None
+            self.entries.move_to_end(key)
+            return entry[2]
+
+    def put(self, key, version, digest, body):
+        if len(body) > Config.COMPRESS_CACHE_MAX_BYTES // 4:
+            return
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.total_size -= len(old[2])
+            self.entries[key] = (version, digest, body)
+            self.total_size += len(body)
+            while self.total_size > Config.COMPRESS_CACHE_MAX_BYTES:
+                _, removed = self.entries.popitem(last=False)
+                self.total_size -= len(removed[2])
+
+
+compressed_cache = CompressedCache()
+
+
+def _compressible(response):
+    if (request.method == 'HEAD' or response.status_code != 200 or
+            response.direct_passthrough or 'Content-Encoding' in response.headers):
+        return False
+    # 文件下载和图片、视频、音频等预览走Range/sendfile（直通响应），不在这里压缩
+    mimetype = response.mimetype or ''
+    if mimetype == 'text/event-stream':
+        return False
+    return mimetype in Config.COMPRESS_MIMETYPES or mimetype.startswith('text/')
+
+
+def _compressed_body(body, encoding, version):
+    """压缩完整的响应体，带目录版本号的列表响应使用缓存"""
+    if version is None:
+        return compress(body, encoding)
+    key = (request.full_path, encoding)
+    digest = hashlib.blake2b(body, digest_size=16).digest()
+    compressed = compressed_cache.get(key, version, digest)
+    cache_result('compressed_listing', compressed is not None)
+    if compressed is None:
+        compressed = compress(body, encoding)
+        compressed_cache.put(key, version, digest, compressed)
+    return compressed
+
+
+def enable_compression(app):
+    """根据Accept-Encoding压缩JSON和文本响应（gzip，安装了brotli/zstandard时还支持br/zstd）"""
+
+    @app.after_request
+    def _compress_response(response):
+        if not Config.COMPRESS_ENABLED or not _compressible(response):
+            return response
+        response.vary.add('Accept-Encoding')
+        encoding = request.accept_encodings.best_match(available_encodings())
+        if encoding is None:
+            return response
+        version = response.headers.get('X-Dir-Version')
+
+        if response.is_sequence:
+            body = response.get_data()
+            if len(body) < Config.COMPRESS_MIN_SIZE:
+                return response
+            response.set_data(_compressed_body(body, encoding, version))
+            response.headers['Content-Encoding'] = encoding
+            return response
+
+        # 流式响应（大目录列表）: 只预读一小段，读完时整体压缩并缓存，否则边生成边压缩，
+        # 不把整个列表读入内存
+        chunks = response.iter_encoded()
+        buffered = []
+        size = 0
+        for chunk in chunks:
+            buffered.append(chunk)
+            size += len(chunk)
+            if size > Config.COMPRESS_BUFFER_MAX:
+                break
+        else:
+            body = b''.join(buffered)
+            if size >= Config.COMPRESS_MIN_SIZE:
+                body = _compressed_body(body, encoding, version)
+                response.headers['Content-Encoding'] = encoding
+            response.set_data(body)
+            return response
+        response.response = _compress_stream(chain(buffered, chunks), encoding)
+        response.headers.pop('Content-Length', None)
+        response.headers['Content-Encoding'] = encoding
+        return response
\ No newline at end of file
@@ -1,5 +1,6 @@
 import os
 import sys
+import hashlib
 
 # 路径转换，用于打包后寻找资源
 def resource_path(relative_path):
@@ -26,6 +27,171 @@ class Config:
     # 文件清理间隔(秒)
     CLEANUP_INTERVAL = 3600
     
+    # 文件监控方式: auto(Linux下使用inotify) / polling
+    WATCHER_BACKEND = 'auto'
+    # 事件防抖时间(秒)，一批变化在此时间内无新事件后才通知
+    WATCHER_DEBOUNCE = 0.3
+    # 持续有事件时的最大通知延迟(秒)
+    WATCHER_MAX_DELAY = 2.0
+    # 轮询方式的检查间隔(秒)
+    WATCHER_POLL_INTERVAL = 1
+    
+    # 目录列表缓存的最大目录数
+    LISTING_CACHE_SIZE = 256
+    
+    # 分页列表的默认/最大每页条目数
+    LISTING_PAGE_SIZE = 200
+    LISTING_PAGE_MAX = 2000
+    
+    # 文件类型分类（与前端侧边栏一致）
+    FILE_TYPES = {
+        'image': {'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp'},
+        'video': {'.mp4', '.avi', '.mov', '.wmv', '.mkv', '.flv'},
+        'audio': {'.mp3', '.wav', '.flac', '.aac', '.ogg'},
+        'document': {'.txt', '.doc', '.docx', '.pdf', '.xls', '.xlsx', '.ppt', '.pptx'},
+    }
+    
+    # 共享目录内的内部文件夹（上传暂存等需要与目标文件同一文件系统的数据），不在列表中显示
+    INTERNAL_FOLDER_NAME = '.cloud_disk'
+    
+    # 分块上传: 单块最大大小、未完成上传的保留时间(秒)
+    CHUNKED_UPLOAD_MAX_CHUNK = 64 * 1024 * 1024
+    CHUNKED_UPLOAD_EXPIRE = 7 * 24 * 3600
+    
+    # 上传写入: 接收线程与写盘线程之间的队列长度（每项约1MB）、小于该大小的数据直接在接收线程写入
+    UPLOAD_WRITE_QUEUE = 16
+    UPLOAD_QUEUE_MIN_SIZE = 4 * 1024 * 1024
+    # 是否用posix_fallocate预先分配磁盘空间（不支持的文件系统自动退回稀疏文件）
+    UPLOAD_PREALLOCATE = True
+    # 写盘同步策略: none 交给操作系统; commit 文件移动到最终位置前同步一次;
+    # interval 另外每写入UPLOAD_FSYNC_INTERVAL_BYTES同步一次，避免提交时集中写盘
+    UPLOAD_FSYNC = 'commit'
+    UPLOAD_FSYNC_INTERVAL_BYTES = 64 * 1024 * 1024
+    # 上传文件夹时每批同步并移动到位的文件数
+    UPLOAD_FSYNC_BATCH_FILES = 64
+    # 上传准入: 磁盘至少保留的可用空间、共享文件夹配额(0为不限制)、
+    # 空间暂时被其他进行中的上传占用时的最长等待时间(秒)
+    UPLOAD_MIN_FREE_BYTES = 512 * 1024 * 1024
+    SHARE_QUOTA_BYTES = 0
+    UPLOAD_ADMISSION_WAIT = 30
+    
+    # 程序数据目录（索引、缓存等，不放在共享目录内）
+    DATA_FOLDER = os.path.abspath('cloud_disk_data')
+    
+    # 搜索索引自动保存间隔(秒)及单次查询最大结果数
+    SEARCH_INDEX_SAVE_INTERVAL = 60
+    SEARCH_MAX_RESULTS = 500
+    # 参与排序的最大匹配数，超出时结果标记为不完整
+    SEARCH_RANK_LIMIT = 20000
+    
+    # 文本预览: 缓存分页索引的文件数、每页最大字节数（超长行会被截断）
+    TEXT_INDEX_CACHE_SIZE = 32
+    TEXT_PAGE_MAX_BYTES = 1024 * 1024
+    # 实时跟踪: 初始显示的行数、检查文件变化的间隔(秒)
+    TEXT_TAIL_LINES = 100
+    TEXT_TAIL_INTERVAL = 0.5
+    
+    # 元数据目录（SQLite）: 是否启用（关闭后目录列表总是直接读取磁盘）、定期与磁盘对账的间隔(秒)
+    CATALOG_ENABLED = True
+    CATALOG_RECONCILE_INTERVAL = 600
+    
+    # 目录占用统计: 启动时并行扫描目录树的线程数
+    USAGE_SCAN_WORKERS = min(16, (os.cpu_count() or 2) * 2)
+    
+    # 后台任务: 进度推送的最小间隔(秒)、已结束任务的保留时间(秒)
+    JOB_PROGRESS_INTERVAL = 0.5
+    JOB_KEEP_SECONDS = 3600
+    # 删除文件夹时并行删除的线程数
+    DELETE_WORKERS = 8
+    # 同时运行的复制/跨磁盘移动任务数，其余排队等待
+    JOB_MAX_CONCURRENT = 2
+    
+    # 内容哈希索引（秒传和查找重复文件）: 是否启用、分块大小（需与网页端一致）、自动保存间隔(秒)
+    HASH_INDEX_ENABLED = True
+    HASH_CHUNK_SIZE = 4 * 1024 * 1024
+    HASH_INDEX_SAVE_INTERVAL = 60
+    # 秒传时允许使用硬链接（两个路径共享同一份数据，修改一个会影响另一个）
+    DEDUP_HARDLINK = False
+    
+    # 缩略图: 支持的格式、预设尺寸(像素)、图标视图使用的尺寸
+    THUMBNAIL_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp'}
+    THUMBNAIL_SIZES = (256, 1280)
+    THUMBNAIL_DEFAULT_SIZE = 256
+    THUMBNAIL_QUALITY = 80
+    # 生成缩略图的进程数、单个缩略图的最长等待时间(秒)
+    THUMBNAIL_WORKERS = max(1, min(4, (os.cpu_count() or 2) - 1))
+    THUMBNAIL_TIMEOUT = 30
+    # 缩略图缓存的最大总大小
+    THUMBNAIL_CACHE_MAX_BYTES = 512 * 1024 * 1024
+    # 发现新图片时是否在后台预生成缩略图
+    THUMBNAIL_PREGENERATE = True
+    
+    # 视频边转码边播放（HLS，需安装ffmpeg）: 是否启用、ffmpeg和ffprobe的路径
+    HLS_ENABLED = True
+    FFMPEG_PATH = 'ffmpeg'
+    FFPROBE_PATH = 'ffprobe'
+    # 可以转码播放的视频格式
+    HLS_EXTENSIONS = {'.mp4', '.avi', '.mov', '.wmv', '.mkv', '.flv', '.webm', '.m4v', '.ts', '.mpg', '.mpeg', '.3gp'}
+    # 每个片段的时长(秒)、输出的最大高度(像素)、视频最大码率、x264编码速度和质量
+    HLS_SEGMENT_SECONDS = 6
+    HLS_MAX_HEIGHT = 720
+    HLS_VIDEO_MAXRATE = '2500k'
+    HLS_PRESET = 'veryfast'
+    HLS_CRF = 23
+    # 同时运行的ffmpeg进程数、播放时提前转码的片段数、单个片段的最长转码时间(秒)
+    HLS_WORKERS = 2
+    HLS_PREFETCH_SEGMENTS = 1
+    HLS_SEGMENT_TIMEOUT = 120
+    # 转码片段缓存的最大总大小
+    HLS_CACHE_MAX_BYTES = 2 * 1024 * 1024 * 1024
+    
+    # 打包下载: 这些已压缩的格式直接存储，不再压缩；其他文件的压缩级别(1最快)
+    ZIP_STORE_EXTENSIONS = {
+        '.jpg', '.jpeg', '.png', '.gif', '.webp', '.heic',
+        '.mp4', '.avi', '.mov', '.wmv', '.mkv', '.flv', '.webm',
+        '.mp3', '.flac', '.aac', '.ogg', '.m4a',
+        '.zip', '.rar', '.7z', '.gz', '.bz2', '.xz', '.zst',
+        '.docx', '.xlsx', '.pptx', '.pdf', '.apk', '.iso',
+    }
+    ZIP_COMPRESS_LEVEL = 1
+    
+    # 服务器模式: werkzeug(默认，无需额外依赖) / gevent / eventlet（需安装对应的包）
+    SERVER_MODE = os.environ.get('CLOUD_DISK_SERVER_MODE', 'werkzeug')
+    # 协程服务器: 最大并发连接数(0为不限制)，超出后新连接在监听队列中等待
+    SERVER_WORKERS = 1000
+    # 长连接空闲超时(秒)，0为禁用长连接
+    SERVER_KEEPALIVE = 75
+    # 监听队列长度
+    SERVER_BACKLOG = 1024
+    
+    # 传输限速(字节/秒，0为不限制): 所有设备合计、单个设备（按IP），上传和下载分别计算
+    TRANSFER_RATE_TOTAL = 0
+    TRANSFER_RATE_PER_CLIENT = 0
+    # 令牌桶容量（按多少秒的流量计），允许短时突发
+    TRANSFER_BURST_SECONDS = 0.5
+    # 单个设备同时进行的大文件传输数（下载、打包下载、视频、上传），超出的排队等待，0为不限制
+    TRANSFER_MAX_PER_CLIENT = 4
+    # 排队的最长等待时间(秒)，超时返回429
+    TRANSFER_QUEUE_TIMEOUT = 60
+    
+    # 响应压缩（JSON和文本）: 是否启用、可用算法（br需安装brotli，zstd需安装zstandard）、各算法的压缩级别
+    COMPRESS_ENABLED = True
+    COMPRESS_ENCODINGS = ('zstd', 'br', 'gzip')
+    COMPRESS_LEVELS = {'gzip': 6, 'br': 4, 'zstd': 3}
+    # 小于该大小的响应不压缩
+    COMPRESS_MIN_SIZE = 1024
+    # 除text/*外需要压缩的类型（图片、视频等已压缩的格式不在其中）
+    COMPRESS_MIMETYPES = {'application/json', 'application/javascript', 'application/xml', 'image/svg+xml'}
+    # 流式响应（大目录列表）最多预读的大小：不超过时整体压缩并缓存，超过时边生成边压缩，
+    # 首字节时间和内存占用不随列表大小增长
+    COMPRESS_BUFFER_MAX = 256 * 1024
+    # 目录列表压缩结果的缓存总大小
+    COMPRESS_CACHE_MAX_BYTES = 64 * 1024 * 1024
+    
+    # 请求性能分析（通过 /metrics/profile 在运行时开启）: 保留的结果数、每条结果显示的函数数
+    PROFILE_KEEP = 50
+    PROFILE_TOP_FUNCTIONS = 30
+    
     # 最大上传文件大小 (100GB)
     MAX_CONTENT_LENGTH = 100 * 1024 * 1024 * 1024
     
@@ -38,4 +204,19 @@ class Config:
         if os.path.exists(path) and os.path.isdir(path):
             cls.UPLOAD_FOLDER = os.path.abspath(path)
             return True
-        return False
\ No newline at end of file
+        return False
+    
+    @classmethod
+    def internal_path(cls, name):
+        """共享目录内部文件夹下的子目录（自动创建）"""
+        folder = os.path.join(cls.UPLOAD_FOLDER, cls.INTERNAL_FOLDER_NAME, name)
+        os.makedirs(folder, exist_ok=True)
+        return folder
+    
+    @classmethod
+    def share_data_path(cls, name):
+        """当前共享目录专属的数据文件路径（不同共享目录的数据互不干扰）"""
+        share_id = hashlib.md5(os.path.abspath(cls.UPLOAD_FOLDER).encode('utf-8')).hexdigest()[:12]
+        folder = os.path.join(cls.DATA_FOLDER, share_id)
+        os.makedirs(folder, exist_ok=True)
+        return os.path.join(folder, name)
\ No newline at end of file
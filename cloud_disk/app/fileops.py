@@ -0,0 +1,387 @@
+import os
+import stat
+import uuid
+import errno
+import shutil
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from .config import Config
+
+# Linux下的FICLONE ioctl（btrfs/xfs等支持写时复制的文件系统）
+FICLONE = 0x40049409
+# 复制文件时每次复制的大小（两次之间检查取消并更新进度）
+COPY_CHUNK = 16 * 1024 * 1024
+
+
+def is_valid_name(name):
+    """文件名是否合法（不含路径分隔符）"""
+    return bool(name) and name not in ('.', '..') and not any(c in name for c in '/\\\0')
+
+
+def unique_name(folder, name, taken=()):
+    """目标文件夹中已有同名项（或名称在taken中）时，生成“名称 - 副本”形式的新名称"""
+    def exists(candidate):
+        return candidate in taken or os.path.lexists(os.path.join(folder, candidate))
+    
+    if not exists(name):
+        return name
+    stem, ext = os.path.splitext(name)
+    if os.path.isdir(os.path.join(folder, name)):
+        stem, ext = name, ''
+    candidate = f'{stem} - 副本{ext}'
+    n = 2
+    while exists(candidate):
+        candidate = f'{stem} - 副本 ({n}){ext}'
+        n += 1
+    return candidate
+
+
+def _is_inside(path, folder):
+    """path是否就是folder或位于folder之中（均为/分隔的相对路径）"""
+    return path == folder or path.startswith(folder + '/')
+
+
+def trash_folder():
+    """删除暂存区（共享目录的内部文件夹中，与待删除内容在同一文件系统，移动是瞬间完成的）"""
+    return Config.internal_path('trash')
+
+
+def stage_delete(rel_paths):
+    """把要删除的路径移入暂存区，返回 (本批次的暂存目录, [(暂存路径, 原相对路径)], 错误列表)
+
+    移入后立即从列表中消失；无法移动的（例如挂载点）保留原路径，在后台原地删除。
+    """
+    batch_dir = os.path.join(trash_folder(), uuid.uuid4().hex)
+    os.makedirs(batch_dir)
+    staged = []
+    errors = []
+    for i, rel_path in enumerate(rel_paths):
+        abs_path = os.path.join(Config.UPLOAD_FOLDER, rel_path)
+        if not os.path.lexists(abs_path):
+            errors.append(f'文件或文件夹不存在: {rel_path}')
+            continue
+        staged_path = os.path.join(batch_dir, str(i))
+        try:
+            os.rename(abs_path, staged_path)
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                errors.append(f'删除失败 {rel_path}: {e}')
+                continue
+            staged_path = abs_path
+        staged.append((staged_path, rel_path))
+    return batch_dir, staged, errors
+
+
+def _unlink(path):
+    try:
+        os.unlink(path)
+    except PermissionError:
+        # Windows下只读文件需要先去掉只读属性
+        os.chmod(path, stat.S_IWRITE)
+        os.unlink(path)
+
+
+def _clear_dir(job, path):
+    """删除目录中的文件，返回子目录列表（目录本身留到最后按深度删除）"""
+    subdirs = []
+    files = 0
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if job.cancelled:
+                    break
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append(entry.path)
+                        continue
+                    _unlink(entry.path)
+                    files += 1
+                except OSError as e:
+                    job.add_error(f'删除失败 {entry.name}: {e}')
+    except OSError as e:
+        job.add_error(f'读取文件夹失败 {os.path.basename(path)}: {e}')
+    job.add_progress(done=files, total=files + len(subdirs))
+    return subdirs
+
+
+def delete_paths(job, paths, workers=None):
+    """并行删除文件和目录树
+
+    每个目录作为一个任务，删除其中的文件并提交子目录，多个线程同时等待磁盘；
+    全部文件删除后再自深而浅删除空目录。取消时尽快停止。
+    """
+    workers = workers or Config.DELETE_WORKERS
+    dirs = []
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {}
+        for path in paths:
+            if os.path.isdir(path) and not os.path.islink(path):
+                dirs.append(path)
+                futures[pool.submit(_clear_dir, job, path)] = path
+                job.add_progress(total=1)
+            else:
+                job.add_progress(total=1)
+                try:
+                    _unlink(path)
+                    job.add_progress(done=1)
+                except FileNotFoundError:
+                    job.add_progress(done=1)
+                except OSError as e:
+                    job.add_error(f'删除失败 {os.path.basename(path)}: {e}')
+        while futures:
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                del futures[future]
+                for subdir in future.result():
+                    dirs.append(subdir)
+                    if not job.cancelled:
+                        futures[pool.submit(_clear_dir, job, subdir)] = subdir
+            job.on_progress()
+    if job.cancelled:
+        return
+    for path in sorted(dirs, key=lambda p: p.count(os.sep), reverse=True):
+        try:
+            os.rmdir(path)
+            job.add_progress(done=1)
+        except OSError as e:
+            job.add_error(f'删除文件夹失败 {os.path.basename(path)}: {e}')
+
+
+def delete_job(job, batch_dir, staged, notify):
+    """删除任务：并行删除暂存的内容；取消时恢复剩余内容并通知所在目录"""
+    delete_paths(job, [staged_path for staged_path, _ in staged])
+    if job.cancelled:
+        for error in restore_staged(staged):
+            job.add_error(error)
+        notify(os.path.dirname(rel_path) for _, rel_path in staged)
+        return '已取消删除，尚未删除的内容已恢复'
+    try:
+        os.rmdir(batch_dir)
+    except OSError:
+        pass
+    return f'成功删除 {len(staged)} 个文件/文件夹'
+
+
+def clone_fd(src_fd, dst_fd):
+    """写时复制（reflink，不占额外空间），文件系统不支持时返回False"""
+    try:
+        import fcntl
+    except ImportError:
+        return False
+    try:
+        fcntl.ioctl(dst_fd, FICLONE, src_fd)
+        return True
+    except OSError:
+        return False
+
+
+def copy_file(src_path, dst_path, job=None):
+    """复制单个文件，取消时返回False
+
+    依次尝试：写时复制、copy_file_range（数据不经过用户态，网络文件系统上可由
+    服务器端完成复制）、普通读写。
+    """
+    with open(src_path, 'rb', buffering=0) as src, open(dst_path, 'wb', buffering=0) as dst:
+        src_fd, dst_fd = src.fileno(), dst.fileno()
+        if clone_fd(src_fd, dst_fd):
+            if job is not None:
+                job.add_progress(done=os.fstat(src_fd).st_size)
+            return True
+        use_range = hasattr(os, 'copy_file_range')
+        buffer = None
+        while True:
+            if job is not None and job.cancelled:
+                return False
+            copied = None
+            if use_range:
+                try:
+                    copied = os.copy_file_range(src_fd, dst_fd, COPY_CHUNK)
+                except OSError:
+                    # 不支持（例如旧内核跨文件系统），从当前位置继续普通读写
+                    use_range = False
+            if copied is None:
+                if buffer is None:
+                    buffer = bytearray(1024 * 1024)
+                copied = src.readinto(buffer)
+                if copied:
+                    view = memoryview(buffer)[:copied]
+                    while view:
+                        view = view[dst.write(view):]
+            if not copied:
+                return True
+            if job is not None:
+                job.add_progress(done=copied)
+                job.on_progress()
+
+
+def _tree_size(path):
+    """文件或目录树的总大小"""
+    if not os.path.isdir(path) or os.path.islink(path):
+        try:
+            return os.lstat(path).st_size
+        except OSError:
+            return 0
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                pass
+    return total
+
+
+def _copy_tree(job, src, dst):
+    """复制文件或目录树（保留修改时间），取消时返回False
+
+    任何一个文件复制失败都抛出OSError，不会把缺少内容的目录树当作复制完成。
+    """
+    if os.path.islink(src):
+        os.symlink(os.readlink(src), dst)
+        return True
+    if not os.path.isdir(src):
+        if not copy_file(src, dst, job):
+            return False
+        shutil.copystat(src, dst)
+        return True
+    os.mkdir(dst)
+    with os.scandir(src) as entries:
+        names = [entry.name for entry in entries]
+    for name in names:
+        if job.cancelled:
+            return False
+        if not _copy_tree(job, os.path.join(src, name), os.path.join(dst, name)):
+            return False
+    try:
+        shutil.copystat(src, dst)
+    except OSError:
+        pass
+    return True
+
+
+def _remove(path):
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path)
+    else:
+        _unlink(path)
+
+
+def plan_copy(rel_paths, target_dir):
+    """检查复制请求，返回 ([(源相对路径, 目标相对路径)], 错误列表)，同名时自动改名"""
+    target_abs = os.path.join(Config.UPLOAD_FOLDER, target_dir)
+    items = []
+    errors = []
+    taken = set()
+    for rel_path in rel_paths:
+        if not os.path.lexists(os.path.join(Config.UPLOAD_FOLDER, rel_path)):
+            errors.append(f'文件或文件夹不存在: {rel_path}')
+            continue
+        if _is_inside(target_dir, rel_path):
+            errors.append(f'不能复制到自身或其子文件夹中: {rel_path}')
+            continue
+        name = unique_name(target_abs, os.path.basename(rel_path), taken)
+        taken.add(name)
+        items.append((rel_path, f'{target_dir}/{name}' if target_dir else name))
+    return items, errors
+
+
+def move_paths(rel_paths, target_dir):
+    """移动到目标文件夹，同一文件系统内直接重命名
+
+    返回 (已移动的 [(源, 目标)], 需跨文件系统复制的 [(源, 目标)], 错误列表)。
+    """
+    moved = []
+    cross_device = []
+    errors = []
+    for rel_path in rel_paths:
+        src = os.path.join(Config.UPLOAD_FOLDER, rel_path)
+        dst_rel = f'{target_dir}/{os.path.basename(rel_path)}' if target_dir else os.path.basename(rel_path)
+        dst = os.path.join(Config.UPLOAD_FOLDER, dst_rel)
+        if not os.path.lexists(src):
+            errors.append(f'文件或文件夹不存在: {rel_path}')
+        elif _is_inside(target_dir, rel_path):
+            errors.append(f'不能移动到自身或其子文件夹中: {rel_path}')
+        elif os.path.dirname(rel_path) == target_dir:
+            errors.append(f'已在目标文件夹中: {rel_path}')
+        elif os.path.lexists(dst):
+            errors.append(f'目标位置已有同名文件: {os.path.basename(rel_path)}')
+        else:
+            try:
+                os.rename(src, dst)
+                moved.append((rel_path, dst_rel))
+            except OSError as e:
+                if e.errno == errno.EXDEV:
+                    cross_device.append((rel_path, dst_rel))
+                else:
+                    errors.append(f'移动失败 {rel_path}: {e}')
+    return moved, cross_device, errors
+
+
+def copy_job(job, items, notify, remove_source=False):
+    """复制（或跨文件系统移动）任务，items为 [(源相对路径, 目标相对路径)]
+
+    每一项先复制到目标文件夹中的隐藏暂存项（与提交分块上传的 .part 相同），
+    完成后在同一文件夹内原子地改名，目标位置不会出现复制了一半的内容，目标在
+    另一个文件系统上时也只需写一次；某一项中有文件复制失败时整项放弃（移动时
+    不删除源），取消时丢弃正在复制的项，已完成的项保留。
+    """
+    job.unit = 'bytes'
+    for src_rel, _ in items:
+        job.add_progress(total=_tree_size(os.path.join(Config.UPLOAD_FOLDER, src_rel)))
+    finished = 0
+    for i, (src_rel, dst_rel) in enumerate(items):
+        src = os.path.join(Config.UPLOAD_FOLDER, src_rel)
+        dst_dir = os.path.join(Config.UPLOAD_FOLDER, os.path.dirname(dst_rel))
+        staged = os.path.join(dst_dir, f'.{os.path.basename(dst_rel)}.{job.id}.{i}.part')
+        try:
+            try:
+                if not _copy_tree(job, src, staged):
+                    break
+                # 复制期间目标位置可能出现了同名项
+                name = unique_name(dst_dir, os.path.basename(dst_rel))
+                os.rename(staged, os.path.join(dst_dir, name))
+            finally:
+                # 失败或取消时删除复制了一半的内容
+                if os.path.lexists(staged):
+                    try:
+                        _remove(staged)
+                    except OSError:
+                        pass
+            if remove_source:
+                _remove(src)
+                notify([os.path.dirname(src_rel)])
+            notify([os.path.dirname(dst_rel)])
+            finished += 1
+        except OSError as e:
+            # 移动时保留源文件
+            job.add_error(f'{"移动" if remove_source else "复制"}失败 {src_rel}: {e}')
+    verb = '移动' if remove_source else '复制'
+    if job.cancelled:
+        return f'已取消{verb}，已完成 {finished} 项'
+    return f'成功{verb} {finished} 个文件/文件夹'
+
+
+def restore_staged(staged):
+    """取消删除时把暂存区中剩余的内容移回原位置，返回错误列表"""
+    errors = []
+    for staged_path, rel_path in staged:
+        abs_path = os.path.join(Config.UPLOAD_FOLDER, rel_path)
+        if staged_path == abs_path or not os.path.lexists(staged_path):
+            continue
+        if os.path.lexists(abs_path):
+            errors.append(f'无法恢复 {rel_path}: 原位置已有同名文件')
+            continue
+        try:
+            os.makedirs(os.path.dirname(abs_path), exist_ok=True)
+            os.rename(staged_path, abs_path)
+        except OSError as e:
+            errors.append(f'无法恢复 {rel_path}: {e}')
+    return errors
+
+
+def purge_trash(job):
+    """清空暂存区（上次未完成的删除）"""
+    folder = trash_folder()
+    paths = [entry.path for entry in os.scandir(folder)]
+    if paths:
+        delete_paths(job, paths)
+    return f'已清理 {len(paths)} 个未完成的删除'
\ No newline at end of file
@@ -0,0 +1,430 @@
+import os
+import mmap
+import time
+import uuid
+import pickle
+import shutil
+import hashlib
+import threading
+from .config import Config
+from .fileops import clone_fd
+
+# 索引文件格式版本，结构或哈希算法变化时递增以触发重建
+INDEX_FORMAT = 1
+
+
+def hash_file(file_path, chunk_size=None):
+    """计算文件的分块SHA-256：每块的SHA-256摘要拼接后再取一次SHA-256
+
+    浏览器在HTTP（非安全上下文）下只能用JS计算哈希，分块后每块可以单独
+    读入内存计算，服务端和浏览器算出的结果一致。使用SHA-256而不是更快的
+    BLAKE2/xxhash，是因为浏览器的crypto.subtle只支持SHA系列。
+
+    注意 /upload/probe 把哈希当作持有文件的证明：客户端提交任一文件的大小和
+    哈希，服务器就会把该文件复制到客户端指定的位置。能访问共享目录的设备本来
+    就能下载所有文件，因此可以接受；以后如果加入按文件的访问权限，秒传前必须
+    先检查客户端能否读取源文件。
+    """
+    chunk_size = chunk_size or Config.HASH_CHUNK_SIZE
+    outer = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return outer.hexdigest()
+        try:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            # 无法映射（例如特殊文件系统），退回普通读取
+            while True:
+                data = f.read(chunk_size)
+                if not data:
+                    break
+                outer.update(hashlib.sha256(data).digest())
+            return outer.hexdigest()
+        with mapped:
+            view = memoryview(mapped)
+            try:
+                for offset in range(0, len(view), chunk_size):
+                    # 切片不复制数据，hashlib计算时会释放GIL
+                    outer.update(hashlib.sha256(view[offset:offset + chunk_size]).digest())
+                    # 让出执行权，协程服务器模式下计算大文件时不会阻塞请求
+                    time.sleep(0)
+            finally:
+                view.release()
+    return outer.hexdigest()
+
+
+def place_copy(src_path, dst_path):
+    """把已有文件的内容放到新位置，返回使用的方式
+
+    依次尝试：写时复制（reflink，不占额外空间）、硬链接（需在配置中开启，
+    两个路径共享同一份数据，修改一个会影响另一个）、普通复制。先写入目标
+    目录下的临时文件（名称唯一，同时放到同一位置的请求互不影响）再原子替换。
+    """
+    tmp_path = os.path.join(os.path.dirname(dst_path), f'.{os.path.basename(dst_path)}.{uuid.uuid4().hex}.tmp')
+    try:
+        if _reflink(src_path, tmp_path):
+            method = 'reflink'
+        elif Config.DEDUP_HARDLINK and _hardlink(src_path, tmp_path):
+            method = 'hardlink'
+        else:
+            shutil.copyfile(src_path, tmp_path)
+            method = 'copy'
+        os.replace(tmp_path, dst_path)
+        return method
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def _reflink(src_path, dst_path):
+    with open(src_path, 'rb') as src, open(dst_path, 'wb') as dst:
+        if clone_fd(src.fileno(), dst.fileno()):
+            return True
+    os.remove(dst_path)
+    return False
+
+
+def _hardlink(src_path, dst_path):
+    try:
+        os.link(src_path, dst_path)
+        return True
+    except OSError:
+        return False
+
+
+class HashIndex:
+    """共享目录的内容哈希索引
+
+    后台线程对共享目录中的文件计算哈希，维护 路径 -> (大小, mtime, 哈希) 和
+    (大小, 哈希) -> 路径集合 两个映射，用于秒传和查找重复文件。索引定期持久化，
+    重启后只对大小或修改时间变化的文件重新计算。
+    """
+
+    def __init__(self):
+        self.base_path = None
+        self.index_file = None
+        self.lock = threading.RLock()
+        self.ready = False
+        self.running = False
+        self.thread = None
+        self.dirty = False
+        self._event = threading.Event()
+        self._pending = set()
+        self.listeners = []
+        # 相对路径 -> (大小, mtime_ns, 哈希)
+        self.files = {}
+        # (大小, 哈希) -> {相对路径}
+        self.by_hash = {}
+        # 相对目录 -> {直接包含的已索引文件名和含有已索引文件的子目录名}，
+        # 更新单个目录时只需查看该目录的子项，不必遍历全部文件
+        self.children = {}
+
+    def add_listener(self, callback):
+        """注册哈希更新回调，callback(records) 接收 (相对路径, 大小, mtime_ns, 哈希) 列表"""
+        self.listeners.append(callback)
+
+    def _notify(self, records):
+        for callback in self.listeners:
+            try:
+                callback(records)
+            except Exception as e:
+                print(f"哈希索引回调出错: {e}")
+
+    # ================= 生命周期 =================
+    def start(self, base_path):
+        """加载索引并启动后台哈希线程"""
+        if self.running or not Config.HASH_INDEX_ENABLED:
+            return
+        self.base_path = base_path
+        self.index_file = Config.share_data_path('hash_index.pickle')
+        self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """停止后台线程并保存索引"""
+        if not self.running:
+            return
+        self.running = False
+        self._event.set()
+        if self.thread:
+            self.thread.join()
+        self.save()
+
+    def _run(self):
+        try:
+            self.load()
+            # 对账：新增或变化的文件重新计算哈希
+            self._scan_tree('')
+        except Exception as e:
+            print(f"哈希索引构建出错: {e}")
+        self.ready = True
+        self.save()
+        with self.lock:
+            records = [(rel_path,) + record for rel_path, record in self.files.items()]
+        self._notify(records)
+        while self.running:
+            self._event.wait(Config.HASH_INDEX_SAVE_INTERVAL)
+            self._event.clear()
+            with self.lock:
+                rel_dirs, self._pending = self._pending, set()
+            for rel_dir in sorted(rel_dirs):
+                if not self.running:
+                    break
+                try:
+                    self._scan_dir(rel_dir)
+                except Exception as e:
+                    print(f"哈希索引更新出错: {e}")
+            if self.dirty:
+                try:
+                    self.save()
+                except Exception as e:
+                    print(f"哈希索引保存出错: {e}")
+
+    # ================= 持久化 =================
+    def load(self):
+        try:
+            with open(self.index_file, 'rb') as f:
+                data = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ValueError):
+            return False
+        if (data.get('format') != INDEX_FORMAT or data.get('chunk_size') != Config.HASH_CHUNK_SIZE or
+                data.get('base_path') != os.path.abspath(self.base_path)):
+            return False
+        with self.lock:
+            self.files = {}
+            self.by_hash = {}
+            self.children = {}
+            for rel_path, record in data['files'].items():
+                self._set(rel_path, record)
+        return True
+
+    def save(self):
+        if not self.index_file:
+            return
+        with self.lock:
+            data = {
+                'format': INDEX_FORMAT,
+                'chunk_size': Config.HASH_CHUNK_SIZE,
+                'base_path': os.path.abspath(self.base_path),
+                'files': dict(self.files),
+            }
+            self.dirty = False
+        tmp_file = self.index_file + '.tmp'
+        with open(tmp_file, 'wb') as f:
+            pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_file, self.index_file)
+
+    # ================= 索引维护 =================
+    def update_dirs(self, rel_dirs):
+        """目录发生变化（文件监控回调），由后台线程重新扫描"""
+        if not self.running:
+            return
+        with self.lock:
+            self._pending.update(rel_dirs)
+        self._event.set()
+
+    def _set(self, rel_path, record):
+        old = self.files.get(rel_path)
+        if old is not None:
+            self._unlink(rel_path, old)
+        else:
+            self._add_child(rel_path)
+        self.files[rel_path] = record
+        self.by_hash.setdefault((record[0], record[2]), set()).add(rel_path)
+        self.dirty = True
+
+    def _unlink(self, rel_path, record):
+        key = (record[0], record[2])
+        paths = self.by_hash.get(key)
+        if paths is not None:
+            paths.discard(rel_path)
+            if not paths:
+                del self.by_hash[key]
+
+    def _remove(self, rel_path):
+        record = self.files.pop(rel_path, None)
+        if record is not None:
+            self._unlink(rel_path, record)
+            self._remove_child(rel_path)
+            self.dirty = True
+
+    def _add_child(self, rel_path):
+        """逐级登记到上级目录的子项中，直到上级已有记录"""
+        while True:
+            parent, name = os.path.split(rel_path)
+            names = self.children.setdefault(parent, set())
+            if name in names:
+                return
+            names.add(name)
+            if not parent:
+                return
+            rel_path = parent
+
+    def _remove_child(self, rel_path):
+        """从上级目录的子项中移除，目录中不再有已索引的文件时逐级向上移除"""
+        while True:
+            parent, name = os.path.split(rel_path)
+            names = self.children.get(parent)
+            if names is None:
+                return
+            names.discard(name)
+            if names:
+                return
+            del self.children[parent]
+            if not parent:
+                return
+            rel_path = parent
+
+    def _tree_files(self, rel_dir):
+        """索引中该目录下（含子目录）的所有文件"""
+        result = []
+        stack = [rel_dir]
+        while stack:
+            folder = stack.pop()
+            for name in self.children.get(folder, ()):
+                rel_path = os.path.join(folder, name) if folder else name
+                if rel_path in self.files:
+                    result.append(rel_path)
+                else:
+                    stack.append(rel_path)
+        return result
+
+    def _hash_if_changed(self, rel_path, stat):
+        """大小或修改时间变化时重新计算哈希"""
+        record = self.files.get(rel_path)
+        if record is not None and record[0] == stat.st_size and record[1] == stat.st_mtime_ns:
+            return
+        abs_path = os.path.join(self.base_path, rel_path)
+        try:
+            digest = hash_file(abs_path)
+            after = os.stat(abs_path)
+        except OSError:
+            return
+        if after.st_size != stat.st_size or after.st_mtime_ns != stat.st_mtime_ns:
+            # 计算期间文件被修改，等待下一次变化通知
+            return
+        with self.lock:
+            self._set(rel_path, (stat.st_size, stat.st_mtime_ns, digest))
+        self._notify([(rel_path, stat.st_size, stat.st_mtime_ns, digest)])
+
+    def _scan_tree(self, rel_dir):
+        """递归扫描目录树，并移除已不存在的条目"""
+        top = os.path.join(self.base_path, rel_dir) if rel_dir else self.base_path
+        seen = set()
+        for root, dirs, files in os.walk(top):
+            if not self.running:
+                return
+            rel_root = os.path.relpath(root, self.base_path)
+            rel_root = '' if rel_root == '.' else rel_root
+            if not rel_root and Config.INTERNAL_FOLDER_NAME in dirs:
+                dirs.remove(Config.INTERNAL_FOLDER_NAME)
+            for name in files:
+                rel_path = os.path.join(rel_root, name) if rel_root else name
+                try:
+                    stat = os.stat(os.path.join(root, name))
+                except OSError:
+                    continue
+                seen.add(rel_path)
+                self._hash_if_changed(rel_path, stat)
+        with self.lock:
+            for rel_path in self._tree_files(rel_dir):
+                if rel_path not in seen:
+                    self._remove(rel_path)
+
+    def _scan_dir(self, rel_dir):
+        """增量更新单个目录：直接子文件重新检查，新出现的子目录递归扫描"""
+        abs_dir = os.path.join(self.base_path, rel_dir) if rel_dir else self.base_path
+        prefix = rel_dir + os.sep if rel_dir else ''
+        files = {}
+        subdirs = []
+        try:
+            with os.scandir(abs_dir) as entries:
+                for entry in entries:
+                    if not rel_dir and entry.name == Config.INTERNAL_FOLDER_NAME:
+                        continue
+                    try:
+                        if entry.is_file():
+                            files[prefix + entry.name] = entry.stat()
+                        elif entry.is_dir():
+                            subdirs.append(prefix + entry.name)
+                    except OSError:
+                        continue
+        except OSError:
+            # 目录已被删除或移走
+            with self.lock:
+                for rel_path in self._tree_files(rel_dir):
+                    self._remove(rel_path)
+            return
+
+        subdir_set = set(subdirs)
+        with self.lock:
+            known_dirs = set()
+            stale = []
+            for name in self.children.get(rel_dir, ()):
+                rel_path = prefix + name
+                if rel_path in self.files:
+                    if rel_path not in files:
+                        stale.append(rel_path)
+                elif rel_path in subdir_set:
+                    known_dirs.add(rel_path)
+                else:
+                    # 子目录已被删除或移走
+                    stale.extend(self._tree_files(rel_path))
+            for rel_path in stale:
+                self._remove(rel_path)
+        for rel_path, stat in files.items():
+            self._hash_if_changed(rel_path, stat)
+        for subdir in subdirs:
+            if subdir not in known_dirs:
+                # 新出现（例如移入）的子目录
+                self._scan_tree(subdir)
+
+    # ================= 查询 =================
+    def lookup(self, size, digest):
+        """查找内容相同且未被修改的文件，返回绝对路径或None（索引构建期间也可使用已计算的部分）"""
+        with self.lock:
+            candidates = list(self.by_hash.get((size, digest.lower()), ()))
+        for rel_path in candidates:
+            abs_path = os.path.join(self.base_path, rel_path)
+            try:
+                stat = os.stat(abs_path)
+            except OSError:
+                continue
+            record = self.files.get(rel_path)
+            if record and stat.st_size == record[0] and stat.st_mtime_ns == record[1]:
+                return abs_path
+        return None
+
+    def digest(self, file_path, stat):
+        """已索引且未被修改的文件返回其哈希，否则返回None"""
+        if self.base_path is None:
+            return None
+        rel_path = os.path.relpath(file_path, self.base_path)
+        with self.lock:
+            record = self.files.get(rel_path)
+        if record and stat.st_size == record[0] and stat.st_mtime_ns == record[1]:
+            return record[2]
+        return None
+
+    def duplicates(self, min_size=1, limit=200):
+        """重复文件报告，按可节省的空间从大到小排序"""
+        with self.lock:
+            groups = [(size, digest, sorted(paths)) for (size, digest), paths in self.by_hash.items()
+                      if len(paths) > 1 and size >= min_size]
+        groups.sort(key=lambda g: g[0] * (len(g[2]) - 1), reverse=True)
+        return {
+            'groups': [{
+                'hash': digest,
+                'size': size,
+                'paths': [path.replace(os.sep, '/') for path in paths],
+                'wasted': size * (len(paths) - 1),
+            } for size, digest, paths in groups[:limit]],
+            'group_count': len(groups),
+            'total_wasted': sum(size * (len(paths) - 1) for size, _, paths in groups),
+            'ready': self.ready,
+        }
\ No newline at end of file
@@ -0,0 +1,311 @@
+import os
+import json
+import math
+import time
+import shutil
+import threading
+import subprocess
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from .config import Config
+from .metrics import cache_result, HLS_TRANSCODE, HLS_TRANSCODES_ACTIVE
+
+
+class TranscodeError(Exception):
+    """ffmpeg/ffprobe无法处理该视频"""
+
+
+# 转码命令的版本，命令改变时递增，不再使用旧命令生成的缓存片段
+TRANSCODE_VERSION = 2
+
+
+def _profile_name():
+    """转码参数的标识，参数改变后不会用到旧的缓存片段"""
+    return (f'{Config.HLS_MAX_HEIGHT}p-{Config.HLS_VIDEO_MAXRATE}-{Config.HLS_SEGMENT_SECONDS}s'
+            f'-v{TRANSCODE_VERSION}')
+
+
+class HlsService:
+    """视频边转码边播放（HLS）
+
+    播放列表按固定时长切分整个视频，播放到哪一段才调用ffmpeg转码该段，并提前
+    转码后面的若干段，拖动进度条时只需转码目标位置的片段。转码在线程池中以
+    ffmpeg子进程运行，同时运行的进程数有上限。片段缓存以内容指纹命名，总大小
+    超出上限时按最近使用时间淘汰。
+    """
+
+    def __init__(self, fingerprint):
+        # 文件内容指纹函数（与缩略图共用）
+        self.fingerprint = fingerprint
+        self.cache_dir = None
+        self.lock = threading.Lock()
+        self.executor = None
+        # 缓存片段（相对cache_dir的路径） -> 大小，按最近使用排序
+        self.entries = OrderedDict()
+        self.total_size = 0
+        # 正在转码或排队的片段: 相对路径 -> [Future, 视频标识, 片段序号, 是否为预读]
+        self.pending = {}
+        # 正在运行的ffmpeg进程，退出时结束
+        self.processes = set()
+        # 内容指纹 -> 视频信息
+        self.probes = OrderedDict()
+        self._available = None
+
+    # ================= 生命周期 =================
+    def start(self):
+        """加载已有的缓存片段，按修改时间（即最近使用时间）排序"""
+        self.cache_dir = os.path.join(Config.DATA_FOLDER, 'hls')
+        os.makedirs(self.cache_dir, exist_ok=True)
+        files = []
+        for folder in os.scandir(self.cache_dir):
+            if not folder.is_dir():
+                continue
+            for entry in os.scandir(folder.path):
+                if entry.name.endswith('.ts'):
+                    try:
+                        stat = entry.stat()
+                    except OSError:
+                        continue
+                    files.append((stat.st_mtime, f'{folder.name}/{entry.name}', stat.st_size))
+                elif entry.name.endswith('.tmp'):
+                    # 上次异常退出留下的临时文件
+                    try:
+                        os.remove(entry.path)
+                    except OSError:
+                        pass
+        with self.lock:
+            self.entries.clear()
+            self.total_size = 0
+            for _, name, size in sorted(files):
+                self.entries[name] = size
+                self.total_size += size
+
+    def stop(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+        with self.lock:
+            processes = list(self.processes)
+        for process in processes:
+            try:
+                process.kill()
+            except OSError:
+                pass
+
+    def _get_executor(self):
+        with self.lock:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=Config.HLS_WORKERS,
+                                                   thread_name_prefix='hls')
+            return self.executor
+
+    def available(self):
+        """是否启用并找到了ffmpeg和ffprobe"""
+        if self._available is None:
+            self._available = bool(Config.HLS_ENABLED and shutil.which(Config.FFMPEG_PATH)
+                                   and shutil.which(Config.FFPROBE_PATH))
+        return self._available
+
+    @staticmethod
+    def is_supported(filename):
+        return os.path.splitext(filename)[1].lower() in Config.HLS_EXTENSIONS
+
+    # ================= 视频信息与播放列表 =================
+    def probe(self, file_path):
+        """读取视频时长等信息（按内容指纹缓存），返回dict，无法识别时抛出TranscodeError"""
+        if self.cache_dir is None:
+            self.start()
+        fingerprint = self.fingerprint(file_path)
+        with self.lock:
+            info = self.probes.get(fingerprint)
+            if info is not None:
+                self.probes.move_to_end(fingerprint)
+                return info
+        cmd = [Config.FFPROBE_PATH, '-v', 'error', '-of', 'json',
+               '-show_entries', 'format=duration:stream=codec_type,codec_name,width,height', file_path]
+        try:
+            result = subprocess.run(cmd, stdin=subprocess.DEVNULL, capture_output=True, timeout=30)
+            data = json.loads(result.stdout or b'{}')
+            duration = float(data['format']['duration'])
+        except (OSError, subprocess.TimeoutExpired, ValueError, KeyError, TypeError) as e:
+            raise TranscodeError(f'无法读取视频信息: {e}')
+        streams = data.get('streams') or []
+        video = next((s for s in streams if s.get('codec_type') == 'video'), None)
+        if video is None or duration <= 0:
+            raise TranscodeError('没有视频轨道')
+        info = {
+            'id': f'{fingerprint}-{_profile_name()}',
+            'duration': duration,
+            'segments': max(1, math.ceil(duration / Config.HLS_SEGMENT_SECONDS)),
+            'width': video.get('width'),
+            'height': video.get('height'),
+            'video_codec': video.get('codec_name'),
+            'has_audio': any(s.get('codec_type') == 'audio' for s in streams),
+        }
+        with self.lock:
+            self.probes[fingerprint] = info
+            while len(self.probes) > 1000:
+                self.probes.popitem(last=False)
+        return info
+
+    @staticmethod
+    def segment_range(info, index):
+        """片段的起始时间和时长(秒)"""
+        start = index * Config.HLS_SEGMENT_SECONDS
+        return start, min(Config.HLS_SEGMENT_SECONDS, info['duration'] - start)
+
+    def playlist(self, info, segment_url):
+        """生成包含全部片段的点播列表，segment_url(序号) 返回片段地址"""
+        lines = [
+            '#EXTM3U',
+            '#EXT-X-VERSION:3',
+            f'#EXT-X-TARGETDURATION:{math.ceil(Config.HLS_SEGMENT_SECONDS)}',
+            '#EXT-X-MEDIA-SEQUENCE:0',
+            '#EXT-X-PLAYLIST-TYPE:VOD',
+        ]
+        for index in range(info['segments']):
+            lines.append(f'#EXTINF:{self.segment_range(info, index)[1]:.3f},')
+            lines.append(segment_url(index))
+        lines.append('#EXT-X-ENDLIST')
+        return '\n'.join(lines) + '\n'
+
+    # ================= 片段 =================
+    def segment(self, file_path, index, timeout=None):
+        """获取片段文件路径，必要时等待转码完成，并在后台预读后面的片段"""
+        info = self.probe(file_path)
+        if not 0 <= index < info['segments']:
+            raise IndexError(index)
+        cache_path, future = self._submit(file_path, info, index, prefetch=False)
+        last = min(info['segments'], index + 1 + Config.HLS_PREFETCH_SEGMENTS)
+        self._cancel_stale(info['id'], index, last)
+        for ahead in range(index + 1, last):
+            self._submit(file_path, info, ahead, prefetch=True)
+        if future is not None:
+            future.result(timeout=timeout or Config.HLS_SEGMENT_TIMEOUT)
+        return cache_path
+
+    def _submit(self, file_path, info, index, prefetch):
+        """返回 (缓存文件路径, Future)，缓存命中时Future为None"""
+        name = f'{info["id"]}/{index:05d}.ts'
+        cache_path = os.path.join(self.cache_dir, name)
+        with self.lock:
+            cached = name in self.entries
+            if cached:
+                self.entries.move_to_end(name)
+        if not prefetch:
+            cache_result('hls_segment', cached)
+        if cached:
+            try:
+                # 更新修改时间，重启后仍能按最近使用时间淘汰
+                os.utime(cache_path)
+                return cache_path, None
+            except FileNotFoundError:
+                with self.lock:
+                    self.total_size -= self.entries.pop(name, 0)
+            except OSError:
+                return cache_path, None
+
+        executor = self._get_executor()
+        with self.lock:
+            task = self.pending.get(name)
+            created = task is None
+            if created:
+                start, duration = self.segment_range(info, index)
+                future = executor.submit(self._transcode, file_path, cache_path, start, duration,
+                                         info['has_audio'])
+                task = self.pending[name] = [future, info['id'], index, prefetch]
+            elif not prefetch:
+                # 播放器已经在等这个片段，不能再被取消
+                task[3] = False
+        if created:
+            task[0].add_done_callback(lambda f: self._finished(name, f))
+        return cache_path, task[0]
+
+    def _cancel_stale(self, stream_id, first, last):
+        """拖动进度后，取消同一视频中还未开始的、不在新位置附近的预读"""
+        with self.lock:
+            stale = [task[0] for task in self.pending.values()
+                     if task[1] == stream_id and task[3] and not first <= task[2] < last]
+        for future in stale:
+            future.cancel()
+
+    def _transcode(self, file_path, cache_path, start, duration, has_audio=True):
+        """调用ffmpeg把一段视频转为H.264/AAC的MPEG-TS，先写临时文件再原子替换
+
+        各片段单独转码，边界处要避免两个问题：片段开头强制关键帧并关闭场景切换
+        插入的额外关键帧，保证每段都从关键帧开始、可以单独解码；音频按时间戳重采样
+        补齐（aresample=async），片段开头不会因定位或编码器延迟出现空隙。
+        """
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        tmp_path = f'{cache_path}.{threading.get_ident()}.tmp'
+        maxrate = Config.HLS_VIDEO_MAXRATE
+        if has_audio:
+            audio = ['-af', 'aresample=async=1:first_pts=0', '-c:a', 'aac', '-ac', '2', '-b:a', '128k']
+        else:
+            audio = ['-an']
+        cmd = [
+            Config.FFMPEG_PATH, '-nostdin', '-v', 'error', '-y',
+            # -ss放在-i前按关键帧快速定位，重新编码时仍能精确从start开始
+            '-ss', f'{start:.3f}', '-i', file_path, '-t', f'{duration:.3f}',
+            '-map', '0:v:0', '-map', '0:a:0?', '-sn', '-dn',
+            '-vf', f"scale=-2:'trunc(min({Config.HLS_MAX_HEIGHT},ih)/2)*2'",
+            '-c:v', 'libx264', '-preset', Config.HLS_PRESET, '-crf', str(Config.HLS_CRF),
+            '-maxrate', maxrate, '-bufsize', maxrate, '-pix_fmt', 'yuv420p',
+            '-force_key_frames', 'expr:eq(n,0)', '-sc_threshold', '0',
+            *audio,
+            # 各片段的时间戳接续整个视频的时间轴，播放器无需重置解码器
+            '-output_ts_offset', f'{start:.3f}', '-muxdelay', '0',
+            '-f', 'mpegts', tmp_path,
+        ]
+        HLS_TRANSCODES_ACTIVE.inc()
+        started = time.perf_counter()
+        try:
+            process = subprocess.Popen(cmd, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                                       stderr=subprocess.PIPE)
+            with self.lock:
+                self.processes.add(process)
+            try:
+                _, stderr = process.communicate(timeout=Config.HLS_SEGMENT_TIMEOUT)
+            except subprocess.TimeoutExpired:
+                process.kill()
+                process.communicate()
+                raise TranscodeError('转码超时')
+            finally:
+                with self.lock:
+                    self.processes.discard(process)
+            if process.returncode != 0:
+                message = stderr.decode('utf-8', 'replace').strip().splitlines()
+                raise TranscodeError(f'ffmpeg出错: {message[-1] if message else process.returncode}')
+            os.replace(tmp_path, cache_path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+        finally:
+            HLS_TRANSCODES_ACTIVE.dec()
+        HLS_TRANSCODE.observe(time.perf_counter() - started)
+        return os.path.getsize(cache_path)
+
+    def _finished(self, name, future):
+        with self.lock:
+            self.pending.pop(name, None)
+            if future.cancelled() or future.exception() is not None:
+                return
+            if name not in self.entries:
+                self.entries[name] = future.result()
+                self.total_size += self.entries[name]
+            evict = []
+            while self.total_size > Config.HLS_CACHE_MAX_BYTES and len(self.entries) > 1:
+                old_name, old_size = self.entries.popitem(last=False)
+                self.total_size -= old_size
+                evict.append(old_name)
+        for old_name in evict:
+            path = os.path.join(self.cache_dir, old_name)
+            try:
+                os.remove(path)
+                # 该视频的片段都被淘汰后删除空文件夹
+                os.rmdir(os.path.dirname(path))
+            except OSError:
+                pass
\ No newline at end of file
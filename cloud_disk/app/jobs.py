@@ -0,0 +1,178 @@
+import time
+import uuid
+import threading
+from collections import OrderedDict, deque
+from .config import Config
+from .metrics import SOCKET_EMITS
+
+# 单个任务最多保留的错误信息条数
+MAX_ERRORS = 100
+
+
+class Job:
+    """后台任务的状态和进度"""
+
+    def __init__(self, kind, description=''):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.description = description
+        # queued / running / completed / cancelled / failed
+        self.state = 'running'
+        # 进度单位: items（文件数）/ bytes
+        self.unit = 'items'
+        self.done = 0
+        self.total = 0
+        self.message = ''
+        self.errors = []
+        self.error_count = 0
+        self.created = time.time()
+        self.finished = None
+        self.cancel_event = threading.Event()
+        self.lock = threading.Lock()
+        # 进度变化时调用（由任务管理器设置为节流推送）
+        self.on_progress = lambda: None
+
+    @property
+    def cancelled(self):
+        return self.cancel_event.is_set()
+
+    def add_progress(self, done=0, total=0):
+        with self.lock:
+            self.done += done
+            self.total += total
+
+    def add_error(self, message):
+        with self.lock:
+            self.error_count += 1
+            if len(self.errors) < MAX_ERRORS:
+                self.errors.append(message)
+
+    def to_dict(self):
+        with self.lock:
+            return {
+                'id': self.id,
+                'kind': self.kind,
+                'description': self.description,
+                'state': self.state,
+                'unit': self.unit,
+                'done': self.done,
+                'total': self.total,
+                'message': self.message,
+                'errors': list(self.errors),
+                'error_count': self.error_count,
+                'created': self.created,
+                'finished': self.finished,
+            }
+
+
+class JobManager:
+    """后台任务管理
+
+    每个任务在独立线程中运行，进度通过Socket.IO的job_progress事件推送（按
+    间隔节流），也可以通过任务id查询或取消。需要排队的任务（复制等大量读写
+    磁盘的操作）按提交顺序执行，同时运行的数量有上限。已结束的任务保留一段
+    时间供查询。
+    """
+
+    def __init__(self, socketio, namespace='/file'):
+        self.socketio = socketio
+        self.namespace = namespace
+        self.lock = threading.Lock()
+        self.jobs = OrderedDict()
+        self._last_emit = {}
+        # 排队任务的调度
+        self._queue_cond = threading.Condition()
+        self._queue = deque()
+        self._queue_running = 0
+
+    def submit(self, kind, func, *args, description='', queued=False):
+        """创建任务并在后台运行 func(job, *args)，func的返回值作为完成消息"""
+        job = Job(kind, description)
+        job.on_progress = lambda: self.emit(job)
+        if queued:
+            job.state = 'queued'
+        with self.lock:
+            self._prune()
+            self.jobs[job.id] = job
+        thread = threading.Thread(target=self._run, args=(job, func, args, queued), daemon=True)
+        thread.start()
+        return job
+
+    def _run(self, job, func, args, queued):
+        self.emit(job, force=True)
+        if queued and not self._wait_turn(job):
+            self._finish(job, 'cancelled', '已取消')
+            return
+        try:
+            message = func(job, *args)
+            state = 'cancelled' if job.cancelled else 'completed'
+        except Exception as e:
+            message = str(e)
+            state = 'failed'
+            print(f"后台任务出错 {job.kind}: {e}")
+        finally:
+            if queued:
+                with self._queue_cond:
+                    self._queue_running -= 1
+                    self._queue_cond.notify_all()
+        self._finish(job, state, message)
+
+    def _wait_turn(self, job):
+        """排队等待运行名额，排队期间被取消时返回False"""
+        with self._queue_cond:
+            self._queue.append(job)
+            while self._queue[0] is not job or self._queue_running >= Config.JOB_MAX_CONCURRENT:
+                if job.cancelled:
+                    self._queue.remove(job)
+                    self._queue_cond.notify_all()
+                    return False
+                self._queue_cond.wait(0.5)
+            self._queue.popleft()
+            self._queue_running += 1
+            self._queue_cond.notify_all()
+        with job.lock:
+            job.state = 'running'
+        self.emit(job, force=True)
+        return True
+
+    def _finish(self, job, state, message):
+        with job.lock:
+            job.state = state
+            job.message = message or ''
+            job.finished = time.time()
+        self.emit(job, force=True)
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def cancel(self, job_id):
+        """请求取消任务，任务会在下一个检查点停止"""
+        job = self.get(job_id)
+        if job is None:
+            return None
+        job.cancel_event.set()
+        return job
+
+    def active(self):
+        with self.lock:
+            return [job for job in self.jobs.values() if job.finished is None]
+
+    def emit(self, job, force=False):
+        """推送任务进度，未结束的任务按间隔节流"""
+        now = time.monotonic()
+        if not force:
+            last = self._last_emit.get(job.id, 0)
+            if now - last < Config.JOB_PROGRESS_INTERVAL:
+                return
+        self._last_emit[job.id] = now
+        SOCKET_EMITS.inc(event='job_progress')
+        self.socketio.emit('job_progress', job.to_dict(), namespace=self.namespace)
+
+    def _prune(self):
+        """清理过期的已结束任务（需持有lock）"""
+        expire = time.time() - Config.JOB_KEEP_SECONDS
+        for job_id, job in list(self.jobs.items()):
+            if job.finished is not None and job.finished < expire:
+                del self.jobs[job_id]
+                self._last_emit.pop(job_id, None)
\ No newline at end of file
@@ -0,0 +1,367 @@
+import io
+import time
+import pstats
+import cProfile
+import threading
+from bisect import bisect_left
+from collections import deque
+from flask import request
+from .config import Config
+
+# 耗时直方图的分桶上限(秒)，上传下载大文件可能持续较长时间
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Registry:
+    """指标集合，按Prometheus文本格式输出"""
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+
+class Metric:
+    """带标签的指标，每组标签值对应一个数值"""
+    kind = 'untyped'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+        self.values = {}
+        registry.register(self)
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def _samples(self, key, value):
+        yield f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}'
+
+    def _snapshot(self):
+        with self.lock:
+            return sorted(self.values.items())
+
+    def render(self):
+        items = self._snapshot()
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        for key, value in items:
+            lines.extend(self._samples(key, value))
+        return lines
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    """可增减的数值；指定function时在输出时调用它获取当前值"""
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=(), function=None):
+        super().__init__(name, documentation, labelnames)
+        self.function = function
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def render(self):
+        if self.function is not None:
+            try:
+                self.set(self.function())
+            except Exception:
+                pass
+        return super().render()
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            data = self.values.get(key)
+            if data is None:
+                # 各分桶的计数（最后一个为+Inf），总和，总数
+                data = self.values[key] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            data[bisect_left(self.buckets, value)] += 1
+            data[-2] += value
+            data[-1] += 1
+
+    def _snapshot(self):
+        # 复制各组计数，避免输出时与observe并发修改
+        with self.lock:
+            return sorted((key, list(data)) for key, data in self.values.items())
+
+    def _samples(self, key, data):
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), data):
+            cumulative += count
+            labels = _format_labels(self.labelnames, key, ('le', _format_value(float(bound))))
+            yield f'{self.name}_bucket{labels} {cumulative}'
+        labels = _format_labels(self.labelnames, key)
+        yield f'{self.name}_sum{labels} {_format_value(data[-2])}'
+        yield f'{self.name}_count{labels} {data[-1]}'
+
+    def time(self, **labels):
+        """计时上下文: with histogram.time(kind='x'): ..."""
+        return _Timer(self, labels)
+
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.started, **self.labels)
+
+
+# ================= 指标定义 =================
+START_TIME = Gauge('cloud_disk_start_time_seconds', '服务启动时间（Unix时间戳）')
+START_TIME.set(time.time())
+
+HTTP_REQUESTS = Counter('cloud_disk_http_requests_total', '按路由和状态码统计的请求数',
+                        ('method', 'route', 'status'))
+HTTP_DURATION = Histogram('cloud_disk_http_request_duration_seconds', '请求耗时（直到响应体发送完毕）',
+                          ('method', 'route'))
+HTTP_RECEIVED_BYTES = Counter('cloud_disk_http_received_bytes_total', '收到的请求体字节数', ('route',))
+HTTP_SENT_BYTES = Counter('cloud_disk_http_sent_bytes_total', '发送的响应体字节数', ('route',))
+ACTIVE_TRANSFERS = Gauge('cloud_disk_active_transfers', '正在进行的上传和下载', ('direction',))
+
+WATCHER_SCAN = Histogram('cloud_disk_watcher_scan_duration_seconds',
+                         '文件监控耗时: add_tree 建立监控，poll 轮询扫描，dispatch 分发变化', ('kind',))
+WATCHER_ERRORS = Counter('cloud_disk_watcher_errors_total', '文件监控及其回调出错次数', ('stage',))
+
+SOCKET_CLIENTS = Gauge('cloud_disk_socketio_clients', '已连接的Socket.IO客户端数')
+SOCKET_EMITS = Counter('cloud_disk_socketio_emits_total', 'Socket.IO推送次数（按事件）', ('event',))
+
+JOBS_ACTIVE = Gauge('cloud_disk_jobs_active', '未结束的后台任务数（含排队中）')
+
+TRANSFER_QUEUED = Gauge('cloud_disk_transfers_queued', '等待传输名额的上传和下载')
+TRANSFER_THROTTLED = Counter('cloud_disk_transfer_throttled_seconds_total', '传输因限速等待的总时间(秒)')
+
+UPLOAD_RESERVED = Gauge('cloud_disk_upload_reserved_bytes', '已准入但尚未写入磁盘的上传字节数')
+UPLOAD_REJECTED = Counter('cloud_disk_upload_rejected_total', '因空间不足被拒绝的上传，reason为disk、quota或busy',
+                          ('reason',))
+
+HLS_TRANSCODE = Histogram('cloud_disk_hls_transcode_duration_seconds', '视频片段转码耗时')
+HLS_TRANSCODES_ACTIVE = Gauge('cloud_disk_hls_transcodes_active', '正在运行的ffmpeg转码进程数')
+
+CACHE_REQUESTS = Counter('cloud_disk_cache_requests_total', '缓存查询次数，result为hit或miss',
+                         ('cache', 'result'))
+
+# 上传下载类的路由（按视图函数名），用于统计正在进行的传输
+TRANSFER_ENDPOINTS = {
+    'upload_file': 'upload',
+    'chunked_upload_write': 'upload',
+    'upload_archive': 'upload',
+    'download_file': 'download',
+    'download_zip': 'download',
+    'view_file': 'download',
+    'hls_segment': 'download',
+}
+
+
+def cache_result(cache, hit):
+    """记录一次缓存查询"""
+    CACHE_REQUESTS.inc(cache=cache, result='hit' if hit else 'miss')
+
+
+# ================= 请求性能分析 =================
+class RequestProfiler:
+    """可在运行时开启的请求性能分析
+
+    开启后用cProfile记录请求处理函数的调用耗时（流式响应体的发送不在其中），
+    保留最近的若干条结果。分析本身会明显拖慢请求，排查完应及时关闭。
+    """
+
+    def __init__(self):
+        self.enabled = False
+        # 只分析路径以此开头的请求
+        self.path_prefix = ''
+        # 只保留耗时不低于此值的结果(毫秒)
+        self.min_ms = 0
+        self.results = deque(maxlen=Config.PROFILE_KEEP)
+        self.lock = threading.Lock()
+
+    def configure(self, enabled=None, path_prefix=None, min_ms=None):
+        with self.lock:
+            if enabled is not None:
+                if enabled and not self.enabled:
+                    self.results.clear()
+                self.enabled = bool(enabled)
+            if path_prefix is not None:
+                self.path_prefix = str(path_prefix)
+            if min_ms is not None:
+                self.min_ms = float(min_ms)
+
+    def start(self):
+        if (not self.enabled or request.path.startswith('/metrics') or
+                not request.path.startswith(self.path_prefix)):
+            return
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # 已有其他分析器在运行
+            return
+        request.environ['cloud_disk.profile'] = profile
+
+    def stop(self, route, status, started):
+        profile = request.environ.pop('cloud_disk.profile', None)
+        if profile is None:
+            return
+        profile.disable()
+        duration_ms = (time.perf_counter() - started) * 1000
+        if duration_ms < self.min_ms:
+            return
+        out = io.StringIO()
+        pstats.Stats(profile, stream=out).sort_stats('cumulative').print_stats(Config.PROFILE_TOP_FUNCTIONS)
+        with self.lock:
+            self.results.append({
+                'time': time.time(),
+                'method': request.method,
+                'path': request.full_path.rstrip('?'),
+                'route': route,
+                'status': status,
+                'duration_ms': round(duration_ms, 3),
+                'stats': out.getvalue(),
+            })
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'enabled': self.enabled,
+                'path_prefix': self.path_prefix,
+                'min_ms': self.min_ms,
+                'profiles': list(reversed(self.results)),
+            }
+
+
+profiler = RequestProfiler()
+
+
+class _TrackedBody:
+    """包装流式响应体，WSGI服务器关闭响应（发送完毕或客户端断开）时调用 done(发送的字节数)
+
+    直通（direct_passthrough）的响应不会触发call_on_close，因此在这里记录。
+    长度已知时按Content-Length计（sendfile直接写入socket，不经过这里的数据块）。
+    不用生成器实现：未开始迭代的生成器被关闭时不会执行finally，也就不会关闭
+    内层的响应体（例如释放传输名额）。
+    """
+
+    def __init__(self, iterable, length, done):
+        self.iterable = iterable
+        self.length = length
+        self.done = done
+        self.sent = 0
+        self.closed = False
+
+    def __iter__(self):
+        for chunk in self.iterable:
+            self.sent += len(chunk)
+            yield chunk
+
+    def close(self):
+        try:
+            close = getattr(self.iterable, 'close', None)
+            if close is not None:
+                close()
+        finally:
+            if not self.closed:
+                self.closed = True
+                self.done(self.length if self.length is not None else self.sent)
+
+
+def instrument_app(app):
+    """注册请求钩子，记录各路由的耗时、流量和正在进行的传输"""
+
+    @app.before_request
+    def _start_request():
+        request.environ['cloud_disk.started'] = time.perf_counter()
+        direction = TRANSFER_ENDPOINTS.get(request.endpoint)
+        if direction:
+            request.environ['cloud_disk.transfer'] = direction
+            ACTIVE_TRANSFERS.inc(direction=direction)
+        profiler.start()
+
+    @app.after_request
+    def _finish_request(response):
+        started = request.environ.get('cloud_disk.started')
+        if started is None:
+            return response
+        # 按路由规则而不是实际路径统计，避免每个文件产生一组指标
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        method = request.method
+        status = str(response.status_code)
+        direction = request.environ.get('cloud_disk.transfer')
+        profiler.stop(route, response.status_code, started)
+        if request.content_length:
+            HTTP_RECEIVED_BYTES.inc(request.content_length, route=route)
+
+        def done(sent):
+            if sent:
+                HTTP_SENT_BYTES.inc(sent, route=route)
+            HTTP_DURATION.observe(time.perf_counter() - started, method=method, route=route)
+            HTTP_REQUESTS.inc(method=method, route=route, status=status)
+            if direction:
+                ACTIVE_TRANSFERS.dec(direction=direction)
+
+        # 响应体发送完毕（或客户端断开）后才记录，流式下载的耗时也包含在内
+        if method == 'HEAD' or response.status_code in (204, 304) or response.is_sequence:
+            sent = 0 if method == 'HEAD' else response.calculate_content_length() or 0
+            response.call_on_close(lambda: done(sent))
+        else:
+            response.response = _TrackedBody(response.response, response.content_length, done)
+        return response
\ No newline at end of file
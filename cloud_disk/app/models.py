@@ -1,43 +1,348 @@
 import os
 import time
+import select
 import threading
-from flask import jsonify
-from flask_socketio import emit
-from .utils import get_file_info
+from .config import Config
+from .utils import get_file_info, invalidate_listing, clear_listing_cache, set_listing_cache_trusted
+from .metrics import WATCHER_SCAN, WATCHER_ERRORS, SOCKET_EMITS
+from . import inotify
 
 class FileWatcher:
-    """文件监控类"""
-    
-    def __init__(self, base_path, socketio):
+    """文件监控类
+
+    Linux下使用inotify递归监控整个目录树，仅通知发生变化的目录；
+    其他平台回退到定时轮询根目录。
+    """
+
+    def __init__(self, base_path, socketio, backend=None):
         self.base_path = base_path
         self.socketio = socketio
+        self.backend = backend or Config.WATCHER_BACKEND
         self.last_files = []
         self.running = False
         self.thread = None
-    
+        self.listeners = []
+        # inotify: wd -> 相对目录，相对目录 -> wd
+        self._wd_paths = {}
+        self._path_wds = {}
+        self._watch_complete = False
+
+    def add_listener(self, callback):
+        """注册变化回调，callback(changed_dirs) 接收发生变化的相对目录集合"""
+        self.listeners.append(callback)
+
     def start(self):
         """启动文件监控"""
         if not self.running:
             self.running = True
-            self.thread = threading.Thread(target=self._watch_files, daemon=True)
+            if self.backend != 'polling' and inotify.is_available():
+                target = self._watch_inotify
+            else:
+                target = self._watch_files
+            self.thread = threading.Thread(target=target, daemon=True)
             self.thread.start()
-    
+
     def stop(self):
         """停止文件监控"""
         self.running = False
         if self.thread:
             self.thread.join()
-    
+
+    def _dispatch(self, changed_dirs):
+        """将变化的目录分发给回调，没有回调时直接广播目录列表"""
+        with WATCHER_SCAN.time(kind='dispatch'):
+            self._dispatch_dirs(changed_dirs)
+
+    def _dispatch_dirs(self, changed_dirs):
+        for rel_dir in changed_dirs:
+            # 父目录列表中该子目录的mtime也会变化
+            invalidate_listing(self.base_path, rel_dir)
+            invalidate_listing(self.base_path, os.path.dirname(rel_dir))
+        if not self.listeners:
+            for rel_dir in sorted(changed_dirs):
+                SOCKET_EMITS.inc(event='file_update')
+                self.socketio.emit('file_update', {
+                    'path': rel_dir,
+                    'files': get_file_info(self.base_path, rel_dir)
+                }, namespace='/file')
+            return
+        for callback in self.listeners:
+            try:
+                callback(set(changed_dirs))
+            except Exception as e:
+                WATCHER_ERRORS.inc(stage='callback')
+                print(f"文件监控回调出错: {e}")
+
     def _watch_files(self):
-        """后台监控文件变化"""
+        """后台轮询文件变化（inotify不可用时的回退方案）"""
         while self.running:
             try:
-                current_files = get_file_info(self.base_path)
+                with WATCHER_SCAN.time(kind='poll'):
+                    current_files = get_file_info(self.base_path, use_cache=False)
                 if current_files != self.last_files:
                     # 通知所有客户端
-                    self.socketio.emit('file_update', {'files': current_files}, namespace='/file')
+                    self._dispatch({''})
                     self.last_files = current_files
-                time.sleep(1)
+                time.sleep(Config.WATCHER_POLL_INTERVAL)
             except Exception as e:
+                WATCHER_ERRORS.inc(stage='poll')
                 print(f"文件监控出错: {e}")
-                time.sleep(5)
\ No newline at end of file
+                time.sleep(5)
+
+    def _watch_inotify(self):
+        """基于inotify的事件驱动监控，带防抖合并"""
+        try:
+            notifier = inotify.Inotify()
+        except OSError as e:
+            print(f"inotify初始化失败，回退到轮询: {e}")
+            self._watch_files()
+            return
+
+        self._wd_paths.clear()
+        self._path_wds.clear()
+        self._watch_complete = True
+        self._add_tree(notifier, '')
+        # 整个目录树都在监控中时，目录列表缓存可以直接信任
+        clear_listing_cache()
+        set_listing_cache_trusted(self._watch_complete)
+
+        pending = set()
+        first_event = last_event = 0.0
+        try:
+            while self.running:
+                timeout = 0.5
+                if pending:
+                    timeout = min(timeout, max(0.0, last_event + Config.WATCHER_DEBOUNCE - time.monotonic()))
+                readable, _, _ = select.select([notifier.fd], [], [], timeout)
+                if readable:
+                    for wd, mask, cookie, name in notifier.read_events():
+                        self._handle_event(notifier, wd, mask, name, pending)
+                    now = time.monotonic()
+                    if pending:
+                        if not first_event:
+                            first_event = now
+                        last_event = now
+
+                if pending:
+                    now = time.monotonic()
+                    # 事件停止一段时间后，或累积超过最大延迟时，统一通知一次
+                    if (now - last_event >= Config.WATCHER_DEBOUNCE or
+                            now - first_event >= Config.WATCHER_MAX_DELAY):
+                        changed, pending = pending, set()
+                        first_event = last_event = 0.0
+                        self._dispatch(changed)
+        except Exception as e:
+            WATCHER_ERRORS.inc(stage='inotify')
+            print(f"文件监控出错: {e}")
+        finally:
+            set_listing_cache_trusted(False)
+            notifier.close()
+
+    def _handle_event(self, notifier, wd, mask, name, pending):
+        """处理单个inotify事件，把受影响的目录加入pending"""
+        if mask & inotify.IN_Q_OVERFLOW:
+            # 事件队列溢出，重新建立监控并认为所有目录都已变化
+            WATCHER_ERRORS.inc(stage='overflow')
+            for old_wd in list(self._wd_paths):
+                notifier.rm_watch(old_wd)
+            self._wd_paths.clear()
+            self._path_wds.clear()
+            self._add_tree(notifier, '', pending)
+            return
+
+        rel_dir = self._wd_paths.get(wd)
+        if rel_dir is None:
+            return
+        if mask & inotify.IN_IGNORED:
+            self._forget_wd(wd)
+            return
+        if mask & (inotify.IN_DELETE_SELF | inotify.IN_MOVE_SELF):
+            # 由父目录的事件负责通知
+            return
+
+        pending.add(rel_dir)
+        if mask & inotify.IN_ISDIR:
+            child = os.path.join(rel_dir, name) if rel_dir else name
+            if mask & (inotify.IN_CREATE | inotify.IN_MOVED_TO):
+                self._add_tree(notifier, child, pending)
+            elif mask & (inotify.IN_MOVED_FROM | inotify.IN_DELETE):
+                self._remove_tree(notifier, child)
+
+    def _add_tree(self, notifier, rel_dir, pending=None):
+        """递归为目录树添加监控"""
+        with WATCHER_SCAN.time(kind='add_tree'):
+            self._add_watches(notifier, rel_dir, pending)
+
+    def _add_watches(self, notifier, rel_dir, pending):
+        top = os.path.join(self.base_path, rel_dir) if rel_dir else self.base_path
+        for root, dirs, _ in os.walk(top):
+            rel = os.path.relpath(root, self.base_path)
+            rel = '' if rel == '.' else rel
+            if not rel and Config.INTERNAL_FOLDER_NAME in dirs:
+                # 内部文件夹（上传暂存等）不需要监控
+                dirs.remove(Config.INTERNAL_FOLDER_NAME)
+            try:
+                wd = notifier.add_watch(root)
+            except OSError as e:
+                if e.errno == 28:  # ENOSPC: 超出 max_user_watches
+                    print(f"inotify监控数量已达上限，部分子目录将不会被监控: {root}")
+                    self._watch_complete = False
+                    set_listing_cache_trusted(False)
+                    return
+                dirs[:] = []
+                continue
+            self._wd_paths[wd] = rel
+            self._path_wds[rel] = wd
+            if pending is not None:
+                pending.add(rel)
+
+    def _remove_tree(self, notifier, rel_dir):
+        """移除目录树的监控（目录被删除或移出）"""
+        prefix = rel_dir + os.sep
+        for rel, wd in list(self._path_wds.items()):
+            if rel == rel_dir or rel.startswith(prefix):
+                notifier.rm_watch(wd)
+                self._forget_wd(wd)
+
+    def _forget_wd(self, wd):
+        rel = self._wd_paths.pop(wd, None)
+        if rel is not None and self._path_wds.get(rel) == wd:
+            del self._path_wds[rel]
+
+
+def normalize_rel_dir(rel_dir):
+    """规范化相对目录，非法路径返回None"""
+    rel_dir = os.path.normpath(rel_dir or '').replace('\\', '/').strip('/')
+    if rel_dir == '.':
+        return ''
+    if rel_dir == '..' or rel_dir.startswith('../') or os.path.isabs(rel_dir):
+        return None
+    return rel_dir
+
+
+class ListingBroadcaster:
+    """目录列表增量广播
+
+    每个目录对应一个Socket.IO房间和一个递增的版本号。客户端订阅所在目录后，
+    目录变化时只向该房间推送以path为键的增删改条目。
+    """
+
+    def __init__(self, socketio, namespace='/file'):
+        self.socketio = socketio
+        self.namespace = namespace
+        self.lock = threading.Lock()
+        # 相对目录 -> 版本号
+        self.versions = {}
+        # 有订阅者的目录 -> (读取时的变化序号, {path: 条目})
+        self.snapshots = {}
+        # 目录 -> 变化序号，目录在锁外读取，据此丢弃比已保存的快照更旧的结果
+        self.changes = {}
+        # 目录 -> 订阅者数量，sid -> 目录
+        self.subscribers = {}
+        self.client_dirs = {}
+        self.listeners = []
+
+    def add_listener(self, callback):
+        """注册目录变化回调（上传、删除等操作和文件监控都会经过广播），callback(changed_dirs)"""
+        self.listeners.append(callback)
+
+    @staticmethod
+    def room(rel_dir):
+        return f'dir:{rel_dir}'
+
+    def version(self, rel_dir):
+        """获取目录当前版本号"""
+        return self.versions.get(rel_dir, 0)
+
+    def subscribe(self, sid, rel_dir):
+        """客户端切换到新目录，返回 (旧目录, 当前版本号)"""
+        snapshot = None
+        while True:
+            with self.lock:
+                if (snapshot is not None and rel_dir not in self.snapshots
+                        and self.changes.get(rel_dir, 0) == seq):
+                    self.snapshots[rel_dir] = (seq, snapshot)
+                current = self.snapshots.get(rel_dir)
+                if current is not None:
+                    old_dir = self._release(sid)
+                    # 重新订阅同一目录时，_release会丢弃刚保存的快照
+                    self.snapshots.setdefault(rel_dir, current)
+                    self.client_dirs[sid] = rel_dir
+                    self.subscribers[rel_dir] = self.subscribers.get(rel_dir, 0) + 1
+                    return old_dir, self.version(rel_dir)
+                seq = self.changes.get(rel_dir, 0)
+            # 在锁外读取目录，读取期间目录有变化时重新读取
+            snapshot = self._snapshot(rel_dir)
+
+    def unsubscribe(self, sid):
+        """客户端断开连接"""
+        with self.lock:
+            return self._release(sid)
+
+    def _release(self, sid):
+        rel_dir = self.client_dirs.pop(sid, None)
+        if rel_dir is not None:
+            count = self.subscribers.get(rel_dir, 0) - 1
+            if count > 0:
+                self.subscribers[rel_dir] = count
+            else:
+                self.subscribers.pop(rel_dir, None)
+                self.snapshots.pop(rel_dir, None)
+        return rel_dir
+
+    def _snapshot(self, rel_dir):
+        return {f['path']: f for f in get_file_info(Config.UPLOAD_FOLDER, rel_dir)}
+
+    def notify(self, rel_dir):
+        """目录内容可能已变化，计算差异并推送给订阅者"""
+        rel_dir = normalize_rel_dir(rel_dir)
+        if rel_dir is None:
+            return
+        invalidate_listing(Config.UPLOAD_FOLDER, rel_dir)
+        if rel_dir:
+            # 父目录列表中该子目录的大小和修改时间也会变化
+            invalidate_listing(Config.UPLOAD_FOLDER, rel_dir.rpartition('/')[0])
+        for callback in self.listeners:
+            try:
+                callback({rel_dir})
+            except Exception as e:
+                print(f"目录广播回调出错: {e}")
+        with self.lock:
+            seq = self.changes[rel_dir] = self.changes.get(rel_dir, 0) + 1
+            if rel_dir not in self.snapshots:
+                # 没有订阅者，只需让已缓存的版本失效
+                self.versions[rel_dir] = self.version(rel_dir) + 1
+                return
+        # 在锁外读取目录，不阻塞其他目录的通知和订阅
+        new = self._snapshot(rel_dir)
+        with self.lock:
+            current = self.snapshots.get(rel_dir)
+            if current is None:
+                self.versions[rel_dir] = self.version(rel_dir) + 1
+                return
+            if current[0] > seq:
+                # 之后的通知已经保存了更新的快照
+                return
+            old = current[1]
+            added = [entry for path, entry in new.items() if path not in old]
+            removed = [path for path in old if path not in new]
+            modified = [entry for path, entry in new.items()
+                        if path in old and old[path] != entry]
+            self.snapshots[rel_dir] = (seq, new)
+            if not (added or removed or modified):
+                return
+            version = self.versions[rel_dir] = self.version(rel_dir) + 1
+
+        self.socketio.emit('file_delta', {
+            'path': rel_dir,
+            'version': version,
+            'added': added,
+            'removed': removed,
+            'modified': modified
+        }, namespace=self.namespace, to=self.room(rel_dir))
+        SOCKET_EMITS.inc(event='file_delta')
+
+    def notify_many(self, rel_dirs):
+        """批量通知多个目录"""
+        for rel_dir in sorted(set(rel_dirs)):
+            self.notify(rel_dir)
\ No newline at end of file
@@ -0,0 +1,364 @@
+import os
+import time
+import heapq
+import pickle
+import threading
+from array import array
+from .config import Config
+from .utils import format_entry
+
+# 索引文件格式版本，结构变化时递增以触发重建
+INDEX_FORMAT = 2
+
+# 这些字符之后的匹配视为“词首”匹配
+_WORD_SEPARATORS = ' _-.()[]'
+
+
+def _join(rel_dir, name):
+    """索引中的相对路径统一用'/'分隔（与网页端一致，Windows下按路径前缀过滤和按深度排序才正确）"""
+    return f'{rel_dir}/{name}' if rel_dir else name
+
+
+def _split(rel_path):
+    parent, _, name = rel_path.rpartition('/')
+    return parent, name
+
+
+def _trigrams(text):
+    """文本的三元组集合"""
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class SearchIndex:
+    """文件名搜索索引
+
+    以三元组倒排表索引整个共享目录下的文件名。新条目的id单调递增，追加到
+    倒排表末尾即可保持有序；删除只打标记，累计过多时整体压缩。索引定期
+    持久化到数据目录，启动时加载后在后台与磁盘对账。
+    """
+
+    def __init__(self):
+        self.base_path = None
+        self.index_file = None
+        self.lock = threading.RLock()
+        self.ready = False
+        self.running = False
+        self.thread = None
+        self._stop_event = threading.Event()
+        # 构建期间收到的目录变化，检查ready和追加都在_pending_lock中进行，不会在交接时丢失
+        self._pending_lock = threading.Lock()
+        self._pending = set()
+        self._reset()
+
+    def _reset(self):
+        # id -> 相对路径 / 小写文件名（None表示已删除）
+        self.paths = []
+        self.names = []
+        self.is_dir = bytearray()
+        # 三元组 -> 有序id数组
+        self.grams = {}
+        # 相对目录 -> {文件名: id}
+        self.children = {}
+        # 相对目录 -> 目录mtime_ns，用于启动时对账
+        self.dir_mtimes = {}
+        self.deleted = 0
+        self.dirty = False
+
+    # ================= 生命周期 =================
+    def start(self, base_path):
+        """加载或构建索引，并启动后台维护线程"""
+        if self.running:
+            return
+        self.base_path = base_path
+        self.index_file = Config.share_data_path('search_index.pickle')
+        self.running = True
+        self._stop_event.clear()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """停止后台线程并保存索引"""
+        if not self.running:
+            return
+        self.running = False
+        self._stop_event.set()
+        if self.thread:
+            self.thread.join()
+        self.save()
+
+    def _run(self):
+        try:
+            if self.load():
+                self.ready = True
+                # 停机期间的变化：只重新扫描mtime变化过的目录
+                self.reconcile()
+            else:
+                self.build()
+                self.ready = True
+                self.save()
+        except Exception as e:
+            print(f"搜索索引构建出错: {e}")
+            self.ready = True
+        with self._pending_lock:
+            pending, self._pending = self._pending, set()
+        self.update_dirs(pending)
+        while not self._stop_event.wait(Config.SEARCH_INDEX_SAVE_INTERVAL):
+            try:
+                if self.dirty:
+                    self.save()
+            except Exception as e:
+                print(f"搜索索引保存出错: {e}")
+
+    # ================= 持久化 =================
+    def load(self):
+        """从磁盘加载索引，成功返回True"""
+        try:
+            with open(self.index_file, 'rb') as f:
+                data = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ValueError):
+            return False
+        if data.get('format') != INDEX_FORMAT or data.get('base_path') != os.path.abspath(self.base_path):
+            return False
+        with self.lock:
+            self._reset()
+            self.paths = data['paths']
+            self.names = data['names']
+            self.is_dir = data['is_dir']
+            self.grams = data['grams']
+            self.dir_mtimes = data['dir_mtimes']
+            self.deleted = data['deleted']
+            for i, path in enumerate(self.paths):
+                if path is not None:
+                    parent, name = _split(path)
+                    self.children.setdefault(parent, {})[name] = i
+        return True
+
+    def save(self):
+        """原子地保存索引"""
+        if not self.index_file:
+            return
+        with self.lock:
+            data = {
+                'format': INDEX_FORMAT,
+                'base_path': os.path.abspath(self.base_path),
+                'paths': self.paths,
+                'names': self.names,
+                'is_dir': self.is_dir,
+                'grams': self.grams,
+                'dir_mtimes': self.dir_mtimes,
+                'deleted': self.deleted,
+            }
+            tmp_file = self.index_file + '.tmp'
+            with open(tmp_file, 'wb') as f:
+                pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_file, self.index_file)
+            self.dirty = False
+
+    # ================= 索引维护 =================
+    def build(self):
+        """全量构建索引"""
+        started = time.time()
+        with self.lock:
+            self._reset()
+            self._add_tree('')
+            self.dirty = True
+        print(f"搜索索引构建完成: {len(self.paths)} 项，用时 {time.time() - started:.1f} 秒")
+
+    def reconcile(self):
+        """与磁盘对账，只更新mtime变化的目录"""
+        stack = ['']
+        while stack and self.running:
+            rel_dir = stack.pop()
+            abs_dir = os.path.join(self.base_path, rel_dir)
+            try:
+                mtime = os.stat(abs_dir).st_mtime_ns
+            except OSError:
+                continue
+            with self.lock:
+                if self.dir_mtimes.get(rel_dir) != mtime:
+                    self._update_dir(rel_dir)
+                subdirs = [_join(rel_dir, name) for name, i in self.children.get(rel_dir, {}).items() if self.is_dir[i]]
+            stack.extend(subdirs)
+
+    def update_dirs(self, rel_dirs):
+        """目录发生变化（文件监控回调）"""
+        rel_dirs = [rel_dir.replace(os.sep, '/') for rel_dir in rel_dirs]
+        with self._pending_lock:
+            if not self.ready:
+                # 构建期间的变化先记下，构建完成后再补上
+                self._pending.update(rel_dirs)
+                return
+        with self.lock:
+            for rel_dir in sorted(rel_dirs):
+                self._update_dir(rel_dir)
+            if self.deleted > 1000 and self.deleted > len(self.paths) // 4:
+                self._compact()
+
+    def _update_dir(self, rel_dir):
+        """增量更新单个目录的直接子项"""
+        abs_dir = os.path.join(self.base_path, rel_dir) if rel_dir else self.base_path
+        existing = self.children.get(rel_dir, {})
+        try:
+            mtime = os.stat(abs_dir).st_mtime_ns
+            with os.scandir(abs_dir) as entries:
+                current = {}
+                for entry in entries:
+                    if not rel_dir and entry.name == Config.INTERNAL_FOLDER_NAME:
+                        continue
+                    try:
+                        current[entry.name] = entry.is_dir()
+                    except OSError:
+                        continue
+        except OSError:
+            # 目录已不存在，其自身的条目由父目录的更新负责移除
+            for i in list(existing.values()):
+                self._remove(i)
+            self.children.pop(rel_dir, None)
+            self.dir_mtimes.pop(rel_dir, None)
+            return
+
+        for name, i in list(existing.items()):
+            if name not in current or bool(self.is_dir[i]) != current[name]:
+                self._remove(i)
+        existing = self.children.get(rel_dir, {})
+        for name, is_dir in current.items():
+            if name in existing:
+                continue
+            rel_path = _join(rel_dir, name)
+            self._add(rel_path, name, is_dir)
+            if is_dir:
+                self._add_tree(rel_path)
+        self.dir_mtimes[rel_dir] = mtime
+        self.dirty = True
+
+    def _add_tree(self, rel_dir):
+        """递归添加目录下的所有条目"""
+        stack = [rel_dir]
+        while stack:
+            current_dir = stack.pop()
+            abs_dir = os.path.join(self.base_path, current_dir) if current_dir else self.base_path
+            try:
+                self.dir_mtimes[current_dir] = os.stat(abs_dir).st_mtime_ns
+                entries = list(os.scandir(abs_dir))
+            except OSError:
+                continue
+            for entry in entries:
+                if not current_dir and entry.name == Config.INTERNAL_FOLDER_NAME:
+                    continue
+                try:
+                    is_dir = entry.is_dir()
+                except OSError:
+                    continue
+                rel_path = _join(current_dir, entry.name)
+                self._add(rel_path, entry.name, is_dir)
+                if is_dir:
+                    stack.append(rel_path)
+            # 让出执行权，协程服务器模式下构建索引时不会长时间阻塞请求
+            time.sleep(0)
+
+    def _add(self, rel_path, name, is_dir):
+        i = len(self.paths)
+        lower = name.lower()
+        self.paths.append(rel_path)
+        self.names.append(lower)
+        self.is_dir.append(1 if is_dir else 0)
+        for gram in _trigrams(lower):
+            postings = self.grams.get(gram)
+            if postings is None:
+                postings = self.grams[gram] = array('I')
+            postings.append(i)
+        self.children.setdefault(_split(rel_path)[0], {})[name] = i
+
+    def _remove(self, i):
+        rel_path = self.paths[i]
+        if rel_path is None:
+            return
+        if self.is_dir[i]:
+            for child in list(self.children.pop(rel_path, {}).values()):
+                self._remove(child)
+            self.dir_mtimes.pop(rel_path, None)
+        parent, name = _split(rel_path)
+        siblings = self.children.get(parent)
+        if siblings is not None and siblings.get(name) == i:
+            del siblings[name]
+        # 倒排表中保留旧id，查询时通过paths[i] is None过滤
+        self.paths[i] = None
+        self.names[i] = None
+        self.deleted += 1
+
+    def _compact(self):
+        """清除已删除条目，重新编号"""
+        live = [(path, bool(self.is_dir[i])) for i, path in enumerate(self.paths) if path is not None]
+        dir_mtimes = self.dir_mtimes
+        self._reset()
+        for path, is_dir in live:
+            self._add(path, _split(path)[1], is_dir)
+        self.dir_mtimes = dir_mtimes
+        self.dirty = True
+
+    # ================= 查询 =================
+    def search(self, query, limit=50, path='', file_type=None):
+        """搜索文件名，所有关键词都需出现在文件名中
+
+        返回 (排序后的条目列表, 是否因匹配过多只对部分结果排序)。
+        """
+        terms = [term for term in query.lower().split() if term]
+        if not terms or not self.ready:
+            return [], False
+        extensions = Config.FILE_TYPES.get(file_type) if file_type else None
+        prefix = path.strip('/') + '/' if path and path.strip('/') else ''
+
+        with self.lock:
+            names, paths, is_dir = self.names, self.paths, self.is_dir
+            matched = []
+            truncated = False
+            for i in self._candidates(terms):
+                name = names[i]
+                if name is None or not all(term in name for term in terms):
+                    continue
+                if prefix and not paths[i].startswith(prefix):
+                    continue
+                if extensions is not None and (is_dir[i] or os.path.splitext(name)[1] not in extensions):
+                    continue
+                matched.append(i)
+                # 匹配项过多时只对前一部分排序，保证查询耗时有上限
+                if len(matched) >= Config.SEARCH_RANK_LIMIT:
+                    truncated = True
+                    break
+            term = terms[0]
+            best = heapq.nsmallest(limit, matched, key=lambda i: (
+                self._score(names[i], term), paths[i].count('/'), len(names[i]), paths[i]))
+            hits = [(paths[i], bool(is_dir[i])) for i in best]
+
+        results = []
+        for rel_path, hit_is_dir in hits:
+            entry = format_entry(os.path.join(self.base_path, rel_path), rel_path, hit_is_dir)
+            if entry is not None:
+                results.append(entry)
+        return results, truncated
+
+    def _candidates(self, terms):
+        """选出最稀有的三元组的倒排表作为候选，短关键词时退化为全量扫描"""
+        best = None
+        for term in terms:
+            for gram in _trigrams(term):
+                postings = self.grams.get(gram)
+                if postings is None:
+                    return ()
+                if best is None or len(postings) < len(best):
+                    best = postings
+        return best if best is not None else range(len(self.paths))
+
+    @staticmethod
+    def _score(name, term):
+        """排序分值：完全匹配 < 前缀匹配 < 词首匹配 < 其他"""
+        if name == term or os.path.splitext(name)[0] == term:
+            return 0
+        if name.startswith(term):
+            return 1
+        pos = name.find(term)
+        while pos > 0:
+            if name[pos - 1] in _WORD_SEPARATORS:
+                return 2
+            pos = name.find(term, pos + 1)
+        return 3
\ No newline at end of file
@@ -0,0 +1,231 @@
+import os
+import re
+import json
+import time
+import codecs
+import functools
+import threading
+from array import array
+from collections import OrderedDict
+from .config import Config
+from .metrics import cache_result
+
+# 扫描换行符时每次读取的大小；检测编码时读取的样本大小
+READ_SIZE = 1024 * 1024
+SAMPLE_SIZE = 64 * 1024
+
+_index_cache = OrderedDict()
+_index_lock = threading.Lock()
+
+
+def detect_encoding(file_path):
+    """根据文件开头的样本检测编码：UTF-8（含BOM）或GBK"""
+    with open(file_path, 'rb') as f:
+        sample = f.read(SAMPLE_SIZE)
+    if sample.startswith(codecs.BOM_UTF8):
+        return 'utf-8-sig'
+    try:
+        # 样本末尾可能截断了一个多字节字符，使用增量解码器容忍这种情况
+        codecs.getincrementaldecoder('utf-8')().decode(sample, final=False)
+        return 'utf-8'
+    except UnicodeDecodeError:
+        return 'gbk'
+
+
+def decode_text(data, encoding, at_start=False):
+    """解码一段文本，只有文件开头才去除BOM"""
+    if encoding == 'utf-8-sig' and not at_start:
+        encoding = 'utf-8'
+    return data.decode(encoding, errors='replace' if encoding.startswith('utf-8') else 'ignore')
+
+
+def _utf8_boundary(data, cut):
+    """把截断位置前移到UTF-8字符边界，避免切开多字节字符"""
+    for i in range(cut - 1, max(cut - 4, -1), -1):
+        byte = data[i]
+        if byte & 0xC0 != 0x80:
+            # 找到字符首字节，判断该字符是否完整
+            if byte < 0x80:
+                length = 1
+            elif byte < 0xE0:
+                length = 2
+            elif byte < 0xF0:
+                length = 3
+            else:
+                length = 4
+            return i if i + length > cut and i > 0 else cut
+    return cut
+
+
+@functools.lru_cache(maxsize=8)
+def _page_pattern(chunk_size):
+    """一次匹配chunk_size行的正则，由正则引擎在C层面数换行符"""
+    return re.compile(rb'(?:[^\n]*\n){%d}' % chunk_size)
+
+
+class TextIndex:
+    """文本文件的稀疏分页索引
+
+    只记录每页起始的字节偏移（每页chunk_size行，超过字节上限时提前在行尾分页，
+    超长行按字节数截断），读取任意一页只需一次seek和有限的读取。索引按需向后
+    扩展，文件大小或修改时间变化时失效。
+    """
+
+    def __init__(self, file_path, chunk_size, stat):
+        self.file_path = file_path
+        self.chunk_size = chunk_size
+        self.size = stat.st_size
+        self.mtime_ns = stat.st_mtime_ns
+        self.encoding = detect_encoding(file_path)
+        self.offsets = array('Q', [0])
+        # offsets的最后一项是否已到达文件末尾
+        self.complete = self.size == 0
+        self.lock = threading.Lock()
+
+    def matches(self, stat):
+        return stat.st_size == self.size and stat.st_mtime_ns == self.mtime_ns
+
+    def _ensure(self, f, page):
+        """顺序扫描，把索引扩展到能定位第page页的结束位置"""
+        offsets = self.offsets
+        if self.complete or len(offsets) > page + 1:
+            return
+        page_pattern = _page_pattern(self.chunk_size)
+        f.seek(offsets[-1])
+        # buf保存从文件偏移buf_start开始的数据，pos为当前页在buf中的起点
+        buf = b''
+        buf_start = offsets[-1]
+        pos = 0
+        while len(offsets) <= page + 1:
+            limit = pos + Config.TEXT_PAGE_MAX_BYTES
+            match = page_pattern.match(buf, pos, limit)
+            if match:
+                end = match.end()
+            elif limit <= len(buf):
+                # 一页超过字节上限时在上限内最后一个换行处分页，只有单行超长时才在上限处截断
+                newline = buf.rfind(b'\n', pos, limit)
+                if newline >= 0:
+                    end = newline + 1
+                else:
+                    end = _utf8_boundary(buf, limit) if self.encoding.startswith('utf-8') else limit
+            else:
+                data = f.read(min(READ_SIZE, self.size - buf_start - len(buf)))
+                if data:
+                    buf = buf[pos:] + data
+                    buf_start += pos
+                    pos = 0
+                    continue
+                # 到达文件末尾，剩余部分作为最后一页
+                if len(buf) > pos:
+                    offsets.append(buf_start + len(buf))
+                self.complete = True
+                return
+            offsets.append(buf_start + end)
+            pos = end
+            if buf_start + end >= self.size:
+                self.complete = True
+                return
+
+    def read_page(self, page):
+        """读取第page页，返回 (内容, 是否还有更多)"""
+        with self.lock, open(self.file_path, 'rb') as f:
+            self._ensure(f, page)
+            if page + 1 >= len(self.offsets):
+                return '', False
+            start, end = self.offsets[page], self.offsets[page + 1]
+            f.seek(start)
+            data = f.read(end - start)
+        return decode_text(data, self.encoding, at_start=start == 0), end < self.size
+
+
+def get_text_index(file_path, chunk_size=100):
+    """获取（必要时重建）文件的分页索引"""
+    stat = os.stat(file_path)
+    key = (os.path.abspath(file_path), chunk_size)
+    with _index_lock:
+        index = _index_cache.get(key)
+        if index is not None and index.matches(stat):
+            _index_cache.move_to_end(key)
+            cache_result('text_index', True)
+            return index
+    cache_result('text_index', False)
+    index = TextIndex(file_path, chunk_size, stat)
+    with _index_lock:
+        _index_cache[key] = index
+        _index_cache.move_to_end(key)
+        while len(_index_cache) > Config.TEXT_INDEX_CACHE_SIZE:
+            _index_cache.popitem(last=False)
+    return index
+
+
+def read_last_lines(file_path, lines, encoding=None):
+    """从文件末尾向前读取最后若干行，返回 (内容, 末尾偏移)"""
+    encoding = encoding or detect_encoding(file_path)
+    with open(file_path, 'rb') as f:
+        size = f.seek(0, os.SEEK_END)
+        pos = size
+        data = b''
+        # 多读一个换行符，保证第一行是完整的
+        while pos > 0 and data.count(b'\n') <= lines and len(data) < Config.TEXT_PAGE_MAX_BYTES:
+            step = min(64 * 1024, pos)
+            pos -= step
+            f.seek(pos)
+            data = f.read(step) + data
+    trailing = data.endswith(b'\n')
+    parts = data.split(b'\n')
+    if trailing:
+        parts.pop()
+    at_start = pos == 0 and len(parts) <= lines
+    data = b'\n'.join(parts[-lines:] if lines > 0 else []) + (b'\n' if trailing and lines > 0 else b'')
+    return decode_text(data, encoding, at_start=at_start), size
+
+
+def iter_tail_events(file_path, lines=None):
+    """以Server-Sent Events的形式持续推送文件新增的行
+
+    先发送最后若干行，之后定期检查文件大小，只发送完整的新行；文件被截断
+    或替换时从头重新开始。
+    """
+    lines = Config.TEXT_TAIL_LINES if lines is None else lines
+    encoding = detect_encoding(file_path)
+
+    def event(payload):
+        return f'data: {json.dumps(payload, ensure_ascii=False)}\n\n'
+
+    content, position = read_last_lines(file_path, lines, encoding)
+    inode = os.stat(file_path).st_ino
+    yield event({'content': content, 'reset': True})
+
+    idle = 0.0
+    while True:
+        time.sleep(Config.TEXT_TAIL_INTERVAL)
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            yield event({'content': '', 'deleted': True})
+            return
+        if stat.st_ino != inode or stat.st_size < position:
+            # 日志轮转或文件被截断
+            inode = stat.st_ino
+            position = 0
+            yield event({'content': '', 'reset': True})
+        if stat.st_size == position:
+            idle += Config.TEXT_TAIL_INTERVAL
+            if idle >= 15:
+                # 注释行作为心跳，同时让服务器发现已断开的连接
+                idle = 0.0
+                yield ': keepalive\n\n'
+            continue
+
+        idle = 0.0
+        with open(file_path, 'rb') as f:
+            f.seek(position)
+            data = f.read(min(stat.st_size - position, Config.TEXT_PAGE_MAX_BYTES))
+        end = data.rfind(b'\n')
+        if end < 0 and len(data) < Config.TEXT_PAGE_MAX_BYTES:
+            # 最后一行还没写完，等待换行
+            continue
+        if end >= 0:
+            data = data[:end + 1]
+        yield event({'content': decode_text(data, encoding, at_start=position == 0)})
+        position += len(data)
\ No newline at end of file
@@ -0,0 +1,259 @@
+import time
+import threading
+from flask import request, jsonify
+from .config import Config
+from .metrics import TRANSFER_ENDPOINTS, TRANSFER_QUEUED, TRANSFER_THROTTLED
+
+# 限速时每次发送或读取的最小/最大字节数
+MIN_CHUNK = 16 * 1024
+MAX_CHUNK = 1024 * 1024
+
+
+class TokenBucket:
+    """令牌桶，速率从函数读取（修改配置后立即生效），0为不限制
+
+    令牌不足时记为欠账并返回需要等待的时间，先到的请求先还清，多个传输
+    自然地平分带宽。
+    """
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.lock = threading.Lock()
+        self.tokens = 0.0
+        self.updated = time.monotonic()
+
+    def consume(self, amount):
+        """取走amount字节的令牌，返回需要等待的秒数"""
+        rate = self.rate()
+        with self.lock:
+            now = time.monotonic()
+            if rate <= 0:
+                self.tokens = 0.0
+                self.updated = now
+                return 0
+            burst = rate * Config.TRANSFER_BURST_SECONDS
+            self.tokens = min(burst, self.tokens + (now - self.updated) * rate)
+            self.updated = now
+            self.tokens -= amount
+            return -self.tokens / rate if self.tokens < 0 else 0
+
+
+class Throttle:
+    """一次传输的限速：同时受所有设备合计和该设备的令牌桶限制
+
+    交互请求（目录列表、文本预览、缩略图等）wait为False：只计入流量、从不等待，
+    占用的带宽由正在进行的大文件传输让出，从而优先得到响应。这是有意的取舍：
+    交互请求与大文件传输共用令牌桶，短时间内大量预览（例如快速翻看缩略图）
+    产生的欠账会让排队和正在进行的下载相应地放慢，直到欠账还清；交互请求
+    本身的总流量不受限速约束。
+    """
+
+    def __init__(self, buckets, wait=True):
+        self.buckets = buckets
+        self.wait = wait
+
+    def chunk_size(self, default):
+        """限速时减小每次发送的大小，使速率平稳"""
+        rates = [bucket.rate() for bucket in self.buckets]
+        rates = [rate for rate in rates if rate > 0]
+        if not rates:
+            return default
+        return max(MIN_CHUNK, min(default, MAX_CHUNK, int(min(rates) / 10)))
+
+    def consume(self, amount):
+        delay = max(bucket.consume(amount) for bucket in self.buckets)
+        if delay > 0 and self.wait:
+            TRANSFER_THROTTLED.inc(delay)
+            time.sleep(delay)
+
+
+class _ThrottledInput:
+    """按限速读取上传的请求体"""
+
+    def __init__(self, stream, throttle):
+        self.stream = stream
+        self.throttle = throttle
+
+    def read(self, size=-1):
+        if size is None or size < 0 or size > MAX_CHUNK:
+            size = self.throttle.chunk_size(MAX_CHUNK)
+        data = self.stream.read(size)
+        if data:
+            self.throttle.consume(len(data))
+        return data
+
+    def readline(self, size=-1):
+        data = self.stream.readline(size)
+        if data:
+            self.throttle.consume(len(data))
+        return data
+
+
+class _ReleaseAfter:
+    """包装响应体，WSGI服务器关闭响应（发送完毕或客户端断开）时释放传输名额
+
+    不用生成器实现：生成器在开始迭代之前被关闭时不会执行finally，客户端在收到
+    第一块数据前断开时名额就永远不会释放。
+    """
+
+    def __init__(self, iterable, release):
+        self.iterable = iterable
+        self.release = release
+        self.released = False
+
+    def __iter__(self):
+        return iter(self.iterable)
+
+    def close(self):
+        try:
+            close = getattr(self.iterable, 'close', None)
+            if close is not None:
+                close()
+        finally:
+            if not self.released:
+                self.released = True
+                self.release()
+
+
+class TransferScheduler:
+    """传输调度：按设备（IP）和全局限速，并限制每个设备同时进行的大文件传输数
+
+    上传在开始读取请求体之前取得名额，下载在视图打开文件之前取得名额，名额用完
+    时排队等待，超时返回429。交互请求不占名额也不等待限速。
+    """
+
+    def __init__(self):
+        self.cond = threading.Condition()
+        # 设备IP -> 正在进行的大文件传输数
+        self.active = {}
+        self.lock = threading.Lock()
+        # (方向, 设备IP或None) -> 令牌桶，None为所有设备合计
+        self.buckets = {}
+
+    def configure(self, rate_total=None, rate_per_client=None, max_per_client=None):
+        """运行时修改限速设置（图形界面的设置页调用）"""
+        if rate_total is not None:
+            Config.TRANSFER_RATE_TOTAL = max(0, int(rate_total))
+        if rate_per_client is not None:
+            Config.TRANSFER_RATE_PER_CLIENT = max(0, int(rate_per_client))
+        if max_per_client is not None:
+            Config.TRANSFER_MAX_PER_CLIENT = max(0, int(max_per_client))
+        # 名额增加后唤醒排队的传输
+        with self.cond:
+            self.cond.notify_all()
+
+    def _bucket(self, direction, client):
+        key = (direction, client)
+        with self.lock:
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                if len(self.buckets) > 1000:
+                    # 清理长时间没有传输的设备
+                    idle = time.monotonic() - 60
+                    for old_key in [k for k, b in self.buckets.items() if k[1] and b.updated < idle]:
+                        del self.buckets[old_key]
+                if client is None:
+                    bucket = TokenBucket(lambda: Config.TRANSFER_RATE_TOTAL)
+                else:
+                    bucket = TokenBucket(lambda: Config.TRANSFER_RATE_PER_CLIENT)
+                self.buckets[key] = bucket
+            return bucket
+
+    def throttle(self, direction, client, wait=True):
+        return Throttle([self._bucket(direction, None), self._bucket(direction, client)], wait)
+
+    def acquire(self, client):
+        """取得一个传输名额，排队超时返回False"""
+        deadline = time.monotonic() + Config.TRANSFER_QUEUE_TIMEOUT
+        with self.cond:
+            queued = False
+            try:
+                while 0 < Config.TRANSFER_MAX_PER_CLIENT <= self.active.get(client, 0):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return False
+                    if not queued:
+                        queued = True
+                        TRANSFER_QUEUED.inc()
+                    self.cond.wait(remaining)
+            finally:
+                if queued:
+                    TRANSFER_QUEUED.dec()
+            self.active[client] = self.active.get(client, 0) + 1
+            return True
+
+    def release(self, client):
+        with self.cond:
+            count = self.active.get(client, 0) - 1
+            if count > 0:
+                self.active[client] = count
+            else:
+                self.active.pop(client, None)
+            self.cond.notify_all()
+
+
+def _busy():
+    response = jsonify({'error': '同时进行的传输过多，请稍后重试'})
+    response.status_code = 429
+    response.headers['Retry-After'] = '5'
+    return response
+
+
+def _transfer_direction():
+    """在视图运行前判断请求是否为需要排队的大文件传输，返回 'upload' / 'download' / None"""
+    direction = TRANSFER_ENDPOINTS.get(request.endpoint)
+    if direction == 'download':
+        if request.method == 'HEAD':
+            return None
+        # 文本分页预览和实时跟踪属于交互请求
+        if request.endpoint == 'view_file' and request.view_args.get('filepath', '').lower().endswith('.txt'):
+            return None
+    return direction
+
+
+def enable_throttling(app, scheduler):
+    """注册请求钩子，对上传下载限速并限制每个设备的并发传输数
+
+    名额在视图运行之前取得（排队时还没有打开文件），视图出错或返回的不是文件
+    内容（404、304等）时在请求结束时释放，文件内容发送完毕后释放。
+    """
+
+    @app.before_request
+    def _start_transfer():
+        direction = _transfer_direction()
+        if direction is None:
+            return None
+        client = request.remote_addr
+        if not scheduler.acquire(client):
+            return _busy()
+        request.environ['cloud_disk.transfer_slot'] = client
+        if direction == 'upload':
+            # 视图读取请求体之前替换输入流
+            request.environ['wsgi.input'] = _ThrottledInput(request.environ['wsgi.input'],
+                                                            scheduler.throttle('upload', client))
+        return None
+
+    @app.teardown_request
+    def _finish_transfer(exc=None):
+        client = request.environ.pop('cloud_disk.transfer_slot', None)
+        if client is not None:
+            scheduler.release(client)
+
+    @app.after_request
+    def _schedule_response(response):
+        client = request.remote_addr
+        bulk = (TRANSFER_ENDPOINTS.get(request.endpoint) == 'download' and response.direct_passthrough
+                and response.status_code in (200, 206) and 'cloud_disk.transfer_slot' in request.environ)
+        if not bulk:
+            # 交互请求只计入流量，不等待
+            if response.direct_passthrough:
+                request.environ['cloud_disk.throttle'] = scheduler.throttle('download', client, wait=False)
+            elif response.is_sequence and (Config.TRANSFER_RATE_TOTAL or Config.TRANSFER_RATE_PER_CLIENT):
+                scheduler.throttle('download', client, wait=False).consume(response.calculate_content_length() or 0)
+            return response
+        # 名额交给响应体，发送完毕后释放（而不是在请求结束时）
+        request.environ.pop('cloud_disk.transfer_slot')
+        # 文件内容在发送时（transfer模块中）按此限速
+        request.environ['cloud_disk.throttle'] = scheduler.throttle('download', client)
+        response.response = _ReleaseAfter(response.response, lambda: scheduler.release(client))
+        return response
\ No newline at end of file
@@ -0,0 +1,231 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from .config import Config
+from .hashing import hash_file
+from .metrics import cache_result
+
+
+def _render_thumbnail(src_path, dst_path, size, quality):
+    """在子进程中生成缩略图（JPEG），先写临时文件再原子替换"""
+    from PIL import Image, ImageOps
+
+    with Image.open(src_path) as img:
+        # JPEG可以在解码时直接按比例缩小，大幅减少解码耗时和内存
+        img.draft('RGB', (size, size))
+        img = ImageOps.exif_transpose(img)
+        img.thumbnail((size, size), Image.LANCZOS)
+        if img.mode in ('RGBA', 'LA', 'P'):
+            img = img.convert('RGBA')
+            background = Image.new('RGB', img.size, (255, 255, 255))
+            background.paste(img, mask=img.getchannel('A'))
+            img = background
+        elif img.mode != 'RGB':
+            img = img.convert('RGB')
+        tmp_path = f'{dst_path}.{os.getpid()}.tmp'
+        img.save(tmp_path, 'JPEG', quality=quality, optimize=True)
+    os.replace(tmp_path, dst_path)
+    return os.path.getsize(dst_path)
+
+
+class ThumbnailService:
+    """缩略图生成与缓存
+
+    缩略图在进程池中生成，不占用Web服务进程的GIL。缓存以文件内容的哈希（与
+    哈希索引相同的分块SHA-256）命名，文件重命名或复制后仍能命中；缓存总大小超出
+    上限时按最近使用时间淘汰。
+    """
+
+    def __init__(self, indexed_digest=None):
+        self.cache_dir = None
+        # 可选的已知哈希来源 indexed_digest(绝对路径, stat)，未索引时返回None
+        self.indexed_digest = indexed_digest
+        self.lock = threading.Lock()
+        self.executor = None
+        # 缓存文件名 -> 大小，按最近使用排序
+        self.entries = OrderedDict()
+        self.total_size = 0
+        # 正在生成的缩略图：缓存文件名 -> Future
+        self.pending = {}
+        # (绝对路径, 大小, mtime) -> 内容哈希
+        self.fingerprints = OrderedDict()
+        # 后台预生成
+        self._pregen_dirs = set()
+        self._pregen_event = threading.Event()
+        self._pregen_thread = None
+
+    # ================= 生命周期 =================
+    def start(self):
+        """加载已有的缓存文件，按修改时间（即最近使用时间）排序"""
+        self.cache_dir = os.path.join(Config.DATA_FOLDER, 'thumbnails')
+        os.makedirs(self.cache_dir, exist_ok=True)
+        files = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith('.jpg'):
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, entry.name, stat.st_size))
+            elif entry.name.endswith('.tmp'):
+                # 上次异常退出留下的临时文件
+                try:
+                    os.remove(entry.path)
+                except OSError:
+                    pass
+        with self.lock:
+            self.entries.clear()
+            self.total_size = 0
+            for _, name, size in sorted(files):
+                self.entries[name] = size
+                self.total_size += size
+        if Config.THUMBNAIL_PREGENERATE and self._pregen_thread is None:
+            self._pregen_thread = threading.Thread(target=self._pregenerate_loop, daemon=True)
+            self._pregen_thread.start()
+
+    def stop(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+    def _get_executor(self):
+        with self.lock:
+            if self.executor is None:
+                self.executor = ProcessPoolExecutor(max_workers=Config.THUMBNAIL_WORKERS)
+            return self.executor
+
+    # ================= 缩略图 =================
+    @staticmethod
+    def is_supported(filename):
+        return os.path.splitext(filename)[1].lower() in Config.THUMBNAIL_EXTENSIONS
+
+    @staticmethod
+    def normalize_size(size):
+        """把请求的尺寸归到最接近的预设尺寸，避免缓存大量不同尺寸"""
+        for preset in sorted(Config.THUMBNAIL_SIZES):
+            if size <= preset:
+                return preset
+        return max(Config.THUMBNAIL_SIZES)
+
+    def fingerprint(self, file_path):
+        """文件内容的哈希，按路径、大小和修改时间缓存
+
+        哈希索引已计算过的文件直接使用其结果，否则读取整个文件计算（大文件需要
+        一些时间，结果与哈希索引一致）。
+        """
+        stat = os.stat(file_path)
+        key = (file_path, stat.st_size, stat.st_mtime_ns)
+        with self.lock:
+            digest = self.fingerprints.get(key)
+            if digest is not None:
+                self.fingerprints.move_to_end(key)
+                return digest
+        digest = self.indexed_digest(file_path, stat) if self.indexed_digest else None
+        if digest is None:
+            digest = hash_file(file_path)
+        with self.lock:
+            self.fingerprints[key] = digest
+            while len(self.fingerprints) > 10000:
+                self.fingerprints.popitem(last=False)
+        return digest
+
+    def submit(self, file_path, size):
+        """返回 (缓存文件路径, Future)，缓存命中时Future为None"""
+        if self.cache_dir is None:
+            self.start()
+        name = f'{self.fingerprint(file_path)}-{size}.jpg'
+        cache_path = os.path.join(self.cache_dir, name)
+        with self.lock:
+            cached = name in self.entries
+            if cached:
+                self.entries.move_to_end(name)
+        cache_result('thumbnail', cached)
+        if cached:
+            try:
+                # 更新修改时间，重启后仍能按最近使用时间淘汰
+                os.utime(cache_path)
+                return cache_path, None
+            except FileNotFoundError:
+                with self.lock:
+                    self.total_size -= self.entries.pop(name, 0)
+            except OSError:
+                return cache_path, None
+
+        executor = self._get_executor()
+        with self.lock:
+            future = self.pending.get(name)
+            created = future is None
+            if created:
+                future = executor.submit(_render_thumbnail, file_path, cache_path, size,
+                                         Config.THUMBNAIL_QUALITY)
+                self.pending[name] = future
+        if created:
+            future.add_done_callback(lambda f: self._finished(name, f))
+        return cache_path, future
+
+    def get(self, file_path, size, timeout=None):
+        """获取缩略图路径，必要时等待生成完成（失败时抛出异常）"""
+        cache_path, future = self.submit(file_path, size)
+        if future is not None:
+            future.result(timeout=timeout or Config.THUMBNAIL_TIMEOUT)
+        return cache_path
+
+    def _finished(self, name, future):
+        with self.lock:
+            self.pending.pop(name, None)
+            if future.cancelled() or future.exception() is not None:
+                return
+            if name not in self.entries:
+                self.entries[name] = future.result()
+                self.total_size += self.entries[name]
+            evict = []
+            while self.total_size > Config.THUMBNAIL_CACHE_MAX_BYTES and len(self.entries) > 1:
+                old_name, old_size = self.entries.popitem(last=False)
+                self.total_size -= old_size
+                evict.append(old_name)
+        for old_name in evict:
+            try:
+                os.remove(os.path.join(self.cache_dir, old_name))
+            except OSError:
+                pass
+
+    # ================= 后台预生成 =================
+    def pregenerate_dirs(self, rel_dirs):
+        """目录发生变化（文件监控回调），为其中的新图片预生成缩略图"""
+        if not Config.THUMBNAIL_PREGENERATE:
+            return
+        with self.lock:
+            self._pregen_dirs.update(rel_dirs)
+        self._pregen_event.set()
+
+    def _pregenerate_loop(self):
+        while True:
+            self._pregen_event.wait()
+            self._pregen_event.clear()
+            # 等待一批文件复制完成后再处理
+            time.sleep(1)
+            with self.lock:
+                rel_dirs, self._pregen_dirs = self._pregen_dirs, set()
+            for rel_dir in sorted(rel_dirs):
+                try:
+                    self._pregenerate_dir(rel_dir)
+                except Exception as e:
+                    print(f"缩略图预生成出错: {e}")
+
+    def _pregenerate_dir(self, rel_dir):
+        abs_dir = os.path.join(Config.UPLOAD_FOLDER, rel_dir) if rel_dir else Config.UPLOAD_FOLDER
+        try:
+            entries = [entry.path for entry in os.scandir(abs_dir)
+                       if self.is_supported(entry.name) and entry.is_file()]
+        except OSError:
+            return
+        for file_path in entries:
+            try:
+                # 逐个等待，避免大量图片同时占满进程池而影响前台请求
+                _, future = self.submit(file_path, Config.THUMBNAIL_DEFAULT_SIZE)
+                if future is not None:
+                    future.result()
+            except Exception:
+                continue
\ No newline at end of file
@@ -0,0 +1,328 @@
+import os
+import uuid
+import select
+import zipfile
+import mimetypes
+from urllib.parse import quote
+from flask import Response, request
+from werkzeug.http import parse_range_header, http_date, parse_date, quote_etag, parse_etags
+from .config import Config
+
+# 非零拷贝方式时每次读取的大小；sendfile每次调用发送的最大字节数
+READ_SIZE = 1024 * 1024
+SENDFILE_SLICE = 8 * 1024 * 1024
+# 多段Range请求允许的最大段数，超出时返回完整文件
+MAX_RANGES = 16
+# 打包下载时缓冲区超过该大小就发送给客户端
+ZIP_FLUSH_SIZE = 256 * 1024
+
+
+def make_etag(stat):
+    """根据inode、大小和修改时间生成ETag"""
+    return f'{stat.st_ino:x}-{stat.st_size:x}-{stat.st_mtime_ns:x}'
+
+
+def content_disposition(filename, as_attachment):
+    """生成支持中文文件名的Content-Disposition头"""
+    disposition = 'attachment' if as_attachment else 'inline'
+    ascii_filename = filename.encode('ascii', 'ignore').decode('ascii').replace('"', '')
+    return f"{disposition}; filename=\"{ascii_filename}\"; filename*=UTF-8''{quote(filename)}"
+
+
+def _parse_ranges(header, size):
+    """解析Range头，返回 [(start, end)] 列表（end不含）
+
+    头无效时返回None（按完整文件处理），所有区间都无法满足时返回空列表。
+    """
+    parsed = parse_range_header(header)
+    if parsed is None or parsed.units != 'bytes':
+        return None
+    ranges = []
+    for start, stop in parsed.ranges:
+        if start < 0:
+            start, stop = max(size + start, 0), size
+        elif stop is None or stop > size:
+            stop = size
+        if start < stop:
+            ranges.append((start, stop))
+    if len(ranges) > MAX_RANGES:
+        return None
+    # 合并重叠的区间，避免重复发送
+    merged = []
+    for start, stop in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], stop))
+        else:
+            merged.append((start, stop))
+    return merged
+
+
+def _range_allowed(etag, last_modified):
+    """If-Range条件满足时才按Range响应"""
+    if_range = request.headers.get('If-Range')
+    if not if_range:
+        return True
+    if if_range.startswith('"') or if_range.startswith('W/'):
+        return if_range == quote_etag(etag)
+    date = parse_date(if_range)
+    return date is not None and int(date.timestamp()) == int(last_modified)
+
+
+def _wait_writable(sock):
+    """非阻塞/带超时的socket暂时写不进去时等待"""
+    _, writable, _ = select.select([], [sock], [], sock.gettimeout())
+    if not writable:
+        raise TimeoutError('发送超时')
+
+
+def _sendfile(sock, fd, start, end, throttle=None):
+    """通过sendfile零拷贝发送文件的一段"""
+    offset = start
+    slice_size = throttle.chunk_size(SENDFILE_SLICE) if throttle else SENDFILE_SLICE
+    while offset < end:
+        try:
+            sent = os.sendfile(sock.fileno(), fd, offset, min(slice_size, end - offset))
+        except BlockingIOError:
+            _wait_writable(sock)
+            continue
+        if sent == 0:
+            break
+        offset += sent
+        if throttle:
+            throttle.consume(sent)
+
+
+def _sendall(sock, data):
+    view = memoryview(data)
+    while view:
+        try:
+            sent = sock.send(view)
+        except BlockingIOError:
+            _wait_writable(sock)
+            continue
+        view = view[sent:]
+
+
+def _iter_body(file_path, parts, environ):
+    """响应体：parts由bytes（分段头）和(start, end)文件区间组成
+
+    服务器提供原始socket（Werkzeug）且系统支持sendfile时，先让服务器发出
+    响应头，再由内核直接把文件内容写入socket；否则按块读取文件。
+    """
+    sock = environ.get('werkzeug.socket')
+    # 传输调度在返回响应前设置的限速（开始迭代时才读取）
+    throttle = environ.get('cloud_disk.throttle')
+    read_size = throttle.chunk_size(READ_SIZE) if throttle else READ_SIZE
+    with open(file_path, 'rb') as f:
+        if sock is not None and hasattr(os, 'sendfile'):
+            # 空数据块会让服务器立即发送状态行和响应头
+            yield b''
+            try:
+                for part in parts:
+                    if isinstance(part, bytes):
+                        _sendall(sock, part)
+                    else:
+                        _sendfile(sock, f.fileno(), *part, throttle)
+            except (BrokenPipeError, ConnectionResetError, TimeoutError):
+                # 客户端中途断开（例如视频拖动进度条）
+                return
+            return
+
+        for part in parts:
+            if isinstance(part, bytes):
+                yield part
+                continue
+            start, end = part
+            f.seek(start)
+            remaining = end - start
+            while remaining > 0:
+                data = f.read(min(read_size, remaining))
+                if not data:
+                    break
+                remaining -= len(data)
+                if throttle:
+                    throttle.consume(len(data))
+                yield data
+
+
+def send_file_range(file_path, download_name=None, as_attachment=False, mimetype=None):
+    """发送文件，支持单段/多段Range、ETag、If-None-Match和If-Range
+
+    Werkzeug服务器下使用os.sendfile零拷贝发送文件内容。
+    """
+    stat = os.stat(file_path)
+    size = stat.st_size
+    etag = make_etag(stat)
+    download_name = download_name or os.path.basename(file_path)
+    mimetype = mimetype or mimetypes.guess_type(download_name)[0] or 'application/octet-stream'
+
+    headers = {
+        'ETag': quote_etag(etag),
+        'Last-Modified': http_date(stat.st_mtime),
+        'Accept-Ranges': 'bytes',
+        'Cache-Control': 'no-cache',
+        'Content-Disposition': content_disposition(download_name, as_attachment),
+    }
+
+    # 客户端缓存仍然有效
+    if_none_match = request.headers.get('If-None-Match')
+    if if_none_match and parse_etags(if_none_match).contains_weak(etag):
+        return Response(status=304, headers=headers)
+
+    status = 200
+    parts = [(0, size)]
+    content_type = mimetype
+    content_length = size
+
+    range_header = request.headers.get('Range')
+    if range_header and _range_allowed(etag, stat.st_mtime):
+        ranges = _parse_ranges(range_header, size)
+        if ranges == []:
+            headers['Content-Range'] = f'bytes */{size}'
+            return Response(status=416, headers=headers)
+        if ranges and len(ranges) == 1:
+            start, end = ranges[0]
+            status = 206
+            parts = [(start, end)]
+            content_length = end - start
+            headers['Content-Range'] = f'bytes {start}-{end - 1}/{size}'
+        elif ranges:
+            # 多段：multipart/byteranges
+            status = 206
+            boundary = uuid.uuid4().hex
+            content_type = f'multipart/byteranges; boundary={boundary}'
+            parts = []
+            content_length = 0
+            for start, end in ranges:
+                head = (f'--{boundary}\r\nContent-Type: {mimetype}\r\n'
+                        f'Content-Range: bytes {start}-{end - 1}/{size}\r\n\r\n').encode('latin-1')
+                if parts:
+                    head = b'\r\n' + head
+                parts.extend([head, (start, end)])
+                content_length += len(head) + end - start
+            tail = f'\r\n--{boundary}--\r\n'.encode('latin-1')
+            parts.append(tail)
+            content_length += len(tail)
+
+    headers['Content-Length'] = str(content_length)
+    if request.method == 'HEAD':
+        return Response(status=status, headers=headers, content_type=content_type)
+    body = _iter_body(file_path, parts, request.environ)
+    return Response(body, status=status, headers=headers, content_type=content_type,
+                    direct_passthrough=True)
+
+
+# ================= 打包下载 =================
+class _ZipStream:
+    """只能追加写入的缓冲区，zipfile写入后由生成器取走数据
+
+    没有tell/seek，zipfile会自动使用数据描述符，无需回写本地文件头。
+    """
+
+    def __init__(self):
+        self.chunks = []
+        self.size = 0
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.size += len(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def pop(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        self.size = 0
+        return data
+
+
+def _iter_zip_sources(base_path, rel_paths):
+    """列出要打包的 (绝对路径, 包内路径, 是否目录)，包内路径相对于所有条目的公共父目录
+
+    重复选择的条目和已选文件夹内的条目只打包一次，否则压缩包中会出现同名条目。
+    """
+    abs_paths = []
+    for abs_path in sorted({os.path.normpath(os.path.join(base_path, rel)) if rel else base_path
+                            for rel in rel_paths}):
+        # 排序后文件夹排在其内部条目之前
+        if not any(abs_path.startswith(os.path.join(selected, '')) for selected in abs_paths):
+            abs_paths.append(abs_path)
+    parent = os.path.commonpath([os.path.dirname(p) if p != base_path else p for p in abs_paths])
+    for abs_path in abs_paths:
+        if not os.path.isdir(abs_path):
+            yield abs_path, os.path.relpath(abs_path, parent), False
+            continue
+        for root, dirs, files in os.walk(abs_path):
+            if root == base_path and Config.INTERNAL_FOLDER_NAME in dirs:
+                dirs.remove(Config.INTERNAL_FOLDER_NAME)
+            dirs.sort()
+            if root != parent:
+                yield root, os.path.relpath(root, parent), True
+            for name in sorted(files):
+                path = os.path.join(root, name)
+                yield path, os.path.relpath(path, parent), False
+
+
+def iter_zip(base_path, rel_paths):
+    """边读取文件边生成ZIP数据，内存占用与压缩包大小无关"""
+    stream = _ZipStream()
+    with zipfile.ZipFile(stream, 'w', allowZip64=True) as zf:
+        for abs_path, arcname, is_dir in _iter_zip_sources(base_path, rel_paths):
+            arcname = arcname.replace(os.sep, '/')
+            try:
+                # 预先填写文件大小，超过4GB时自动使用ZIP64
+                zinfo = zipfile.ZipInfo.from_file(abs_path, arcname)
+                if is_dir:
+                    zf.writestr(zinfo, b'')
+                    continue
+                src = open(abs_path, 'rb')
+            except OSError as e:
+                # 无法打开的文件跳过（还没有写入任何数据），不中断整个下载
+                print(f"打包时跳过文件 {abs_path}: {e}")
+                continue
+            if os.path.splitext(arcname)[1].lower() in Config.ZIP_STORE_EXTENSIONS:
+                zinfo.compress_type = zipfile.ZIP_STORED
+            else:
+                zinfo.compress_type = zipfile.ZIP_DEFLATED
+                zinfo._compresslevel = Config.ZIP_COMPRESS_LEVEL
+            try:
+                with src, zf.open(zinfo, 'w') as dst:
+                    while True:
+                        data = src.read(READ_SIZE)
+                        if not data:
+                            break
+                        dst.write(data)
+                        if stream.size >= ZIP_FLUSH_SIZE:
+                            yield stream.pop()
+            except OSError as e:
+                # 条目已经部分发出，无法跳过：中断下载，客户端会看到传输不完整，
+                # 而不是得到一个校验和错误的文件
+                print(f"打包时读取文件出错，中断下载 {abs_path}: {e}")
+                raise
+            if stream.size:
+                yield stream.pop()
+    yield stream.pop()
+
+
+def _throttled(chunks, environ):
+    """按传输调度设置的限速产出数据块"""
+    throttle = environ.get('cloud_disk.throttle')
+    try:
+        for chunk in chunks:
+            if throttle:
+                throttle.consume(len(chunk))
+            yield chunk
+    finally:
+        chunks.close()
+
+
+def send_zip(base_path, rel_paths, download_name):
+    """以流的形式发送ZIP压缩包"""
+    headers = {
+        'Content-Disposition': content_disposition(download_name, True),
+        'Cache-Control': 'no-cache',
+    }
+    return Response(_throttled(iter_zip(base_path, rel_paths), request.environ), headers=headers,
+                    content_type='application/zip', direct_passthrough=True)
\ No newline at end of file
@@ -0,0 +1,371 @@
+import os
+import time
+import zlib
+import errno
+import shutil
+import struct
+import tarfile
+import tempfile
+from .config import Config
+from .fileops import is_valid_name
+from .uploads import open_writer
+
+# 从请求体读取和解压的块大小（zip解压时单次输出也不超过该大小，防止解压炸弹占满内存）
+READ_SIZE = 1024 * 1024
+# 单次解包最多记录的错误信息条数
+MAX_ERRORS = 100
+
+# zip本地文件头: 签名 版本 标志 压缩方法 时间 日期 CRC 压缩后大小 原始大小 文件名长度 扩展字段长度
+ZIP_LOCAL_HEADER = struct.Struct('<4sHHHHHIIIHH')
+ZIP_LOCAL_SIGNATURE = b'PK\x03\x04'
+ZIP_DESCRIPTOR_SIGNATURE = b'PK\x07\x08'
+# 中央目录及结束记录，出现时说明所有文件都已读完
+ZIP_END_SIGNATURES = (b'PK\x01\x02', b'PK\x05\x06', b'PK\x06\x06', b'PK\x06\x07')
+
+
+class ArchiveError(Exception):
+    """压缩包格式错误或磁盘已满，无法继续解包，附带HTTP状态码"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+class _StreamReader:
+    """包装请求体，支持把多读的数据退回（zip解压会读过文件末尾）"""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.pending = b''
+
+    def read(self, size=-1):
+        if self.pending:
+            if size is None or size < 0:
+                data, self.pending = self.pending, b''
+            else:
+                data, self.pending = self.pending[:size], self.pending[size:]
+            return data
+        return self.stream.read(READ_SIZE if size is None or size < 0 else size)
+
+    def read_exact(self, size):
+        parts = []
+        while size > 0:
+            data = self.read(size)
+            if not data:
+                raise ArchiveError('数据不完整')
+            parts.append(data)
+            size -= len(data)
+        return b''.join(parts)
+
+    def unread(self, data):
+        self.pending = data + self.pending
+
+    def peek(self, size):
+        data = b''
+        while len(data) < size:
+            chunk = self.read(size - len(data))
+            if not chunk:
+                break
+            data += chunk
+        self.unread(data)
+        return data
+
+
+def _member_parts(name):
+    """把包内路径拆分为各级名称，绝对路径、包含..等不安全的路径返回None"""
+    name = name.replace('\\', '/')
+    if name.startswith('/') or (len(name) > 1 and name[1] == ':'):
+        return None
+    parts = [part for part in name.split('/') if part not in ('', '.')]
+    if not parts or not all(is_valid_name(part) for part in parts):
+        return None
+    return parts
+
+
+# ================= tar =================
+def _iter_tar_data(f):
+    """读取成员内容，数据不完整时同样作为格式错误（读取在_iter_tar产出之后进行）"""
+    try:
+        while True:
+            data = f.read(READ_SIZE)
+            if not data:
+                break
+            yield data
+    except tarfile.TarError as e:
+        raise ArchiveError(f'tar格式错误: {e}')
+
+
+def _iter_tar(reader):
+    """依次产出 (包内路径, 类型, mtime, 大小, 数据块迭代器)，类型为 dir / file / other"""
+    try:
+        with tarfile.open(fileobj=reader, mode='r|*', encoding='utf-8') as tar:
+            while True:
+                member = tar.next()
+                if member is None:
+                    break
+                # 流式模式下tarfile会保留每个成员的信息，逐个丢弃使内存占用与文件数无关
+                tar.members = []
+                if member.isdir():
+                    yield member.name, 'dir', member.mtime, 0, ()
+                elif member.isfile():
+                    yield member.name, 'file', member.mtime, member.size, _iter_tar_data(tar.extractfile(member))
+                else:
+                    yield member.name, 'other', None, 0, ()
+    except tarfile.TarError as e:
+        raise ArchiveError(f'tar格式错误: {e}')
+
+
+# ================= zip =================
+def _dos_time(dos_date, dos_time):
+    try:
+        return time.mktime(((dos_date >> 9) + 1980, (dos_date >> 5) & 0xF, dos_date & 0x1F,
+                            dos_time >> 11, (dos_time >> 5) & 0x3F, (dos_time & 0x1F) * 2, 0, 0, -1))
+    except (OverflowError, ValueError):
+        return None
+
+
+def _decode_zip_name(raw, flags):
+    if flags & 0x800:
+        return raw.decode('utf-8', 'replace')
+    # 未标记UTF-8时，Windows中文系统打包的文件名通常是GBK
+    for encoding in ('utf-8', 'gbk'):
+        try:
+            return raw.decode(encoding)
+        except UnicodeDecodeError:
+            continue
+    return raw.decode('cp437')
+
+
+def _zip64_sizes(extra, compressed, size):
+    """从zip64扩展字段读取超过4GB的大小"""
+    offset = 0
+    while offset + 4 <= len(extra):
+        header_id, length = struct.unpack_from('<HH', extra, offset)
+        if header_id == 0x0001:
+            data = extra[offset + 4:offset + 4 + length]
+            values = iter(struct.unpack_from(f'<{len(data) // 8}Q', data))
+            if size == 0xFFFFFFFF:
+                size = next(values, size)
+            if compressed == 0xFFFFFFFF:
+                compressed = next(values, compressed)
+            return compressed, size, True
+        offset += 4 + length
+    return compressed, size, False
+
+
+def _iter_stored(reader, size):
+    while size > 0:
+        data = reader.read(min(READ_SIZE, size))
+        if not data:
+            raise ArchiveError('数据不完整')
+        size -= len(data)
+        yield data
+
+
+def _iter_deflated(reader):
+    """解压deflate数据直到结束标记，读过头的数据退回给reader"""
+    decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+    while not decompressor.eof:
+        data = decompressor.unconsumed_tail or reader.read(READ_SIZE)
+        if not data:
+            raise ArchiveError('数据不完整')
+        try:
+            output = decompressor.decompress(data, READ_SIZE)
+        except zlib.error as e:
+            raise ArchiveError(f'zip数据损坏: {e}')
+        if output:
+            yield output
+    if decompressor.unused_data:
+        reader.unread(decompressor.unused_data)
+
+
+def _iter_zip(reader):
+    """按本地文件头顺序读取zip（不需要位于末尾的中央目录，可边接收边解包）"""
+    while True:
+        signature = reader.peek(4)
+        if len(signature) < 4 or signature in ZIP_END_SIGNATURES:
+            return
+        if signature != ZIP_LOCAL_SIGNATURE:
+            raise ArchiveError('不是有效的zip文件')
+        (_, _, flags, method, dos_time, dos_date, _, compressed, size,
+         name_length, extra_length) = ZIP_LOCAL_HEADER.unpack(reader.read_exact(ZIP_LOCAL_HEADER.size))
+        name = _decode_zip_name(reader.read_exact(name_length), flags)
+        compressed, size, zip64 = _zip64_sizes(reader.read_exact(extra_length), compressed, size)
+        has_descriptor = flags & 0x08
+        if flags & 0x01:
+            raise ArchiveError(f'不支持加密的zip: {name}')
+        if method == 8:
+            data = _iter_deflated(reader)
+        elif method == 0 and not has_descriptor:
+            data = _iter_stored(reader, compressed)
+        else:
+            raise ArchiveError(f'不支持的压缩方式: {name}')
+
+        kind = 'dir' if name.endswith('/') or name.endswith('\\') else 'file'
+        # 使用数据描述符时本地文件头中没有大小
+        yield name, kind, _dos_time(dos_date, dos_time), None if has_descriptor else size, data
+        # 调用方可能没有读完（例如路径非法），跳过剩余数据
+        for _ in data:
+            pass
+        if has_descriptor:
+            if reader.peek(4) == ZIP_DESCRIPTOR_SIGNATURE:
+                reader.read_exact(4)
+            reader.read_exact(20 if zip64 else 12)
+
+
+# ================= 解包 =================
+class ArchiveExtractor:
+    """把上传的tar/zip数据流边接收边解包到共享目录中的文件夹
+
+    只读一遍数据，内存占用与压缩包大小和文件数无关。每个文件先写入内部暂存
+    文件夹再rename到目标位置，中断时不会留下写了一半的文件。已确认存在的目录
+    会被记住，不必为每个文件重复创建。写完的文件攒成一批，统一同步到磁盘后
+    再移动到位，避免每个小文件单独等待一次fsync。
+    """
+
+    def __init__(self, base_path, target_dir, reservation=None):
+        self.base_path = base_path
+        # 相对共享目录的目标文件夹（/分隔）
+        self.target_dir = target_dir
+        self.target_abs = os.path.join(base_path, target_dir) if target_dir else base_path
+        self.staging = None
+        # 准入控制预留的空间，写入后扣除
+        self.reservation = reservation
+        # 已写完、等待同步并移动到位的文件: (暂存路径, 目标路径, 各级名称, 大小)
+        self._batch = []
+        self._batch_bytes = 0
+        self._known_dirs = set()
+        # 内容有变化的目录（相对共享目录），解包结束后统一通知
+        self.changed_dirs = set()
+        self.file_count = 0
+        self.dir_count = 0
+        self.bytes = 0
+        self.errors = []
+        self.error_count = 0
+
+    def _error(self, message):
+        self.error_count += 1
+        if len(self.errors) < MAX_ERRORS:
+            self.errors.append(message)
+
+    def _rel(self, parts):
+        return '/'.join([self.target_dir] + list(parts) if self.target_dir else parts)
+
+    def extract(self, stream, archive_format=None):
+        """解包整个数据流，archive_format为 tar / zip，None时根据文件头判断"""
+        reader = _StreamReader(stream)
+        if archive_format is None:
+            archive_format = 'zip' if reader.peek(4)[:2] == b'PK' else 'tar'
+        members = _iter_zip(reader) if archive_format == 'zip' else _iter_tar(reader)
+        try:
+            self._extract_members(members)
+        finally:
+            # 出错中断时，已完整写入的文件仍然保留
+            self._commit_batch()
+
+    def _extract_members(self, members):
+        for name, kind, mtime, size, data in members:
+            parts = _member_parts(name)
+            if parts is None or (not self.target_dir and parts[0] == Config.INTERNAL_FOLDER_NAME):
+                self._error(f'{name}: 非法路径')
+                continue
+            if kind == 'other':
+                self._error(f'{name}: 不支持链接等特殊文件')
+                continue
+            try:
+                self._ensure_target()
+                if kind == 'dir':
+                    self._make_dirs(parts)
+                else:
+                    self._write_file(parts, data, mtime, size)
+            except (OSError, UnicodeError) as e:
+                if getattr(e, 'errno', None) == errno.ENOSPC:
+                    raise ArchiveError('磁盘空间不足', 507)
+                self._error(f'{name}: {getattr(e, "strerror", None) or e}')
+
+    def _ensure_target(self):
+        """收到第一个有效条目时才创建目标文件夹和暂存文件夹"""
+        if self.staging is not None:
+            return
+        if not os.path.isdir(self.target_abs):
+            os.makedirs(self.target_abs, exist_ok=True)
+            self.changed_dirs.add(os.path.dirname(self.target_dir))
+        self.staging = Config.internal_path('uploads')
+
+    def _make_dirs(self, parts):
+        """逐级确认目录存在（已确认过的跳过）"""
+        for i in range(1, len(parts) + 1):
+            key = tuple(parts[:i])
+            if key in self._known_dirs:
+                continue
+            path = os.path.join(self.target_abs, *key)
+            try:
+                os.mkdir(path)
+                self.dir_count += 1
+                self.changed_dirs.add(self._rel(key[:-1]))
+            except FileExistsError:
+                # 不写入指向其他位置的符号链接目录
+                if os.path.islink(path) or not os.path.isdir(path):
+                    raise OSError(errno.ENOTDIR, f'已存在同名文件: {"/".join(key)}')
+            self._known_dirs.add(key)
+
+    def _write_file(self, parts, data, mtime, size):
+        if len(parts) > 1:
+            self._make_dirs(parts[:-1])
+        dest = os.path.join(self.target_abs, *parts)
+        if os.path.isdir(dest) and not os.path.islink(dest):
+            raise OSError(errno.EISDIR, '已存在同名文件夹')
+        fd, temp_path = tempfile.mkstemp(dir=self.staging, prefix='archive-', suffix='.part')
+        try:
+            writer = open_writer(open(fd, 'wb'), size, reservation=self.reservation)
+            try:
+                for chunk in data:
+                    writer.write(chunk)
+                writer.finish(sync=False)
+            finally:
+                writer.close()
+            if mtime:
+                os.utime(temp_path, (mtime, mtime))
+        except BaseException:
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+            raise
+        self._batch.append((temp_path, dest, parts, writer.written))
+        self._batch_bytes += writer.written
+        if (len(self._batch) >= Config.UPLOAD_FSYNC_BATCH_FILES or
+                self._batch_bytes >= Config.UPLOAD_FSYNC_INTERVAL_BYTES):
+            self._commit_batch()
+
+    def _commit_batch(self):
+        """把一批写完的文件连续同步到磁盘，再移动到目标位置"""
+        batch, self._batch, self._batch_bytes = self._batch, [], 0
+        if Config.UPLOAD_FSYNC != 'none':
+            for temp_path, _, _, _ in batch:
+                try:
+                    fd = os.open(temp_path, os.O_RDWR)
+                    try:
+                        os.fsync(fd)
+                    finally:
+                        os.close(fd)
+                except OSError:
+                    pass
+        for temp_path, dest, parts, size in batch:
+            try:
+                try:
+                    os.replace(temp_path, dest)
+                except OSError as e:
+                    if e.errno != errno.EXDEV:
+                        raise
+                    shutil.move(temp_path, dest)
+            except OSError as e:
+                self._error(f'{"/".join(parts)}: {e.strerror or e}')
+                try:
+                    os.remove(temp_path)
+                except OSError:
+                    pass
+                continue
+            self.file_count += 1
+            self.bytes += size
+            self.changed_dirs.add(self._rel(parts[:-1]))
\ No newline at end of file
@@ -0,0 +1,608 @@
+import os
+import json
+import time
+import uuid
+import queue
+import errno
+import shutil
+import tempfile
+import threading
+from flask import Request
+from .config import Config
+from .metrics import UPLOAD_REJECTED
+
+# 从请求体读取数据的块大小
+READ_SIZE = 1024 * 1024
+
+
+class UploadError(Exception):
+    """分块上传错误，附带HTTP状态码"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def _merge_range(ranges, start, end):
+    """把 [start, end) 合并进有序的区间列表"""
+    merged = []
+    for s, e in sorted(ranges + [[start, end]]):
+        if merged and s <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], e)
+        else:
+            merged.append([s, e])
+    return merged
+
+
+def _pwrite_all(f, data, offset):
+    """在指定偏移写入全部数据（支持并发写同一文件的不同区域）"""
+    view = memoryview(data)
+    if hasattr(os, 'pwrite'):
+        while view:
+            written = os.pwrite(f.fileno(), view, offset)
+            view = view[written:]
+            offset += written
+    else:
+        # Windows没有pwrite，每个请求使用独立的文件句柄，seek后写入
+        f.seek(offset)
+        f.write(view)
+
+
+def preallocate(f, size):
+    """用posix_fallocate为文件预先分配size字节的磁盘空间，返回是否成功分配
+
+    空间不足时立即抛出ENOSPC，而不是写到一半才失败；连续分配也能减少碎片。
+    """
+    if size > 0 and Config.UPLOAD_PREALLOCATE and hasattr(os, 'posix_fallocate'):
+        try:
+            os.posix_fallocate(f.fileno(), 0, size)
+            return True
+        except OSError as e:
+            # 文件系统不支持时不预分配
+            if e.errno not in (errno.EOPNOTSUPP, errno.EINVAL, errno.ENOSYS):
+                raise
+    return False
+
+
+def sync_on_commit(f):
+    """按同步策略，在文件移动到最终位置前把数据写入磁盘"""
+    if Config.UPLOAD_FSYNC != 'none':
+        os.fsync(f.fileno())
+
+
+class FileWriter:
+    """上传数据的写入器：预分配空间、按策略同步，并扣减准入时预留的空间
+
+    offset不为None时用pwrite从该偏移写入（分块上传并发写同一文件），否则顺序写入。
+    """
+
+    def __init__(self, f, size=None, offset=None, reservation=None):
+        self.file = f
+        self.name = getattr(f, 'name', None)
+        self.offset = offset
+        self.reservation = reservation
+        self.written = 0
+        # 已分配（已从预留中扣除）的字节数
+        self.allocated = 0
+        self.unsynced = 0
+        self.error = None
+        self.closed = False
+        if size and offset is None and preallocate(f, size):
+            self._allocated(size)
+
+    def _allocated(self, end):
+        if end > self.allocated:
+            if self.reservation is not None:
+                self.reservation.consume(end - self.allocated)
+            self.allocated = end
+
+    def _write(self, data):
+        if self.offset is None:
+            self.file.write(data)
+        else:
+            _pwrite_all(self.file, data, self.offset + self.written)
+        self.written += len(data)
+        self._allocated(self.written)
+        if Config.UPLOAD_FSYNC == 'interval':
+            # 定期同步，避免大量脏页在提交时集中写盘造成长时间卡顿
+            self.unsynced += len(data)
+            if self.unsynced >= Config.UPLOAD_FSYNC_INTERVAL_BYTES:
+                self.file.flush()
+                getattr(os, 'fdatasync', os.fsync)(self.file.fileno())
+                self.unsynced = 0
+
+    def write(self, data):
+        if self.error is not None:
+            raise self.error
+        try:
+            self._write(data)
+        except OSError as e:
+            self.error = e
+            raise
+        return len(data)
+
+    def flush(self):
+        if self.error is not None:
+            raise self.error
+        self.file.flush()
+
+    def _trim(self):
+        """截掉预分配后没有用到的部分，对应的空间退回预留，供同一请求中后面的文件使用"""
+        if self.offset is None and self.allocated > self.written:
+            self.file.truncate(self.written)
+            if self.reservation is not None:
+                self.reservation.refund(self.allocated - self.written)
+            self.allocated = self.written
+
+    def seek(self, offset, whence=0):
+        # 表单解析器写完一个文件后seek(0)：去掉按整个请求大小预分配的多余部分
+        self.flush()
+        self._trim()
+        return self.file.seek(offset, whence)
+
+    def read(self, size=-1):
+        self.flush()
+        return self.file.read(size)
+
+    def finish(self, sync=True):
+        """写完所有数据，按策略同步；写入出错时抛出异常"""
+        self.flush()
+        self._trim()
+        if sync:
+            sync_on_commit(self.file)
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.file.close()
+
+
+class QueuedFileWriter(FileWriter):
+    """通过有界队列交给后台线程写盘，请求线程只负责接收网络数据
+
+    磁盘短暂变慢时接收不会立即停顿；队列满时接收才等待，内存占用有上限。
+    写盘出错（如磁盘已满）后，下一次write立即抛出异常，不再继续接收。
+    """
+
+    def __init__(self, f, size=None, offset=None, reservation=None):
+        super().__init__(f, size, offset, reservation)
+        self.queue = queue.Queue(maxsize=Config.UPLOAD_WRITE_QUEUE)
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            if isinstance(item, threading.Event):
+                item.set()
+            elif self.error is None:
+                try:
+                    self._write(item)
+                except OSError as e:
+                    self.error = e
+
+    def write(self, data):
+        if self.error is not None:
+            raise self.error
+        if self.closed:
+            raise ValueError('写入器已关闭')
+        self.queue.put(bytes(data))
+        return len(data)
+
+    def flush(self):
+        if not self.closed:
+            done = threading.Event()
+            self.queue.put(done)
+            done.wait()
+        super().flush()
+
+    def close(self):
+        if not self.closed:
+            self.queue.put(None)
+            self.thread.join()
+        super().close()
+
+
+def open_writer(f, size=None, offset=None, reservation=None):
+    """大小未知或较大的数据用后台线程写入，小文件直接写入"""
+    if size is None or size >= Config.UPLOAD_QUEUE_MIN_SIZE:
+        return QueuedFileWriter(f, size, offset, reservation)
+    return FileWriter(f, size, offset, reservation)
+
+
+class Reservation:
+    """一次上传预留的磁盘空间，写入或预分配后逐步扣减，结束时释放剩余部分"""
+
+    def __init__(self, admission, size):
+        self.admission = admission
+        self.remaining = size
+
+    def consume(self, amount):
+        # 写盘线程和请求线程都可能调用
+        with self.admission.cond:
+            amount = min(amount, self.remaining)
+            if amount > 0:
+                self.remaining -= amount
+                self.admission.reserved -= amount
+                self.admission.cond.notify_all()
+
+    def refund(self, amount):
+        """退回已扣减但实际没有占用的空间（预分配后截断的部分）"""
+        with self.admission.cond:
+            self.remaining += amount
+            self.admission.reserved += amount
+
+    def release(self):
+        self.consume(self.remaining)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class UploadAdmission:
+    """上传准入控制：写入任何数据前确认磁盘空间和共享文件夹配额足够
+
+    正在进行的上传预留的空间（尚未写入的部分）也计算在内。不算这些预留也放不下
+    时直接拒绝；只是暂时被其他上传占用时等待一段时间（它们可能失败或取消）。
+    """
+
+    def __init__(self, used_bytes=None):
+        # 返回共享文件夹已用字节数（不含内部文件夹），未知时返回None
+        self.used_bytes = used_bytes
+        self.cond = threading.Condition()
+        self.reserved = 0
+
+    def _staged_bytes(self):
+        """暂存文件夹中未完成的上传实际占用的空间"""
+        total = 0
+        try:
+            with os.scandir(Config.internal_path('uploads')) as entries:
+                for entry in entries:
+                    try:
+                        stat = entry.stat()
+                    except OSError:
+                        continue
+                    total += getattr(stat, 'st_blocks', 0) * 512 or stat.st_size
+        except OSError:
+            pass
+        return total
+
+    def _shortfall(self, size, reserved):
+        """放不下时返回 (原因, 说明)，否则返回None"""
+        free = shutil.disk_usage(Config.UPLOAD_FOLDER).free
+        if free - reserved - size < Config.UPLOAD_MIN_FREE_BYTES:
+            return 'disk', '磁盘空间不足'
+        if Config.SHARE_QUOTA_BYTES:
+            # 目录占用还在统计时无法判断配额，只检查磁盘空间
+            used = self.used_bytes() if self.used_bytes else None
+            if used is not None and used + self._staged_bytes() + reserved + size > Config.SHARE_QUOTA_BYTES:
+                return 'quota', '超出共享文件夹的容量配额'
+        return None
+
+    def reserve(self, size, wait=None):
+        """预留size字节，返回Reservation（可用with自动释放）；放不下时抛出UploadError"""
+        size = max(0, int(size))
+        wait = Config.UPLOAD_ADMISSION_WAIT if wait is None else wait
+        deadline = time.monotonic() + wait
+        with self.cond:
+            while True:
+                shortfall = self._shortfall(size, self.reserved)
+                if shortfall is None:
+                    self.reserved += size
+                    return Reservation(self, size)
+                if self.reserved == 0 or self._shortfall(size, 0) is not None:
+                    UPLOAD_REJECTED.inc(reason=shortfall[0])
+                    raise UploadError(shortfall[1], 507)
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    UPLOAD_REJECTED.inc(reason='busy')
+                    raise UploadError(f'{shortfall[1]}（其他上传正在占用空间），请稍后重试', 503)
+                self.cond.wait(remaining)
+
+
+class UploadRequest(Request):
+    """表单上传时把每个文件直接写入共享目录内的暂存文件
+
+    默认实现会先把文件缓存在内存或系统临时目录，保存时再复制一遍；这里让
+    解析器边接收边写入与目标同一文件系统的暂存文件，保存时只需rename。
+    """
+
+    # 需要直接落盘的视图
+    streaming_endpoints = {'upload_file'}
+    # 视图在解析表单前通过准入控制得到的空间预留
+    upload_reservation = None
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if self.endpoint not in self.streaming_endpoints:
+            return super()._get_file_stream(total_content_length, content_type, filename, content_length)
+        stream = tempfile.NamedTemporaryFile(dir=Config.internal_path('uploads'), prefix='form-',
+                                             suffix='.part', delete=False)
+        if not hasattr(self, 'upload_temp_files'):
+            self.upload_temp_files = []
+            self.upload_writers = []
+        self.upload_temp_files.append(stream.name)
+        # 表单中各文件的大小未知，第一个文件按整个请求大小预分配（通常只有一个大文件），写完后截断，
+        # 多出的空间退回预留，后面的文件写入时再从中扣减
+        size = total_content_length if len(self.upload_temp_files) == 1 else None
+        writer = QueuedFileWriter(stream, size, reservation=self.upload_reservation)
+        self.upload_writers.append(writer)
+        return writer
+
+    def cleanup_upload_temp_files(self):
+        """停止写入并删除未被保存的暂存文件"""
+        for writer in getattr(self, 'upload_writers', []):
+            try:
+                writer.close()
+            except OSError:
+                pass
+        for path in getattr(self, 'upload_temp_files', []):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+def save_uploaded_file(file, save_path):
+    """保存表单中的一个文件：已落盘的暂存文件直接rename，否则分块复制"""
+    stream = file.stream
+    temp_path = getattr(stream, 'name', None)
+    if isinstance(temp_path, str) and os.path.dirname(temp_path) == Config.internal_path('uploads'):
+        try:
+            stream.finish()
+        finally:
+            stream.close()
+        try:
+            os.replace(temp_path, save_path)
+            return
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+            stream = open(temp_path, 'rb')
+    # 分块写入大文件
+    try:
+        with open(save_path, 'wb') as f:
+            shutil.copyfileobj(stream, f, 10 * 1024 * 1024)
+    finally:
+        stream.close()
+
+
+class ChunkedUploadManager:
+    """可续传的分块上传
+
+    类似tus协议：先创建上传会话并预分配稀疏文件，客户端按偏移并行写入
+    任意分块，断线后查询已接收的区间继续上传，全部到齐后提交，暂存文件
+    通过rename原子地出现在目标位置。会话信息保存在共享目录的内部文件夹中，
+    服务重启后仍可续传。
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.sessions = {}
+        # 正在提交的会话ID，提交期间拒绝重复提交、写入和取消
+        self.committing = set()
+        # 未能预分配的会话 -> 准入控制的预留，写入分块时扣减，提交、取消或过期时释放
+        self.reservations = {}
+
+    def _folder(self):
+        return Config.internal_path('uploads')
+
+    def _meta_path(self, upload_id):
+        return os.path.join(self._folder(), f'{upload_id}.json')
+
+    def _data_path(self, upload_id):
+        return os.path.join(self._folder(), f'{upload_id}.part')
+
+    def _save(self, session):
+        """原子地保存会话信息"""
+        session['updated'] = time.time()
+        meta_path = self._meta_path(session['id'])
+        tmp_path = meta_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(session, f, ensure_ascii=False)
+        os.replace(tmp_path, meta_path)
+
+    def create(self, rel_dir, filename, size, reservation=None):
+        """创建上传会话，返回会话信息
+
+        reservation为准入控制预留的空间，由会话接管：预分配成功时立即扣除；不能
+        预分配（稀疏文件）时保留到提交、取消或过期，期间写入的分块从中扣减。
+        """
+        try:
+            return self._create(rel_dir, filename, size, reservation)
+        except BaseException:
+            if reservation is not None:
+                reservation.release()
+            raise
+
+    def _create(self, rel_dir, filename, size, reservation):
+        filename = (filename or '').split('/')[-1].split('\\')[-1]
+        if filename in ('', '.', '..'):
+            raise UploadError('空文件名')
+        if size < 0 or size > Config.MAX_CONTENT_LENGTH:
+            raise UploadError('文件大小无效', 413 if size > 0 else 400)
+
+        self.cleanup_expired()
+        upload_id = uuid.uuid4().hex
+        # 预先分配整个文件的空间，各分块可按偏移直接写入，写到一半时不会因磁盘已满而失败
+        data_path = self._data_path(upload_id)
+        try:
+            with open(data_path, 'wb') as f:
+                allocated = preallocate(f, size)
+                if not allocated:
+                    # 不能预分配时使用稀疏文件
+                    f.truncate(size)
+        except OSError as e:
+            try:
+                os.remove(data_path)
+            except OSError:
+                pass
+            if e.errno == errno.ENOSPC:
+                raise UploadError('磁盘空间不足', 507)
+            raise
+        if reservation is not None:
+            if allocated:
+                reservation.release()
+            else:
+                with self.lock:
+                    self.reservations[upload_id] = reservation
+        session = {
+            'id': upload_id,
+            'path': rel_dir,
+            'filename': filename,
+            'size': size,
+            'received': [],
+            'created': time.time(),
+        }
+        with self.lock:
+            self._save(session)
+            self.sessions[upload_id] = session
+        return dict(session)
+
+    def get(self, upload_id):
+        """获取会话信息，不存在时抛出UploadError"""
+        with self.lock:
+            return dict(self._load(upload_id))
+
+    def _load_idle(self, upload_id):
+        """获取未在提交中的会话，正在提交时抛出UploadError"""
+        session = self._load(upload_id)
+        if upload_id in self.committing:
+            raise UploadError('上传正在提交', 409)
+        return session
+
+    def _load(self, upload_id):
+        session = self.sessions.get(upload_id)
+        if session is not None:
+            return session
+        if not upload_id.isalnum():
+            raise UploadError('上传会话不存在', 404)
+        try:
+            with open(self._meta_path(upload_id), 'r', encoding='utf-8') as f:
+                session = json.load(f)
+        except (OSError, ValueError):
+            raise UploadError('上传会话不存在', 404)
+        self.sessions[upload_id] = session
+        return session
+
+    def write_chunk(self, upload_id, offset, stream, length):
+        """把请求体写入指定偏移，返回更新后的会话信息"""
+        with self.lock:
+            size = self._load_idle(upload_id)['size']
+            reservation = self.reservations.get(upload_id)
+        if length is None:
+            raise UploadError('缺少Content-Length', 411)
+        if offset < 0 or offset + length > size:
+            raise UploadError('分块超出文件范围', 416)
+        if length > Config.CHUNKED_UPLOAD_MAX_CHUNK:
+            raise UploadError('分块过大', 413)
+
+        try:
+            f = open(self._data_path(upload_id), 'r+b', buffering=0)
+        except FileNotFoundError:
+            raise UploadError('上传会话不存在', 404)
+        writer = open_writer(f, length, offset=offset, reservation=reservation)
+        try:
+            remaining = length
+            while remaining > 0:
+                data = stream.read(min(READ_SIZE, remaining))
+                if not data:
+                    break
+                writer.write(data)
+                remaining -= len(data)
+            # 等待队列中的数据写完（提交时才同步到磁盘）
+            writer.finish(sync=False)
+        except OSError as e:
+            if e.errno == errno.ENOSPC:
+                raise UploadError('磁盘空间不足', 507)
+            raise
+        finally:
+            writer.close()
+            # 即使连接中途断开，已写入的部分也记录下来，续传时无需重发
+            if writer.written:
+                with self.lock:
+                    session = self._load(upload_id)
+                    session['received'] = _merge_range(session['received'], offset, offset + writer.written)
+                    self._save(session)
+        if writer.written < length:
+            raise UploadError('分块数据不完整', 400)
+        return self.get(upload_id)
+
+    def commit(self, upload_id):
+        """所有数据到齐后，把暂存文件原子地移动到目标位置，返回相对路径"""
+        with self.lock:
+            # 同一会话的并发提交：第二个请求返回409，而不是在暂存文件被移走后出错
+            session = self._load_idle(upload_id)
+            if session['size'] > 0 and session['received'] != [[0, session['size']]]:
+                raise UploadError('文件尚未上传完整', 409)
+            self.committing.add(upload_id)
+
+        try:
+            data_path = self._data_path(upload_id)
+            save_dir = os.path.join(Config.UPLOAD_FOLDER, session['path'])
+            os.makedirs(save_dir, exist_ok=True)
+            save_path = os.path.join(save_dir, session['filename'])
+
+            with open(data_path, 'r+b') as f:
+                sync_on_commit(f)
+            try:
+                os.replace(data_path, save_path)
+            except OSError as e:
+                if e.errno != errno.EXDEV:
+                    raise
+                # 目标目录在另一个文件系统上：先复制到目标目录再原子替换
+                tmp_path = os.path.join(save_dir, f'.{session["filename"]}.{upload_id}.part')
+                shutil.copyfile(data_path, tmp_path)
+                os.replace(tmp_path, save_path)
+                os.remove(data_path)
+            with self.lock:
+                self.sessions.pop(upload_id, None)
+                self._remove_meta(upload_id)
+                self._release_reservation(upload_id)
+        finally:
+            # 提交失败时会话保留，可以重试
+            with self.lock:
+                self.committing.discard(upload_id)
+        return os.path.join(session['path'], session['filename']) if session['path'] else session['filename']
+
+    def abort(self, upload_id):
+        """取消上传并删除暂存数据"""
+        with self.lock:
+            self._load_idle(upload_id)
+            self.sessions.pop(upload_id, None)
+            self._release_reservation(upload_id)
+        for path in (self._data_path(upload_id), self._meta_path(upload_id)):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def _release_reservation(self, upload_id):
+        reservation = self.reservations.pop(upload_id, None)
+        if reservation is not None:
+            reservation.release()
+
+    def _remove_meta(self, upload_id):
+        try:
+            os.remove(self._meta_path(upload_id))
+        except OSError:
+            pass
+
+    def cleanup_expired(self):
+        """删除长时间未更新的上传会话"""
+        folder = self._folder()
+        deadline = time.time() - Config.CHUNKED_UPLOAD_EXPIRE
+        for name in os.listdir(folder):
+            path = os.path.join(folder, name)
+            try:
+                if os.stat(path).st_mtime < deadline:
+                    os.remove(path)
+                    with self.lock:
+                        self.sessions.pop(os.path.splitext(name)[0], None)
+                        self._release_reservation(os.path.splitext(name)[0])
+            except OSError:
+                pass
\ No newline at end of file
@@ -0,0 +1,274 @@
+import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from .config import Config
+
+
+def _parent(rel_dir):
+    return os.path.dirname(rel_dir) if rel_dir else None
+
+
+def _depth(rel_dir):
+    return rel_dir.count(os.sep) + 1 if rel_dir else 0
+
+
+def _key(rel_dir):
+    """统一相对目录的写法（请求中的路径使用/分隔）"""
+    rel_dir = os.path.normpath(rel_dir or '')
+    return '' if rel_dir == '.' else rel_dir
+
+
+class UsageIndex:
+    """目录占用统计
+
+    为每个目录维护直接包含的文件大小和数量，以及包含所有子目录的累计值。
+    启动时用线程池并行扫描整个目录树（每个目录一个任务，新发现的子目录继续
+    提交），之后目录变化时只重新扫描该目录，把差值累加到所有上级目录。
+    """
+
+    def __init__(self):
+        self.base_path = None
+        self.lock = threading.Lock()
+        self.ready = False
+        self.running = False
+        self.thread = None
+        self._event = threading.Event()
+        self._pending = set()
+        # 相对目录 -> (直接包含的文件总大小, 文件数)
+        self.own = {}
+        # 相对目录 -> [累计大小, 累计文件数, 累计子目录数]
+        self.totals = {}
+        # 相对目录 -> {子目录相对路径}
+        self.children = {}
+
+    # ================= 生命周期 =================
+    def start(self, base_path):
+        """启动后台线程，先并行扫描整个目录树"""
+        if self.running:
+            return
+        self.base_path = base_path
+        self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        if not self.running:
+            return
+        self.running = False
+        self._event.set()
+        if self.thread:
+            self.thread.join()
+
+    def _run(self):
+        try:
+            self.build()
+        except Exception as e:
+            print(f"目录占用统计出错: {e}")
+        self.ready = True
+        # 处理扫描期间收到的变化
+        self._event.set()
+        while self.running:
+            self._event.wait()
+            self._event.clear()
+            with self.lock:
+                rel_dirs, self._pending = self._pending, set()
+            # 先处理上级目录，其中新出现的子目录会随上级一起统计
+            for rel_dir in sorted(rel_dirs, key=lambda d: (_depth(d), d)):
+                if not self.running:
+                    break
+                try:
+                    self._update_dir(rel_dir)
+                except Exception as e:
+                    print(f"目录占用统计更新出错: {e}")
+
+    # ================= 扫描 =================
+    def _scan_one(self, rel_dir):
+        """扫描单个目录，返回 (直接文件大小, 文件数, 子目录列表)，目录不存在时返回None"""
+        abs_dir = os.path.join(self.base_path, rel_dir) if rel_dir else self.base_path
+        size = count = 0
+        subdirs = []
+        try:
+            with os.scandir(abs_dir) as entries:
+                for entry in entries:
+                    if not rel_dir and entry.name == Config.INTERNAL_FOLDER_NAME:
+                        continue
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            subdirs.append(os.path.join(rel_dir, entry.name) if rel_dir else entry.name)
+                        elif entry.is_file():
+                            size += entry.stat().st_size
+                            count += 1
+                    except OSError:
+                        continue
+        except OSError:
+            return None
+        return size, count, subdirs
+
+    def _scan_tree(self, rel_dir, workers=1):
+        """扫描目录树，返回 {相对目录: (直接文件大小, 文件数, 子目录列表)}"""
+        results = {}
+        if workers <= 1:
+            stack = [rel_dir]
+            while stack and self.running:
+                current = stack.pop()
+                result = self._scan_one(current)
+                if result is not None:
+                    results[current] = result
+                    stack.extend(result[2])
+            return results
+        # scandir和stat在系统调用期间释放GIL，多个线程可同时等待磁盘（网络共享时尤其明显）
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(self._scan_one, rel_dir): rel_dir}
+            while futures:
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    current = futures.pop(future)
+                    result = future.result()
+                    if result is None:
+                        continue
+                    results[current] = result
+                    if self.running:
+                        for subdir in result[2]:
+                            futures[pool.submit(self._scan_one, subdir)] = subdir
+        return results
+
+    def build(self):
+        """并行扫描整个目录树并计算累计值"""
+        started = time.time()
+        results = self._scan_tree('', Config.USAGE_SCAN_WORKERS)
+        with self.lock:
+            self.own = {}
+            self.totals = {}
+            self.children = {}
+            self._insert(results)
+        print(f"目录占用统计完成: {len(results)} 个目录，用时 {time.time() - started:.1f} 秒")
+
+    def _insert(self, results):
+        """加入扫描结果，自底向上计算累计值（需持有lock）"""
+        for rel_dir, (size, count, subdirs) in results.items():
+            self.own[rel_dir] = (size, count)
+            self.children[rel_dir] = {d for d in subdirs if d in results}
+        for rel_dir in sorted(results, key=_depth, reverse=True):
+            size, count = self.own[rel_dir]
+            dirs = 0
+            for child in self.children[rel_dir]:
+                child_total = self.totals[child]
+                size += child_total[0]
+                count += child_total[1]
+                dirs += child_total[2] + 1
+            self.totals[rel_dir] = [size, count, dirs]
+
+    def _apply(self, rel_dir, size, count, dirs):
+        """把差值累加到目录及其所有上级目录（需持有lock）"""
+        while rel_dir is not None:
+            total = self.totals.get(rel_dir)
+            if total is None:
+                return
+            total[0] += size
+            total[1] += count
+            total[2] += dirs
+            rel_dir = _parent(rel_dir)
+
+    def _drop_tree(self, rel_dir):
+        """移除目录树，并从上级目录的累计值中减去（需持有lock）"""
+        total = self.totals.get(rel_dir)
+        if total is None:
+            return
+        parent = _parent(rel_dir)
+        if parent is not None:
+            self.children.get(parent, set()).discard(rel_dir)
+            self._apply(parent, -total[0], -total[1], -total[2] - 1)
+        stack = [rel_dir]
+        while stack:
+            current = stack.pop()
+            self.own.pop(current, None)
+            self.totals.pop(current, None)
+            stack.extend(self.children.pop(current, ()))
+
+    def _add_tree(self, rel_dir):
+        """扫描新出现的目录树，并累加到上级目录"""
+        parent = _parent(rel_dir)
+        if parent is not None and parent not in self.totals:
+            return
+        results = self._scan_tree(rel_dir)
+        if rel_dir not in results:
+            return
+        with self.lock:
+            if rel_dir in self.totals or (parent is not None and parent not in self.totals):
+                return
+            self._insert(results)
+            if parent is not None:
+                self.children[parent].add(rel_dir)
+                total = self.totals[rel_dir]
+                self._apply(parent, total[0], total[1], total[2] + 1)
+
+    def _update_dir(self, rel_dir):
+        """重新扫描单个目录的直接子项"""
+        result = self._scan_one(rel_dir)
+        if result is None:
+            with self.lock:
+                self._drop_tree(rel_dir)
+            return
+        size, count, subdirs = result
+        with self.lock:
+            if rel_dir not in self.totals:
+                new_tree = True
+            else:
+                new_tree = False
+                old_size, old_count = self.own[rel_dir]
+                self.own[rel_dir] = (size, count)
+                self._apply(rel_dir, size - old_size, count - old_count, 0)
+                current = set(subdirs)
+                for child in list(self.children[rel_dir] - current):
+                    self._drop_tree(child)
+                added = current - self.children[rel_dir]
+        if new_tree:
+            # 上级目录已统计时作为新目录树加入，否则由上级目录的更新负责
+            self._add_tree(rel_dir)
+            return
+        for child in sorted(added):
+            self._add_tree(child)
+
+    def update_dirs(self, rel_dirs):
+        """目录内容发生变化（目录广播回调），由后台线程重新统计"""
+        if not self.running:
+            return
+        with self.lock:
+            self._pending.update(_key(rel_dir) for rel_dir in rel_dirs)
+        if self.ready:
+            self._event.set()
+
+    # ================= 查询 =================
+    def get(self, rel_dir):
+        """目录的累计占用 (大小, 文件数, 子目录数)，未统计时返回None"""
+        total = self.totals.get(_key(rel_dir))
+        return tuple(total) if total is not None else None
+
+    def usage(self, rel_dir, limit=100):
+        """目录占用报告，包含按大小排序的直接子目录"""
+        rel_dir = _key(rel_dir)
+        with self.lock:
+            total = self.totals.get(rel_dir)
+            if total is None:
+                return None
+            own_size, own_count = self.own[rel_dir]
+            children = sorted(((child, tuple(self.totals[child])) for child in self.children[rel_dir]),
+                              key=lambda item: item[1][0], reverse=True)
+            result = {
+                'path': rel_dir.replace(os.sep, '/'),
+                'size': total[0],
+                'files': total[1],
+                'dirs': total[2],
+                'own_size': own_size,
+                'own_files': own_count,
+            }
+        result['children'] = [{
+            'name': os.path.basename(child),
+            'path': child.replace(os.sep, '/'),
+            'size': size,
+            'files': files,
+            'dirs': dirs,
+        } for child, (size, files, dirs) in children[:limit]]
+        result['ready'] = self.ready
+        return result
\ No newline at end of file
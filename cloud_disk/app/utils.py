@@ -1,7 +1,14 @@
 import os
+import json
 import time
+import base64
 import socket
-import psutil
+import functools
+import threading
+from stat import S_ISDIR
+from collections import OrderedDict
+from .config import Config
+from .metrics import cache_result
 
 def get_local_ip():
     """获取本机局域网IP"""
@@ -31,56 +38,305 @@ def allowed_file(filename):
     # 允许所有文件类型
     return True
 
-def get_file_info(base_path, path=''):
-    """获取文件列表信息"""
+def is_internal_path(relative_path):
+    """是否位于共享目录的内部文件夹中（不对用户展示）"""
+    first = os.path.normpath(relative_path or '').replace('\\', '/').strip('/').split('/')[0]
+    return first == Config.INTERNAL_FOLDER_NAME
+
+# 目录列表缓存: 目录绝对路径 -> (目录mtime_ns, 文件列表)，按LRU淘汰
+_listing_cache = OrderedDict()
+_listing_lock = threading.Lock()
+# 由inotify监控保证失效通知时，命中缓存无需再stat目录
+_listing_cache_trusted = False
+# 每次失效时递增，避免扫描期间发生的变化被旧结果覆盖
+_listing_generation = 0
+# 可选的目录列表来源（元数据目录），source(base_path, 相对目录, 目录mtime_ns) 返回None时读取磁盘
+_listing_source = None
+# 可选的文件夹累计占用来源，source(相对目录) 返回 (大小, 文件数, 子目录数)，未统计时返回None
+_dir_usage_source = None
+
+def set_listing_cache_trusted(trusted):
+    """设置缓存是否可信（有可靠的变化通知时无需校验目录mtime）"""
+    global _listing_cache_trusted
+    _listing_cache_trusted = trusted
+
+def set_listing_source(source):
+    """设置目录列表的数据来源，None表示总是读取磁盘"""
+    global _listing_source
+    _listing_source = source
+
+def set_dir_usage_source(source):
+    """设置文件夹累计占用的数据来源"""
+    global _dir_usage_source
+    _dir_usage_source = source
+
+def invalidate_listing(base_path, path=''):
+    """使目录列表缓存失效"""
+    global _listing_generation
+    folder_path = os.path.normpath(os.path.join(base_path, path) if path else base_path)
+    with _listing_lock:
+        _listing_generation += 1
+        _listing_cache.pop(folder_path, None)
+
+def clear_listing_cache():
+    """清空目录列表缓存"""
+    global _listing_generation
+    with _listing_lock:
+        _listing_generation += 1
+        _listing_cache.clear()
+
+@functools.lru_cache(maxsize=8192)
+def _format_mtime(seconds):
+    """格式化修改时间（同一秒内的文件复用结果）"""
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(seconds))
+
+def _make_entry(name, relative_path, is_dir, stat):
+    """构造单个文件/文件夹的列表条目"""
+    return make_entry(name, relative_path, is_dir, stat.st_size if not is_dir else 0, int(stat.st_mtime))
+
+def make_entry(name, relative_path, is_dir, size, mtime):
+    """由大小和修改时间（秒）构造列表条目"""
+    return {
+        'name': name,
+        'is_dir': is_dir,
+        'size': size,
+        'mtime': _format_mtime(mtime),
+        'path': relative_path
+    }
+
+def format_entry(abs_path, relative_path, is_dir=None):
+    """读取单个路径的列表条目，路径不存在时返回None"""
+    try:
+        stat = os.stat(abs_path)
+    except OSError:
+        return None
+    if is_dir is None:
+        is_dir = S_ISDIR(stat.st_mode)
+    return _make_entry(os.path.basename(relative_path), relative_path, is_dir, stat)
+
+def _scan_dir(folder_path, path):
+    """使用scandir读取目录，复用DirEntry中的类型和stat信息"""
+    files = []
+    with os.scandir(folder_path) as entries:
+        for entry in entries:
+            if not path and entry.name == Config.INTERNAL_FOLDER_NAME:
+                continue
+            try:
+                # 判断是否为文件夹（通常可直接从目录项类型得到，无需系统调用）
+                is_dir = entry.is_dir()
+                stat = entry.stat()
+            except OSError:
+                continue
+            
+            # 计算相对路径
+            if path:
+                relative_path = os.path.join(path, entry.name)
+            else:
+                relative_path = entry.name
+                
+            files.append(_make_entry(entry.name, relative_path, is_dir, stat))
+    return sorted(files, key=lambda x: (not x['is_dir'], x['name'].lower()))
+
+def get_file_info(base_path, path='', use_cache=True):
+    """获取文件列表信息
+
+    结果按目录路径和目录mtime缓存，返回的列表为共享对象，调用方不应修改。
+    use_cache=False 时强制读取磁盘（不使用元数据目录的记录）并刷新缓存，
+    轮询监控靠它发现文件大小和修改时间的变化。
+    """
     files = []
     # 确保路径安全
     if path:
         # 规范化路径并确保它在base_path内
         folder_path = os.path.normpath(os.path.join(base_path, path))
         # 检查是否在base_path内
-        if not folder_path.startswith(os.path.normpath(base_path)):
+        if not folder_path.startswith(os.path.normpath(base_path)) or is_internal_path(path):
             return files
     else:
-        folder_path = base_path
+        folder_path = os.path.normpath(base_path)
     
-    if not os.path.exists(folder_path):
+    if use_cache and _listing_cache_trusted:
+        with _listing_lock:
+            cached = _listing_cache.get(folder_path)
+            if cached is not None:
+                _listing_cache.move_to_end(folder_path)
+                cache_result('listing', True)
+                return cached[1]
+    
+    try:
+        dir_stat = os.stat(folder_path)
+    except OSError:
         return files
+    
+    if use_cache:
+        with _listing_lock:
+            cached = _listing_cache.get(folder_path)
+            if cached is not None and cached[0] == dir_stat.st_mtime_ns:
+                _listing_cache.move_to_end(folder_path)
+                cache_result('listing', True)
+                return cached[1]
+        cache_result('listing', False)
+    
+    generation = _listing_generation
+    # 元数据目录依赖文件监控的变化通知；轮询只比较根目录，子目录中原地改写的文件不会被通知，
+    # 此时直接读取磁盘
+    files = (_listing_from_source(base_path, folder_path, dir_stat.st_mtime_ns)
+             if use_cache and _listing_cache_trusted else None)
+    if files is None:
+        try:
+            files = _scan_dir(folder_path, path)
+        except (NotADirectoryError, FileNotFoundError):
+            return []
+    
+    # 目录在最近一秒内被修改过时不缓存，避免同一时间戳内的后续修改被忽略
+    if _listing_cache_trusted or time.time() - dir_stat.st_mtime > 1:
+        with _listing_lock:
+            if generation == _listing_generation:
+                _listing_cache[folder_path] = (dir_stat.st_mtime_ns, files)
+                _listing_cache.move_to_end(folder_path)
+                while len(_listing_cache) > Config.LISTING_CACHE_SIZE:
+                    _listing_cache.popitem(last=False)
+    else:
+        invalidate_listing(folder_path)
         
-    for item in os.listdir(folder_path):
-        item_path = os.path.join(folder_path, item)
-        stat = os.stat(item_path)
-        
-        # 判断是否为文件夹
-        is_dir = os.path.isdir(item_path)
-        
-        # 计算相对路径
-        if path:
-            relative_path = os.path.join(path, item)
-        else:
-            relative_path = item
-            
-        files.append({
-            'name': item,
-            'is_dir': is_dir,
-            'size': stat.st_size if not is_dir else 0,
-            'mtime': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(stat.st_mtime)),
-            'path': relative_path
-        })
-        
+    return files
+
+def _listing_from_source(base_path, folder_path, mtime_ns):
+    """从元数据目录读取列表，记录不可用或已过期时返回None"""
+    if _listing_source is None:
+        return None
+    rel_dir = os.path.relpath(folder_path, os.path.normpath(base_path))
+    rel_dir = '' if rel_dir == '.' else rel_dir
+    rows = _listing_source(base_path, rel_dir, mtime_ns)
+    cache_result('catalog', rows is not None)
+    if rows is None:
+        return None
+    files = [make_entry(name, os.path.join(rel_dir, name) if rel_dir else name, bool(is_dir),
+                        size, mtime_ns // 1000000000)
+             for name, is_dir, size, mtime_ns in rows]
     return sorted(files, key=lambda x: (not x['is_dir'], x['name'].lower()))
 
+def with_dir_usage(files):
+    """把文件夹的大小换成累计占用并附上文件数（返回新列表，不修改缓存的条目）"""
+    if _dir_usage_source is None:
+        return files
+    result = []
+    for f in files:
+        if f['is_dir']:
+            usage = _dir_usage_source(f['path'])
+            if usage is not None:
+                f = dict(f, size=usage[0], file_count=usage[1])
+        result.append(f)
+    return result
+
+# 排序键（文件夹始终排在前面）
+SORT_KEYS = {
+    'name': lambda f: (f['name'].lower(), f['name']),
+    'size': lambda f: (f['size'], f['name'].lower()),
+    'mtime': lambda f: (f['mtime'], f['name'].lower()),
+}
+
+# 排序结果缓存: (目录, 排序键, 顺序) -> (原始列表, 排序后列表, path -> 下标)
+_sorted_cache = OrderedDict()
+
+def _sorted_listing(base_path, path, sort, order):
+    """获取排序后的目录列表，未变化的目录复用上次的排序结果"""
+    files = get_file_info(base_path, path)
+    key = (os.path.normpath(os.path.join(base_path, path)), sort, order)
+    with _listing_lock:
+        cached = _sorted_cache.get(key)
+        if cached is not None and cached[0] is files:
+            _sorted_cache.move_to_end(key)
+            cache_result('sorted_listing', True)
+            return cached[1], cached[2]
+    cache_result('sorted_listing', False)
+    
+    sort_key = SORT_KEYS[sort]
+    reverse = order == 'desc'
+    ordered = (sorted((f for f in files if f['is_dir']), key=sort_key, reverse=reverse) +
+               sorted((f for f in files if not f['is_dir']), key=sort_key, reverse=reverse))
+    positions = {f['path']: i for i, f in enumerate(ordered)}
+    with _listing_lock:
+        _sorted_cache[key] = (files, ordered, positions)
+        while len(_sorted_cache) > Config.LISTING_CACHE_SIZE:
+            _sorted_cache.popitem(last=False)
+    return ordered, positions
+
+def encode_cursor(last_path, next_index):
+    """生成分页游标（记录上一页最后一项，目录变化时仍能定位）"""
+    raw = json.dumps({'p': last_path, 'i': next_index}).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor):
+    """解析分页游标，非法游标抛出ValueError"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        data = json.loads(raw)
+        return str(data['p']), int(data['i'])
+    except (ValueError, KeyError, TypeError) as e:
+        raise ValueError(f'无效的游标: {cursor}') from e
+
+def get_file_page(base_path, path='', sort='name', order='asc', file_type=None,
+                  keyword=None, cursor=None, limit=200):
+    """获取排序、过滤后的一页文件列表，返回 (条目列表, 下一页游标, 总数)"""
+    if sort not in SORT_KEYS:
+        raise ValueError(f'不支持的排序方式: {sort}')
+    if order not in ('asc', 'desc'):
+        raise ValueError(f'不支持的排序顺序: {order}')
+    if file_type and file_type != 'all' and file_type not in Config.FILE_TYPES:
+        raise ValueError(f'不支持的文件类型: {file_type}')
+    
+    files, positions = _sorted_listing(base_path, path, sort, order)
+    if sort == 'size' and _dir_usage_source is not None:
+        # 文件夹按累计占用排序（占用随时变化，不缓存）
+        files = with_dir_usage(files)
+        dirs = sorted((f for f in files if f['is_dir']), key=SORT_KEYS['size'], reverse=order == 'desc')
+        files = dirs + files[len(dirs):]
+        positions = {f['path']: i for i, f in enumerate(files)}
+    
+    # 过滤（分类只包含文件，与前端一致）
+    if (file_type and file_type != 'all') or keyword:
+        extensions = Config.FILE_TYPES.get(file_type)
+        keyword = keyword.lower() if keyword else None
+        files = [f for f in files
+                 if (extensions is None or
+                     (not f['is_dir'] and os.path.splitext(f['name'])[1].lower() in extensions))
+                 and (keyword is None or keyword in f['name'].lower())]
+        positions = {f['path']: i for i, f in enumerate(files)}
+    
+    start = 0
+    if cursor:
+        last_path, next_index = decode_cursor(cursor)
+        # 上一页最后一项仍存在时从它之后继续，否则退回到记录的下标
+        start = positions[last_path] + 1 if last_path in positions else next_index
+        start = max(0, min(start, len(files)))
+    
+    items = with_dir_usage(files[start:start + limit])
+    next_cursor = None
+    if start + limit < len(files):
+        next_cursor = encode_cursor(items[-1]['path'], start + limit)
+    return items, next_cursor, len(files)
+
+def iter_json_list(items, prefix='[', suffix=']', batch_size=500):
+    """流式输出JSON数组，避免一次性序列化整个响应"""
+    yield prefix.encode('utf-8')
+    batch = []
+    first = True
+    for item in items:
+        batch.append(json.dumps(item))
+        if len(batch) >= batch_size:
+            yield ((',' if not first else '') + ','.join(batch)).encode('utf-8')
+            first = False
+            batch = []
+    if batch:
+        yield ((',' if not first else '') + ','.join(batch)).encode('utf-8')
+    yield suffix.encode('utf-8')
+
 def safe_file_download(filepath, filename):
-    """安全下载文件（解决文件锁定问题）"""
-    from flask import send_file
-    import os
+    """安全下载文件（支持断点续传/Range，并尽量使用sendfile零拷贝发送）"""
+    from .transfer import send_file_range
     
-    # 使用 Flask 内置的 send_file 函数，它经过优化，能提供更好的下载性能
-    return send_file(
-        filepath,
-        as_attachment=True,
-        download_name=filename
-    )
+    return send_file_range(filepath, download_name=filename, as_attachment=True)
 
 def format_file_size(bytes_size):
     """格式化文件大小"""
@@ -94,33 +350,10 @@ def format_file_size(bytes_size):
     return f"{bytes_size:.1f} {size_names[i]}"
 
 def read_txt_chunk(file_path, chunk_index=0, chunk_size=100):
-    """高效、分块地读取TXT文件，自动检测编码并忽略错误"""
-    import itertools
-
-    def read_lines_from_file(f):
-        start_line = chunk_index * chunk_size
-        # 高效地获取目标块的行
-        chunk_lines = list(itertools.islice(f, start_line, start_line + chunk_size))
-        
-        # 检查是否还有更多行，以决定是否显示“加载更多”
-        try:
-            next(f)
-            has_more = True
-        except StopIteration:
-            has_more = False
-            
-        return "".join(chunk_lines), has_more
-
+    """分块读取TXT文件：通过缓存的分页索引直接定位，自动检测编码并忽略错误"""
+    from .textindex import get_text_index
+    
     try:
-        # 尝试用 utf-8-sig (处理BOM) 打开
-        with open(file_path, 'r', encoding='utf-8-sig') as f:
-            return read_lines_from_file(f)
-    except UnicodeDecodeError:
-        # 如果失败，回退到 gbk 并忽略错误
-        try:
-            with open(file_path, 'r', encoding='gbk', errors='ignore') as f:
-                return read_lines_from_file(f)
-        except Exception as e:
-            return f"无法读取文件: {e}", False
+        return get_text_index(file_path, chunk_size).read_page(chunk_index)
     except Exception as e:
         return f"无法读取文件: {e}", False
\ No newline at end of file
@@ -1,9 +1,22 @@
-from flask import render_template, request, jsonify, send_from_directory
-from flask_socketio import emit
+from flask import render_template, request, jsonify, Response, url_for
+from flask_socketio import emit, join_room, leave_room
 import os
-from . import app, socketio
+import json
+import errno
+import ipaddress
+import mimetypes
+from . import app, socketio, listing_broadcaster, search_index, chunked_uploads, upload_admission, thumbnails, video_streams, hash_index, usage_index, jobs
 from .config import Config
-from .utils import get_file_info, safe_file_download, allowed_file, format_file_size, read_txt_chunk
+from .models import normalize_rel_dir
+from .uploads import UploadError, save_uploaded_file
+from .hashing import place_copy
+from .unpack import ArchiveExtractor, ArchiveError
+from .hls import TranscodeError
+from .fileops import stage_delete, delete_job, is_valid_name, plan_copy, move_paths, copy_job
+from .transfer import send_file_range, send_zip
+from .textindex import iter_tail_events
+from .metrics import registry, profiler, SOCKET_CLIENTS, SOCKET_EMITS
+from .utils import get_file_info, get_file_page, with_dir_usage, is_internal_path, iter_json_list, safe_file_download, allowed_file, format_file_size, read_txt_chunk
 
 @app.route('/')
 def index():
@@ -14,15 +27,83 @@ def index():
 @app.route('/files/', defaults={'subpath': ''})
 @app.route('/files/<path:subpath>')
 def list_files(subpath=''):
-    """获取文件列表"""
-    return jsonify(get_file_info(Config.UPLOAD_FOLDER, subpath))
+    """获取文件列表
+
+    不带参数时返回完整列表（JSON数组）；带 limit/cursor/sort/order/type/q
+    任一参数时返回一页结果 {items, next_cursor, total, version}。
+    """
+    # 先取版本号再读目录，之后的变化都会以更高版本的增量推送
+    version = listing_broadcaster.version(normalize_rel_dir(subpath) or '')
+    
+    if not any(arg in request.args for arg in ('limit', 'cursor', 'sort', 'order', 'type', 'q')):
+        files = with_dir_usage(get_file_info(Config.UPLOAD_FOLDER, subpath))
+        response = Response(iter_json_list(files), mimetype='application/json')
+        response.headers['X-Dir-Version'] = str(version)
+        return response
+    
+    limit = request.args.get('limit', Config.LISTING_PAGE_SIZE, type=int)
+    limit = max(1, min(limit, Config.LISTING_PAGE_MAX))
+    try:
+        items, next_cursor, total = get_file_page(
+            Config.UPLOAD_FOLDER, subpath,
+            sort=request.args.get('sort', 'name'),
+            order=request.args.get('order', 'asc'),
+            file_type=request.args.get('type'),
+            keyword=request.args.get('q', '').strip(),
+            cursor=request.args.get('cursor'),
+            limit=limit
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    suffix = '],' + json.dumps({'next_cursor': next_cursor, 'total': total, 'version': version})[1:]
+    response = Response(iter_json_list(items, prefix='{"items":[', suffix=suffix),
+                        mimetype='application/json')
+    response.headers['X-Dir-Version'] = str(version)
+    return response
+
+@app.route('/search')
+def search_files():
+    """在整个共享目录中按文件名搜索"""
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({'error': '搜索关键词不能为空'}), 400
+    
+    file_type = request.args.get('type')
+    if file_type == 'all':
+        file_type = None
+    if file_type and file_type not in Config.FILE_TYPES:
+        return jsonify({'error': f'不支持的文件类型: {file_type}'}), 400
+    
+    limit = request.args.get('limit', 100, type=int)
+    limit = max(1, min(limit, Config.SEARCH_MAX_RESULTS))
+    results, truncated = search_index.search(query, limit=limit,
+                                             path=request.args.get('path', ''),
+                                             file_type=file_type)
+    return jsonify({'results': results, 'truncated': truncated, 'ready': search_index.ready})
+
+@app.route('/usage')
+@app.route('/usage/', defaults={'subpath': ''})
+@app.route('/usage/<path:subpath>')
+def folder_usage(subpath=''):
+    """文件夹累计占用，以及按大小排序的子文件夹"""
+    rel_dir = normalize_rel_dir(subpath)
+    if rel_dir is None or is_internal_path(rel_dir):
+        return jsonify({'error': '非法路径'}), 400
+    limit = max(1, min(request.args.get('limit', 100, type=int), 1000))
+    result = usage_index.usage(rel_dir, limit=limit)
+    if result is None:
+        if not usage_index.ready:
+            return jsonify({'error': '正在统计，请稍后再试', 'ready': False}), 503
+        return jsonify({'error': '文件夹不存在'}), 404
+    return jsonify(result)
 
 @app.route('/download/<path:filepath>')
 def download_file(filepath):
     """下载文件"""
     # 安全检查，确保路径在共享目录内
     safe_path = os.path.normpath(filepath)
-    if safe_path.startswith('..') or safe_path.startswith('/'):
+    if safe_path.startswith('..') or safe_path.startswith('/') or is_internal_path(safe_path):
         return "非法路径", 400
     
     file_path = os.path.join(Config.UPLOAD_FOLDER, safe_path)
@@ -34,36 +115,282 @@ def download_file(filepath):
     
     return safe_file_download(file_path, os.path.basename(filepath))
 
+@app.route('/download_zip', methods=['GET', 'POST'])
+def download_zip():
+    """把文件夹或多个文件/文件夹打包成ZIP下载（边打包边发送）"""
+    paths = request.values.getlist('paths') or [request.values.get('path', '')]
+    rel_paths = []
+    for path in paths:
+        rel_path = normalize_rel_dir(path)
+        if rel_path is None or is_internal_path(rel_path):
+            return "非法路径", 400
+        if not os.path.exists(os.path.join(Config.UPLOAD_FOLDER, rel_path)):
+            return "File not found", 404
+        if rel_path not in rel_paths:
+            rel_paths.append(rel_path)
+    
+    # 默认以文件夹名（多选时为所在的公共目录名）命名
+    if len(rel_paths) == 1:
+        name = rel_paths[0]
+    else:
+        name = os.path.commonpath([os.path.dirname(path) for path in rel_paths])
+    name = request.values.get('name') or os.path.basename(name) or os.path.basename(os.path.abspath(Config.UPLOAD_FOLDER))
+    return send_zip(Config.UPLOAD_FOLDER, rel_paths, os.path.basename(name) + '.zip')
+
+@app.route('/thumb/<path:filepath>')
+def thumbnail(filepath):
+    """图片缩略图"""
+    safe_path = os.path.normpath(filepath)
+    if safe_path.startswith('..') or safe_path.startswith('/') or is_internal_path(safe_path):
+        return "非法路径", 400
+    
+    file_path = os.path.join(Config.UPLOAD_FOLDER, safe_path)
+    if not os.path.isfile(file_path):
+        return "File not found", 404
+    if not thumbnails.is_supported(file_path):
+        return "不支持的文件类型", 415
+    
+    size = thumbnails.normalize_size(request.args.get('size', Config.THUMBNAIL_DEFAULT_SIZE, type=int))
+    try:
+        thumb_path = thumbnails.get(file_path, size)
+    except Exception as e:
+        print(f"生成缩略图失败 {file_path}: {e}")
+        return "无法生成缩略图", 500
+    return send_file_range(thumb_path, download_name=os.path.splitext(os.path.basename(file_path))[0] + '.jpg',
+                           mimetype='image/jpeg')
+
 @app.route('/upload', methods=['POST'])
 def upload_file():
-    """上传文件"""
-    if 'file' not in request.files:
-        return jsonify({'error': '未选择文件'}), 400
+    """上传文件（支持一次上传多个文件）"""
+    # 解析表单（开始写入磁盘）之前先确认空间足够
+    if request.content_length is None:
+        return jsonify({'error': '缺少Content-Length'}), 411
+    try:
+        reservation = upload_admission.reserve(request.content_length)
+    except UploadError as e:
+        return jsonify({'error': str(e)}), e.status
+    request.upload_reservation = reservation
+    try:
+        try:
+            files = request.files.getlist('file')
+        except OSError as e:
+            if e.errno == errno.ENOSPC:
+                return jsonify({'error': '磁盘空间不足'}), 507
+            raise
+        if not files:
+            return jsonify({'error': '未选择文件'}), 400
+        
+        # 获取目标路径
+        target_path = normalize_rel_dir(request.form.get('path', ''))
+        if target_path is None or is_internal_path(target_path):
+            return jsonify({'error': '非法路径'}), 400
+        save_dir = os.path.join(Config.UPLOAD_FOLDER, target_path)
+        os.makedirs(save_dir, exist_ok=True)
+        
+        results = []
+        for file in files:  # 不再检查文件类型
+            filename = file.filename.split('/')[-1].split('\\')[-1] if file.filename else ''
+            if filename in ('', '.', '..'):
+                results.append({'filename': file.filename, 'success': False, 'error': '空文件名'})
+                continue
+            try:
+                save_uploaded_file(file, os.path.join(save_dir, filename))
+                results.append({'filename': filename, 'success': True})
+            except OSError as e:
+                results.append({'filename': filename, 'success': False, 'error': str(e)})
+        
+        saved = [r['filename'] for r in results if r['success']]
+        if saved:
+            # 所有文件保存完后统一通知一次
+            listing_broadcaster.notify(target_path)
+        if not saved:
+            return jsonify({'error': results[0].get('error', '文件上传失败'), 'files': results}), 400
+        return jsonify({
+            'success': True,
+            'filename': saved[0],
+            'saved_count': len(saved),
+            'files': results
+        })
+    finally:
+        reservation.release()
+        request.cleanup_upload_temp_files()
+
+# 上传文件夹时请求体的类型
+ARCHIVE_CONTENT_TYPES = {
+    'application/x-tar': 'tar',
+    'application/gzip': 'tar',
+    'application/x-gzip': 'tar',
+    'application/zip': 'zip',
+    'application/x-zip-compressed': 'zip',
+}
+
+@app.route('/upload/archive', methods=['POST'])
+def upload_archive():
+    """上传文件夹：请求体为tar（可gzip压缩）或zip数据流，边接收边解包到path参数指定的文件夹
+
+    保留目录结构，全部写完后统一通知一次目录变化。format参数可指定tar/zip，
+    否则根据Content-Type或文件头判断。
+    """
+    target_path = normalize_rel_dir(request.args.get('path', ''))
+    if target_path is None or is_internal_path(target_path):
+        return jsonify({'error': '非法路径'}), 400
+    archive_format = request.args.get('format') or ARCHIVE_CONTENT_TYPES.get(request.mimetype)
+    if archive_format not in (None, 'tar', 'zip'):
+        return jsonify({'error': '不支持的格式'}), 400
+    
+    # 按请求体大小预留空间（压缩过的包解开后可能更大，每个文件写入时还会预分配）
+    if request.content_length is None:
+        return jsonify({'error': '缺少Content-Length'}), 411
+    try:
+        reservation = upload_admission.reserve(request.content_length)
+    except UploadError as e:
+        return jsonify({'error': str(e)}), e.status
+    
+    extractor = ArchiveExtractor(Config.UPLOAD_FOLDER, target_path, reservation)
+    error = None
+    try:
+        extractor.extract(request.stream, archive_format)
+    except ArchiveError as e:
+        error = e
+    finally:
+        reservation.release()
+        if extractor.changed_dirs:
+            listing_broadcaster.notify_many(extractor.changed_dirs)
     
-    file = request.files['file']
-    if file.filename == '':
+    result = {
+        'success': error is None and extractor.error_count == 0,
+        'saved_count': extractor.file_count,
+        'dir_count': extractor.dir_count,
+        'bytes': extractor.bytes,
+        'errors': extractor.errors,
+        'error_count': extractor.error_count,
+        'message': f'已上传 {extractor.file_count} 个文件'
+    }
+    if error:
+        result['error'] = str(error)
+        return jsonify(result), error.status
+    return jsonify(result)
+
+# ================= 秒传与重复文件 =================
+@app.route('/upload/probe', methods=['POST'])
+def upload_probe():
+    """上传前按内容哈希查找已有文件，找到时直接在服务器上复制，无需传输
+
+    哈希即持有文件的证明（见 hashing.hash_file）：提交正确的大小和哈希即可复制该文件。
+    """
+    data = request.get_json(silent=True) or {}
+    target_path = normalize_rel_dir(data.get('path', ''))
+    if target_path is None or is_internal_path(target_path):
+        return jsonify({'error': '非法路径'}), 400
+    filename = (data.get('filename') or '').split('/')[-1].split('\\')[-1]
+    if filename in ('', '.', '..'):
         return jsonify({'error': '空文件名'}), 400
+    try:
+        size = int(data.get('size', -1))
+        digest = str(data.get('hash', ''))
+    except (TypeError, ValueError):
+        return jsonify({'error': '文件大小无效'}), 400
     
-    # 获取目标路径
-    target_path = request.form.get('path', '')
-    save_dir = os.path.join(Config.UPLOAD_FOLDER, target_path)
-    os.makedirs(save_dir, exist_ok=True)
+    source = hash_index.lookup(size, digest)
+    if source is None:
+        return jsonify({'found': False})
     
-    if file:  # 不再检查文件类型
-        filename = file.filename.split('/')[-1].split('\\')[-1]
-        save_path = os.path.join(save_dir, filename)
-        
-        # 分块写入大文件
-        chunk_size = 1024 * 1024 * 10  # 10MB chunks
-        with open(save_path, 'wb') as f:
-            while chunk := file.stream.read(chunk_size):
-                f.write(chunk)
-                f.flush()
-        
-        # 通知所有客户端
-        socketio.emit('file_update', {'files': get_file_info(Config.UPLOAD_FOLDER, target_path)}, namespace='/file')
-        return jsonify({'success': True, 'filename': filename})
-    return jsonify({'error': '文件上传失败'}), 400
+    save_dir = os.path.join(Config.UPLOAD_FOLDER, target_path)
+    save_path = os.path.join(save_dir, filename)
+    if os.path.abspath(source) == os.path.abspath(save_path):
+        return jsonify({'found': True, 'success': True, 'filename': filename, 'method': 'exists'})
+    try:
+        os.makedirs(save_dir, exist_ok=True)
+        method = place_copy(source, save_path)
+    except OSError as e:
+        # 复制失败时让客户端正常上传
+        print(f"秒传失败 {save_path}: {e}")
+        return jsonify({'found': False})
+    listing_broadcaster.notify(target_path)
+    return jsonify({'found': True, 'success': True, 'filename': filename, 'method': method})
+
+@app.route('/duplicates')
+def duplicates():
+    """重复文件报告"""
+    min_size = max(1, request.args.get('min_size', 1, type=int))
+    limit = max(1, min(request.args.get('limit', 200, type=int), 1000))
+    return jsonify(hash_index.duplicates(min_size=min_size, limit=limit))
+
+# ================= 分块上传（可续传） =================
+@app.route('/upload/chunked', methods=['POST'])
+def chunked_upload_create():
+    """创建分块上传会话"""
+    data = request.get_json(silent=True) or {}
+    target_path = normalize_rel_dir(data.get('path', ''))
+    if target_path is None or is_internal_path(target_path):
+        return jsonify({'error': '非法路径'}), 400
+    try:
+        size = int(data.get('size', -1))
+        # 创建时预分配整个文件，预留的空间在预分配后即转为实际占用；不能预分配时
+        # 预留随会话保留到提交或取消，由会话负责释放
+        reservation = upload_admission.reserve(size if 0 < size <= Config.MAX_CONTENT_LENGTH else 0)
+        session = chunked_uploads.create(target_path, data.get('filename'), size, reservation)
+    except (TypeError, ValueError):
+        return jsonify({'error': '文件大小无效'}), 400
+    except UploadError as e:
+        return jsonify({'error': str(e)}), e.status
+    return jsonify({
+        'upload_id': session['id'],
+        'size': session['size'],
+        'max_chunk_size': Config.CHUNKED_UPLOAD_MAX_CHUNK
+    }), 201
+
+@app.route('/upload/chunked/<upload_id>', methods=['GET'])
+def chunked_upload_status(upload_id):
+    """查询已接收的区间，用于断线续传"""
+    try:
+        session = chunked_uploads.get(upload_id)
+    except UploadError as e:
+        return jsonify({'error': str(e)}), e.status
+    received = session['received']
+    # 从文件开头起连续接收的字节数
+    offset = received[0][1] if received and received[0][0] == 0 else 0
+    return jsonify({
+        'upload_id': session['id'],
+        'path': session['path'],
+        'filename': session['filename'],
+        'size': session['size'],
+        'received': received,
+        'offset': offset
+    })
+
+@app.route('/upload/chunked/<upload_id>', methods=['PUT', 'PATCH'])
+def chunked_upload_write(upload_id):
+    """写入一个分块，偏移由 ?offset= 或 Upload-Offset 头指定"""
+    offset = request.args.get('offset', type=int)
+    if offset is None:
+        offset = request.headers.get('Upload-Offset', type=int)
+    if offset is None:
+        return jsonify({'error': '缺少分块偏移'}), 400
+    try:
+        session = chunked_uploads.write_chunk(upload_id, offset, request.stream, request.content_length)
+    except UploadError as e:
+        return jsonify({'error': str(e)}), e.status
+    return jsonify({'success': True, 'received': session['received']})
+
+@app.route('/upload/chunked/<upload_id>/commit', methods=['POST'])
+def chunked_upload_commit(upload_id):
+    """所有分块上传完成后提交"""
+    try:
+        relative_path = chunked_uploads.commit(upload_id)
+    except UploadError as e:
+        return jsonify({'error': str(e)}), e.status
+    listing_broadcaster.notify(os.path.dirname(relative_path))
+    return jsonify({'success': True, 'filename': os.path.basename(relative_path), 'path': relative_path})
+
+@app.route('/upload/chunked/<upload_id>', methods=['DELETE'])
+def chunked_upload_abort(upload_id):
+    """取消分块上传"""
+    try:
+        chunked_uploads.abort(upload_id)
+    except UploadError as e:
+        return jsonify({'error': str(e)}), e.status
+    return jsonify({'success': True})
 
 @app.route('/create_folder', methods=['POST'])
 def create_folder():
@@ -82,72 +409,191 @@ def create_folder():
     
     try:
         os.makedirs(full_path, exist_ok=False)
-        # 通知所有客户端
-        socketio.emit('file_update', {'files': get_file_info(Config.UPLOAD_FOLDER, target_path)}, namespace='/file')
+        # 通知订阅该目录的客户端
+        listing_broadcaster.notify(target_path)
         return jsonify({'success': True, 'message': f'文件夹 {folder_name} 创建成功'})
     except OSError as e:
         return jsonify({'success': False, 'error': f'创建文件夹失败: {str(e)}'}), 400
 
 @app.route('/batch_delete', methods=['POST'])
 def batch_delete_files():
-    """批量删除文件或文件夹"""
+    """批量删除文件或文件夹
+
+    先把目标移入删除暂存区（立即从列表中消失），再由后台任务并行删除。返回
+    任务id，进度通过job_progress事件推送，也可通过 /jobs/<id> 查询或取消。
+    """
     filepaths = request.json.get('filepaths', [])
     
     if not filepaths:
         return jsonify({'success': False, 'error': '文件路径列表不能为空'}), 400
     
-    deleted_count = 0
     errors = []
-    
+    targets = []
     for filepath in filepaths:
         # 安全检查，确保路径在共享目录内
         safe_path = os.path.normpath(filepath)
-        if safe_path.startswith('..') or safe_path.startswith('/'):
+        if (safe_path == '.' or safe_path.startswith('..') or os.path.isabs(safe_path) or
+                is_internal_path(safe_path)):
             errors.append(f'非法路径: {filepath}')
             continue
-        
-        file_path = os.path.join(Config.UPLOAD_FOLDER, safe_path)
-        
-        # 检查文件/文件夹是否存在
-        if not os.path.exists(file_path):
-            errors.append(f'文件或文件夹不存在: {filepath}')
-            continue
-        
-        try:
-            # 删除文件或文件夹
-            if os.path.isfile(file_path):
-                os.remove(file_path)
-            else:
-                import shutil
-                shutil.rmtree(file_path)
-            deleted_count += 1
-        except Exception as e:
-            errors.append(f'删除失败 {filepath}: {str(e)}')
-    
-    # 获取父目录路径以刷新正确的文件列表
-    parent_path = os.path.dirname(filepaths[0]) if filepaths else ''
-    socketio.emit('file_update', {'files': get_file_info(Config.UPLOAD_FOLDER, parent_path)}, namespace='/file')
+        targets.append(safe_path)
     
+    batch_dir, staged, stage_errors = stage_delete(targets)
+    errors.extend(stage_errors)
+    
+    # 通知所有受影响的父目录
+    listing_broadcaster.notify_many(os.path.dirname(filepath) for _, filepath in staged)
+    
+    result = {
+        'success': True,
+        'deleted_count': len(staged),
+        'message': f'成功删除 {len(staged)} 个文件/文件夹'
+    }
+    if staged:
+        job = jobs.submit('delete', delete_job, batch_dir, staged, listing_broadcaster.notify_many,
+                          description=f'删除 {len(staged)} 个文件/文件夹')
+        result['job_id'] = job.id
+    else:
+        os.rmdir(batch_dir)
     if errors:
-        return jsonify({
-            'success': True, 
-            'deleted_count': deleted_count,
-            'message': f'成功删除 {deleted_count} 个文件/文件夹',
-            'errors': errors
-        })
+        result['errors'] = errors
+    return jsonify(result)
+
+# ================= 重命名、移动与复制 =================
+def _source_paths(paths):
+    """规范化请求中的源路径，返回 (合法路径列表, 错误列表)"""
+    valid = []
+    errors = []
+    for path in paths if isinstance(paths, list) else []:
+        rel_path = normalize_rel_dir(path)
+        if not rel_path or is_internal_path(rel_path):
+            errors.append(f'非法路径: {path}')
+        else:
+            valid.append(rel_path)
+    return valid, errors
+
+def _target_dir(data):
+    """规范化请求中的目标文件夹，非法或不存在时返回None"""
+    target = normalize_rel_dir(data.get('target', ''))
+    if target is None or is_internal_path(target):
+        return None
+    if not os.path.isdir(os.path.join(Config.UPLOAD_FOLDER, target)):
+        return None
+    return target
+
+@app.route('/rename', methods=['POST'])
+def rename_path():
+    """重命名文件或文件夹"""
+    data = request.get_json(silent=True) or {}
+    rel_path = normalize_rel_dir(data.get('path', ''))
+    new_name = (data.get('new_name') or '').strip()
+    if not rel_path or is_internal_path(rel_path):
+        return jsonify({'success': False, 'error': '非法路径'}), 400
+    if not is_valid_name(new_name) or (new_name == Config.INTERNAL_FOLDER_NAME and '/' not in rel_path):
+        return jsonify({'success': False, 'error': '无效的名称'}), 400
+    
+    src = os.path.join(Config.UPLOAD_FOLDER, rel_path)
+    dst = os.path.join(os.path.dirname(src), new_name)
+    if not os.path.lexists(src):
+        return jsonify({'success': False, 'error': '文件或文件夹不存在'}), 404
+    # 只改变大小写时（不区分大小写的文件系统上）目标路径会被认为已存在
+    if os.path.lexists(dst) and os.path.normcase(os.path.abspath(dst)) != os.path.normcase(os.path.abspath(src)):
+        return jsonify({'success': False, 'error': '已存在同名文件或文件夹'}), 409
+    try:
+        os.rename(src, dst)
+    except OSError as e:
+        return jsonify({'success': False, 'error': f'重命名失败: {e}'}), 400
+    
+    parent = os.path.dirname(rel_path)
+    listing_broadcaster.notify(parent)
+    return jsonify({'success': True, 'path': f'{parent}/{new_name}' if parent else new_name})
+
+@app.route('/move', methods=['POST'])
+def move_files():
+    """移动到其他文件夹
+
+    同一文件系统内直接重命名，立即完成；跨文件系统的项作为后台任务复制后删除源文件。
+    """
+    data = request.get_json(silent=True) or {}
+    paths, errors = _source_paths(data.get('paths'))
+    if not paths and not errors:
+        return jsonify({'success': False, 'error': '文件路径列表不能为空'}), 400
+    target = _target_dir(data)
+    if target is None:
+        return jsonify({'success': False, 'error': '目标文件夹不存在'}), 400
+    
+    moved, cross_device, move_errors = move_paths(paths, target)
+    errors.extend(move_errors)
+    if moved:
+        listing_broadcaster.notify_many([target] + [os.path.dirname(src) for src, _ in moved])
+    
+    result = {
+        'success': bool(moved or cross_device),
+        'moved_count': len(moved),
+        'message': f'成功移动 {len(moved)} 个文件/文件夹'
+    }
+    if cross_device:
+        job = jobs.submit('move', copy_job, cross_device, listing_broadcaster.notify_many, True,
+                          description=f'移动 {len(cross_device)} 个文件/文件夹', queued=True)
+        result['job_id'] = job.id
+        result['message'] += f'，{len(cross_device)} 个位于其他磁盘，正在后台移动'
+    if errors:
+        result['errors'] = errors
+    return jsonify(result), 200 if result['success'] else 400
+
+@app.route('/copy', methods=['POST'])
+def copy_files():
+    """复制到其他文件夹（后台任务，目标位置已有同名项时自动改名）"""
+    data = request.get_json(silent=True) or {}
+    paths, errors = _source_paths(data.get('paths'))
+    if not paths and not errors:
+        return jsonify({'success': False, 'error': '文件路径列表不能为空'}), 400
+    target = _target_dir(data)
+    if target is None:
+        return jsonify({'success': False, 'error': '目标文件夹不存在'}), 400
+    
+    items, plan_errors = plan_copy(paths, target)
+    errors.extend(plan_errors)
+    result = {'success': bool(items)}
+    if items:
+        job = jobs.submit('copy', copy_job, items, listing_broadcaster.notify_many,
+                          description=f'复制 {len(items)} 个文件/文件夹', queued=True)
+        result['job_id'] = job.id
+        result['message'] = f'正在复制 {len(items)} 个文件/文件夹'
     else:
-        return jsonify({
-            'success': True, 
-            'deleted_count': deleted_count,
-            'message': f'成功删除 {deleted_count} 个文件/文件夹'
-        })
+        result['error'] = errors[0] if errors else '没有可复制的文件'
+    if errors:
+        result['errors'] = errors
+    return jsonify(result), 200 if result['success'] else 400
+
+# ================= 后台任务 =================
+@app.route('/jobs')
+def list_jobs():
+    """正在运行的后台任务"""
+    return jsonify({'jobs': [job.to_dict() for job in jobs.active()]})
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    """查询后台任务进度"""
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': '任务不存在'}), 404
+    return jsonify(job.to_dict())
+
+@app.route('/jobs/<job_id>/cancel', methods=['POST'])
+def job_cancel(job_id):
+    """取消后台任务"""
+    job = jobs.cancel(job_id)
+    if job is None:
+        return jsonify({'error': '任务不存在'}), 404
+    return jsonify({'success': True, 'state': job.state})
 
 @app.route('/view/<path:filepath>')
 def view_file(filepath):
     """在线预览文件"""
     # 安全检查，确保路径在共享目录内
     safe_path = os.path.normpath(filepath)
-    if safe_path.startswith('..') or safe_path.startswith('/'):
+    if safe_path.startswith('..') or safe_path.startswith('/') or is_internal_path(safe_path):
         return "非法路径", 400
     
     file_path = os.path.join(Config.UPLOAD_FOLDER, safe_path)
@@ -160,7 +606,13 @@ def view_file(filepath):
     ext = os.path.splitext(filepath)[1].lower()
 
     if ext == '.txt':
-        page = request.args.get('page', 0, type=int)
+        if request.args.get('tail'):
+            # 实时跟踪文件末尾新增的行
+            lines = request.args.get('lines', Config.TEXT_TAIL_LINES, type=int)
+            return Response(iter_tail_events(file_path, max(0, min(lines, 1000))),
+                            mimetype='text/event-stream',
+                            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+        page = max(0, request.args.get('page', 0, type=int))
         content, has_more = read_txt_chunk(file_path, chunk_index=page)
         return jsonify({'content': content, 'has_more': has_more, 'page': page + 1})
 
@@ -176,47 +628,110 @@ def view_file(filepath):
     elif ext in ['.pdf']:
         mime_type = 'application/pdf'
     
-    from urllib.parse import quote
-    
     if mime_type:
-        response = send_from_directory(
-            os.path.dirname(file_path),
-            os.path.basename(file_path),
-            as_attachment=False,
-            mimetype=mime_type
-        )
-        # 设置正确的Content-Disposition头以支持中文文件名
-        if isinstance(response, tuple):
-            response = response[0]
-        filename = os.path.basename(file_path)
-        ascii_filename = filename.encode('ascii', 'ignore').decode('ascii')
-        utf8_filename = quote(filename)
-        response.headers['Content-Disposition'] = f'inline; filename="{ascii_filename}"; filename*=UTF-8''{utf8_filename}'
-        print(f"Previewing file: {file_path}, MIME type: {mime_type}")  # 调试信息
-        return response
+        # 优先使用具体的MIME类型，浏览器才能正确解码和拖动视频进度
+        mime_type = mimetypes.guess_type(file_path)[0] or mime_type
+        return send_file_range(file_path, as_attachment=False, mimetype=mime_type)
     
     # 默认以附件形式下载
-    response = send_from_directory(
-        os.path.dirname(file_path),
-        os.path.basename(file_path),
-        as_attachment=True
-    )
-    # 设置正确的Content-Disposition头以支持中文文件名
-    if isinstance(response, tuple):
-        response = response[0]
-    filename = os.path.basename(file_path)
-    ascii_filename = filename.encode('ascii', 'ignore').decode('ascii')
-    utf8_filename = quote(filename)
-    response.headers['Content-Disposition'] = f'attachment; filename="{ascii_filename}"; filename*=UTF-8''{utf8_filename}'
-    return response
+    return send_file_range(file_path, as_attachment=True)
 
-# ================= SocketIO事件 =================
-@socketio.on('connect', namespace='/file')
-def handle_connect():
-    """处理客户端连接"""
-    emit('file_update', {'files': get_file_info(Config.UPLOAD_FOLDER)})
+# ================= 视频转码播放 =================
+@app.route('/hls/playlist/<path:filepath>')
+def hls_playlist(filepath):
+    """视频转码播放列表（m3u8），手机浏览器不支持的格式或码率过高时使用"""
+    safe_path = os.path.normpath(filepath)
+    if safe_path.startswith('..') or safe_path.startswith('/') or is_internal_path(safe_path):
+        return "非法路径", 400
+    if not video_streams.available():
+        return "未安装ffmpeg，不能转码播放", 503
+    
+    file_path = os.path.join(Config.UPLOAD_FOLDER, safe_path)
+    if not os.path.isfile(file_path):
+        return "File not found", 404
+    if not video_streams.is_supported(file_path):
+        return "不支持的文件类型", 415
+    
+    try:
+        info = video_streams.probe(file_path)
+    except (TranscodeError, OSError) as e:
+        return str(e), 415
+    # 片段地址带上内容版本，文件被替换后不会用到浏览器缓存的旧片段
+    base = url_for('hls_segment', filepath=safe_path.replace(os.sep, '/'), v=info['id'][:12])
+    playlist = video_streams.playlist(info, lambda index: f'{base}&i={index}')
+    return Response(playlist, mimetype='application/vnd.apple.mpegurl', headers={'Cache-Control': 'no-cache'})
 
+@app.route('/hls/segment/<path:filepath>')
+def hls_segment(filepath):
+    """视频转码片段（MPEG-TS），按需转码并提前转码下一段"""
+    safe_path = os.path.normpath(filepath)
+    if safe_path.startswith('..') or safe_path.startswith('/') or is_internal_path(safe_path):
+        return "非法路径", 400
+    if not video_streams.available():
+        return "未安装ffmpeg，不能转码播放", 503
+    
+    file_path = os.path.join(Config.UPLOAD_FOLDER, safe_path)
+    if not os.path.isfile(file_path) or not video_streams.is_supported(file_path):
+        return "File not found", 404
+    
+    index = request.args.get('i', -1, type=int)
+    try:
+        segment_path = video_streams.segment(file_path, index)
+    except IndexError:
+        return "片段不存在", 404
+    except Exception as e:
+        print(f"视频转码失败 {file_path}: {e}")
+        return "视频转码失败", 500
+    return send_file_range(segment_path, download_name=f'{index:05d}.ts', mimetype='video/mp2t')
 
+# ================= 运行指标 =================
+@app.route('/metrics')
+def metrics():
+    """Prometheus文本格式的运行指标"""
+    return Response(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
 
+@app.route('/metrics/profile', methods=['GET', 'POST'])
+def metrics_profile():
+    """查看请求性能分析结果；POST {enabled, path_prefix, min_ms} 在运行时开启或关闭
+
+    开启分析会拖慢所有请求，只允许在本机（运行服务的电脑上）修改。
+    """
+    if request.method == 'POST':
+        try:
+            local = ipaddress.ip_address(request.remote_addr or '').is_loopback
+        except ValueError:
+            local = False
+        if not local:
+            return jsonify({'error': '只能在本机修改性能分析设置'}), 403
+        data = request.get_json(silent=True) or {}
+        try:
+            profiler.configure(enabled=data.get('enabled'), path_prefix=data.get('path_prefix'),
+                               min_ms=data.get('min_ms'))
+        except (TypeError, ValueError):
+            return jsonify({'error': '参数无效'}), 400
+    return jsonify(profiler.snapshot())
+
+# ================= SocketIO事件 =================
+@socketio.on('connect', namespace='/file')
+def handle_connect():
+    """处理客户端连接，客户端随后通过subscribe订阅所在目录"""
+    SOCKET_CLIENTS.inc()
 
+@socketio.on('subscribe', namespace='/file')
+def handle_subscribe(data):
+    """订阅目录变化，只接收该目录的增量更新"""
+    rel_dir = normalize_rel_dir((data or {}).get('path', ''))
+    if rel_dir is None:
+        return
+    old_dir, version = listing_broadcaster.subscribe(request.sid, rel_dir)
+    if old_dir is not None and old_dir != rel_dir:
+        leave_room(listing_broadcaster.room(old_dir))
+    join_room(listing_broadcaster.room(rel_dir))
+    SOCKET_EMITS.inc(event='subscribed')
+    emit('subscribed', {'path': rel_dir, 'version': version})
 
+@socketio.on('disconnect', namespace='/file')
+def handle_disconnect(*args):
+    """客户端断开时释放订阅"""
+    SOCKET_CLIENTS.dec()
+    listing_broadcaster.unsubscribe(request.sid)
\ No newline at end of file
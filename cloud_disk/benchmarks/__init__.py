@@ -0,0 +1,10 @@
+"""局域网云盘性能测试
+
+在本地启动一个服务器进程，用合成的共享目录测量目录列表延迟、上传下载吞吐量
+和Socket.IO广播延迟，结果保存为JSON以便比较不同版本。
+
+用法（在cloud_disk目录下运行）:
+    python -m benchmarks run --out before.json
+    python -m benchmarks compare before.json after.json
+    python -m benchmarks startup --max-ms 500
+"""
\ No newline at end of file
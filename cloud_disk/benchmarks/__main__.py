@@ -0,0 +1,54 @@
+import argparse
+from .runner import SCENARIOS, run, compare
+from .startup import startup
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m benchmarks', description='局域网云盘性能测试')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    p = commands.add_parser('run', help='运行测试')
+    p.add_argument('--root', default='bench_data', help='测试数据目录（数据集会被复用）')
+    p.add_argument('--out', help='保存JSON结果的文件')
+    p.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=list(SCENARIOS))
+    p.add_argument('--url', help='测试已运行的服务器（如 http://127.0.0.1:5000），此时不启动服务器')
+    p.add_argument('--pid', type=int, help='配合--url，统计该服务器进程的CPU和内存')
+    p.add_argument('--port', type=int, help='启动服务器使用的端口（默认随机）')
+    p.add_argument('--server-mode', choices=('werkzeug', 'gevent', 'eventlet'))
+    p.add_argument('--settle-timeout', type=float, default=120, help='等待启动扫描完成的最长时间(秒)')
+    p.add_argument('-c', '--concurrency', type=int, default=8, help='并发客户端数')
+    p.add_argument('-n', '--requests', type=int, default=400, help='列表和Range请求的请求数')
+    p.add_argument('--uploads', type=int, default=32, help='上传文件数')
+    p.add_argument('--upload-mb', type=int, default=16, help='每个上传文件的大小(MB)')
+    p.add_argument('--downloads', type=int, default=8, help='下载大文件的次数')
+    p.add_argument('--sockets', type=int, default=50, help='Socket.IO客户端数')
+    p.add_argument('--events', type=int, default=20, help='广播测试的目录变化次数')
+    p.add_argument('--small-files', type=int, help='小文件目录的文件数')
+    p.add_argument('--deep-depth', type=int, help='深层目录树的深度')
+    p.add_argument('--huge-mb', type=int, help='大文件大小(MB)')
+    p.set_defaults(func=run)
+
+    p = commands.add_parser('compare', help='对比两次测试结果')
+    p.add_argument('base', help='基准结果JSON')
+    p.add_argument('new', help='本次结果JSON')
+    p.add_argument('--threshold', type=float, default=0.05, help='标记为变好/变差的最小变化比例')
+    p.set_defaults(func=compare)
+
+    p = commands.add_parser('startup', help='测试从启动服务器到首个 /files 请求返回的耗时')
+    p.add_argument('--root', default='bench_data', help='测试数据目录')
+    p.add_argument('--share', help='使用已有的共享目录（默认生成只含少量文件的目录）')
+    p.add_argument('--files', type=int, default=200, help='生成的共享目录中的文件数')
+    p.add_argument('-n', '--runs', type=int, default=5, help='启动次数')
+    p.add_argument('--warm', action='store_true', help='保留上次启动生成的索引和缓存')
+    p.add_argument('--port', type=int, help='服务器端口（默认随机）')
+    p.add_argument('--server-mode', choices=('werkzeug', 'gevent', 'eventlet'))
+    p.add_argument('--max-ms', type=float, help='启动耗时中位数超过该值(毫秒)时返回非零退出码')
+    p.add_argument('--out', help='保存JSON结果的文件')
+    p.set_defaults(func=startup)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
\ No newline at end of file
@@ -0,0 +1,209 @@
+import json
+import time
+import uuid
+import threading
+import http.client
+from urllib.parse import quote
+
+READ_SIZE = 1024 * 1024
+
+
+class HttpClient:
+    """保持长连接的HTTP客户端，每个并发线程使用一个"""
+
+    def __init__(self, host, port, timeout=60):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.conn = None
+
+    def _connection(self):
+        if self.conn is None:
+            self.conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        return self.conn
+
+    def request(self, method, path, body=None, headers=None):
+        """发送请求并读完响应，返回 (状态码, 响应字节数, 响应内容)
+
+        响应超过1MB时只计数不保留内容（下载测试）。
+        """
+        for attempt in range(2):
+            conn = self._connection()
+            try:
+                conn.request(method, quote(path, safe='/?=&'), body=body, headers=headers or {})
+                response = conn.getresponse()
+                total = 0
+                parts = []
+                while True:
+                    data = response.read(READ_SIZE)
+                    if not data:
+                        break
+                    total += len(data)
+                    if total <= READ_SIZE:
+                        parts.append(data)
+                if response.will_close:
+                    self.close()
+                return response.status, total, b''.join(parts)
+            except (http.client.HTTPException, ConnectionError):
+                # 服务器关闭了空闲连接，重连后重试一次（请求体为迭代器时不能重试）
+                self.close()
+                if attempt or (body is not None and not isinstance(body, (bytes, str))):
+                    raise
+
+    def get_json(self, path):
+        status, _, content = self.request('GET', path)
+        return status, json.loads(content) if content else None
+
+    def post_json(self, path, data):
+        status, _, content = self.request('POST', path, json.dumps(data).encode('utf-8'),
+                                          {'Content-Type': 'application/json'})
+        return status, json.loads(content) if content else None
+
+    def upload(self, target_dir, filename, size, block):
+        """以multipart表单上传一个指定大小的文件，内容由block重复填充"""
+        boundary = uuid.uuid4().hex
+        head = (f'--{boundary}\r\n'
+                f'Content-Disposition: form-data; name="path"\r\n\r\n{target_dir}\r\n'
+                f'--{boundary}\r\n'
+                f'Content-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+                f'Content-Type: application/octet-stream\r\n\r\n').encode('utf-8')
+        tail = f'\r\n--{boundary}--\r\n'.encode('utf-8')
+
+        def body():
+            yield head
+            remaining = size
+            while remaining > 0:
+                n = min(remaining, len(block))
+                yield block[:n]
+                remaining -= n
+            yield tail
+
+        headers = {
+            'Content-Type': f'multipart/form-data; boundary={boundary}',
+            'Content-Length': str(len(head) + size + len(tail)),
+        }
+        status, _, content = self.request('POST', '/upload', body(), headers)
+        return status, content
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+
+class SocketClient:
+    """最小的Socket.IO客户端（Engine.IO v4长轮询）
+
+    只依赖标准库。长轮询是浏览器在WebSocket不可用时的回退方式，每条消息都要
+    经过一次HTTP往返，测得的广播延迟是偏保守的上限。
+    """
+
+    def __init__(self, host, port, namespace='/file'):
+        self.host = host
+        self.port = port
+        self.namespace = namespace
+        self.sid = None
+        self.running = False
+        self.thread = None
+        self.cond = threading.Condition()
+        # (接收时间, 事件名, 数据)
+        self.events = []
+        self._send_lock = threading.Lock()
+        self._send_conn = None
+
+    def _url(self):
+        url = f'/socket.io/?EIO=4&transport=polling&t={time.time_ns()}'
+        if self.sid:
+            url += f'&sid={self.sid}'
+        return url
+
+    def connect(self, timeout=10):
+        conn = http.client.HTTPConnection(self.host, self.port, timeout=timeout)
+        conn.request('GET', self._url())
+        payload = conn.getresponse().read().decode('utf-8')
+        conn.close()
+        if not payload.startswith('0'):
+            raise ConnectionError(f'握手失败: {payload[:100]}')
+        self.sid = json.loads(payload[1:])['sid']
+        self.running = True
+        self._send(f'40{self.namespace},')
+        self.thread = threading.Thread(target=self._poll, daemon=True)
+        self.thread.start()
+        self.wait_for(lambda event, data: event == 'connect', timeout)
+
+    def _send(self, packet):
+        with self._send_lock:
+            for attempt in range(2):
+                if self._send_conn is None:
+                    self._send_conn = http.client.HTTPConnection(self.host, self.port, timeout=30)
+                try:
+                    self._send_conn.request('POST', self._url(), body=packet.encode('utf-8'),
+                                            headers={'Content-Type': 'text/plain;charset=UTF-8'})
+                    self._send_conn.getresponse().read()
+                    return
+                except (http.client.HTTPException, ConnectionError):
+                    self._send_conn.close()
+                    self._send_conn = None
+                    if attempt:
+                        raise
+
+    def emit(self, event, data):
+        self._send(f'42{self.namespace},' + json.dumps([event, data], ensure_ascii=False))
+
+    def _poll(self):
+        conn = http.client.HTTPConnection(self.host, self.port, timeout=60)
+        prefix = f'42{self.namespace},'
+        while self.running:
+            try:
+                conn.request('GET', self._url())
+                payload = conn.getresponse().read().decode('utf-8')
+            except (OSError, http.client.HTTPException):
+                if not self.running:
+                    break
+                conn.close()
+                conn = http.client.HTTPConnection(self.host, self.port, timeout=60)
+                time.sleep(0.1)
+                continue
+            received = time.perf_counter()
+            for packet in payload.split('\x1e'):
+                if packet == '2':
+                    self._send('3')
+                elif packet == '1':
+                    self.running = False
+                elif packet.startswith(f'40{self.namespace}'):
+                    self._record(received, 'connect', None)
+                elif packet.startswith(prefix):
+                    event, *args = json.loads(packet[len(prefix):])
+                    self._record(received, event, args[0] if args else None)
+        conn.close()
+
+    def _record(self, received, event, data):
+        with self.cond:
+            self.events.append((received, event, data))
+            self.cond.notify_all()
+
+    def wait_for(self, match, timeout):
+        """等待满足 match(event, data) 的事件，返回接收时间，超时返回None"""
+        deadline = time.monotonic() + timeout
+        checked = 0
+        with self.cond:
+            while True:
+                for received, event, data in self.events[checked:]:
+                    if match(event, data):
+                        return received
+                checked = len(self.events)
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                self.cond.wait(remaining)
+
+    def close(self):
+        if not self.running:
+            return
+        self.running = False
+        try:
+            self._send('1')
+        except (OSError, http.client.HTTPException):
+            pass
+        if self._send_conn is not None:
+            self._send_conn.close()
\ No newline at end of file
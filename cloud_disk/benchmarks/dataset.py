@@ -0,0 +1,120 @@
+import os
+import json
+import random
+import shutil
+
+# 生成文件内容用的随机数据块（随机内容不会被压缩或去重“优化”掉）
+BLOCK_SIZE = 1024 * 1024
+MANIFEST_NAME = 'dataset.json'
+
+DEFAULT_PARAMS = {
+    # 单个目录中的大量小文件
+    'small_files': 20000,
+    'small_max_size': 8 * 1024,
+    # 深层目录树: 深度、每层子目录数、每个目录的文件数
+    'deep_depth': 6,
+    'deep_fanout': 3,
+    'deep_files': 4,
+    # 单个大文件(MB)
+    'huge_mb': 256,
+    # 用于预览/Range请求的媒体文件(MB)
+    'media_mb': 64,
+}
+
+
+def _write_file(path, size, block):
+    with open(path, 'wb') as f:
+        while size > 0:
+            n = min(size, len(block))
+            f.write(block[:n])
+            size -= n
+
+
+def _deep_tree(root, rel, depth, fanout, files, rng, block, stats):
+    """递归生成目录树，返回最深一条路径"""
+    folder = os.path.join(root, rel)
+    os.makedirs(folder, exist_ok=True)
+    for i in range(files):
+        size = rng.randint(256, 4096)
+        _write_file(os.path.join(folder, f'file_{i}.dat'), size, block)
+        stats['files'] += 1
+        stats['bytes'] += size
+    stats['dirs'] += 1
+    if depth == 0:
+        return rel
+    deepest = rel
+    for i in range(fanout):
+        deepest = _deep_tree(root, f'{rel}/d{i}', depth - 1, fanout, files, rng, block, stats)
+    return deepest
+
+
+def build_dataset(root, **params):
+    """在 root/share 下生成合成共享目录，参数相同的数据集已存在时直接复用
+
+    返回数据集描述（各测试场景使用的相对路径、文件数和总大小）。
+    """
+    params = {**DEFAULT_PARAMS, **{k: v for k, v in params.items() if v is not None}}
+    share = os.path.join(root, 'share')
+    manifest_path = os.path.join(root, MANIFEST_NAME)
+    try:
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        if manifest.get('params') == params and os.path.isdir(share):
+            print(f"复用已有的测试数据: {share}")
+            return manifest
+    except (OSError, ValueError):
+        pass
+
+    print(f"正在生成测试数据: {share}")
+    shutil.rmtree(share, ignore_errors=True)
+    os.makedirs(share)
+    rng = random.Random(0)
+    block = os.urandom(BLOCK_SIZE)
+    stats = {'files': 0, 'dirs': 0, 'bytes': 0}
+
+    small_dir = os.path.join(share, 'small')
+    os.makedirs(small_dir)
+    for i in range(params['small_files']):
+        size = rng.randint(1, params['small_max_size'])
+        _write_file(os.path.join(small_dir, f'small_{i:06d}.txt'), size, block)
+        stats['files'] += 1
+        stats['bytes'] += size
+    stats['dirs'] += 1
+
+    deep_dir = _deep_tree(share, 'deep', params['deep_depth'], params['deep_fanout'],
+                          params['deep_files'], rng, block, stats)
+
+    os.makedirs(os.path.join(share, 'huge'))
+    _write_file(os.path.join(share, 'huge', 'huge.bin'), params['huge_mb'] * BLOCK_SIZE, block)
+    os.makedirs(os.path.join(share, 'media'))
+    _write_file(os.path.join(share, 'media', 'sample.mp4'), params['media_mb'] * BLOCK_SIZE, block)
+    stats['files'] += 2
+    stats['dirs'] += 2
+    stats['bytes'] += (params['huge_mb'] + params['media_mb']) * BLOCK_SIZE
+
+    # 上传和广播测试的目标目录
+    os.makedirs(os.path.join(share, 'uploads'))
+    os.makedirs(os.path.join(share, 'fanout'))
+
+    manifest = {
+        'params': params,
+        'small_dir': 'small',
+        'deep_dir': deep_dir,
+        'huge_file': 'huge/huge.bin',
+        'media_file': 'media/sample.mp4',
+        'upload_dir': 'uploads',
+        'fanout_dir': 'fanout',
+        **stats,
+    }
+    with open(manifest_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    return manifest
+
+
+def reset_scratch(root, manifest):
+    """清空上传和广播测试产生的文件，使多次运行的条件一致"""
+    share = os.path.join(root, 'share')
+    for rel in (manifest['upload_dir'], manifest['fanout_dir']):
+        folder = os.path.join(share, rel)
+        shutil.rmtree(folder, ignore_errors=True)
+        os.makedirs(folder, exist_ok=True)
\ No newline at end of file
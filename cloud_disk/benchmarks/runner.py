@@ -0,0 +1,432 @@
+import os
+import sys
+import json
+import time
+import random
+import socket
+import platform
+import threading
+import subprocess
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+import psutil
+from .client import HttpClient, SocketClient
+from .dataset import build_dataset, reset_scratch
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 比较结果时显示的指标，以及数值越大越好的指标
+COMPARE_METRICS = ('p50_ms', 'p99_ms', 'req_per_s', 'mb_per_s', 'delivered',
+                   'server_cpu_seconds', 'server_rss_max_mb')
+HIGHER_IS_BETTER = {'req_per_s', 'mb_per_s', 'delivered'}
+
+
+def percentile(sorted_values, p):
+    """最近秩法百分位数"""
+    if not sorted_values:
+        return None
+    index = max(0, min(len(sorted_values) - 1, int(round(p / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def summarize(latencies):
+    """延迟统计(毫秒)"""
+    values = sorted(latencies)
+    if not values:
+        return {'count': 0}
+    return {
+        'count': len(values),
+        'mean_ms': round(sum(values) / len(values) * 1000, 3),
+        'p50_ms': round(percentile(values, 50) * 1000, 3),
+        'p90_ms': round(percentile(values, 90) * 1000, 3),
+        'p99_ms': round(percentile(values, 99) * 1000, 3),
+        'max_ms': round(values[-1] * 1000, 3),
+    }
+
+
+class ResourceSampler:
+    """在测试场景期间定时采样服务器进程的CPU和内存"""
+
+    def __init__(self, pid, interval=0.1):
+        self.process = psutil.Process(pid) if pid else None
+        self.interval = interval
+        self.samples = []
+        self.running = False
+        self.thread = None
+
+    def _cpu_seconds(self):
+        times = self.process.cpu_times()
+        return times.user + times.system
+
+    def __enter__(self):
+        if self.process is None:
+            return self
+        self.cpu_start = self._cpu_seconds()
+        self.process.cpu_percent(None)
+        self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+        return self
+
+    def _run(self):
+        while self.running:
+            time.sleep(self.interval)
+            try:
+                self.samples.append((self.process.cpu_percent(None), self.process.memory_info().rss))
+            except psutil.Error:
+                break
+
+    def __exit__(self, *exc):
+        if self.process is None:
+            return
+        self.running = False
+        self.thread.join()
+        self.cpu_end = self._cpu_seconds()
+
+    def result(self):
+        if self.process is None or not self.samples:
+            return {}
+        cpu = [s[0] for s in self.samples]
+        rss = [s[1] for s in self.samples]
+        return {
+            'server_cpu_seconds': round(self.cpu_end - self.cpu_start, 3),
+            'server_cpu_avg_percent': round(sum(cpu) / len(cpu), 1),
+            'server_cpu_max_percent': round(max(cpu), 1),
+            'server_rss_max_mb': round(max(rss) / 1024 / 1024, 1),
+        }
+
+
+class ServerProcess:
+    """在子进程中启动被测服务器"""
+
+    def __init__(self, root, port, server_mode):
+        self.root = root
+        self.port = port
+        self.server_mode = server_mode
+        self.process = None
+        self.log = None
+
+    def start(self, timeout=60):
+        env = dict(os.environ)
+        if self.server_mode:
+            env['CLOUD_DISK_SERVER_MODE'] = self.server_mode
+        self.log = open(os.path.join(self.root, 'server.log'), 'wb')
+        self.process = subprocess.Popen(
+            [sys.executable, '-m', 'benchmarks.server',
+             '--share', os.path.join(self.root, 'share'),
+             '--data', os.path.join(self.root, 'data'),
+             '--port', str(self.port)],
+            cwd=PROJECT_DIR, env=env, stdout=self.log, stderr=subprocess.STDOUT)
+        client = HttpClient('127.0.0.1', self.port, timeout=5)
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"服务器启动失败，详见 {self.log.name}")
+            try:
+                if client.request('GET', '/files')[0] == 200:
+                    return
+            except OSError:
+                client.close()
+            time.sleep(0.2)
+        raise RuntimeError('等待服务器启动超时')
+
+    def stop(self):
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+        if self.log:
+            self.log.close()
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_for_background_scans(client, timeout):
+    """等待目录占用统计等启动扫描完成，避免和测试争抢磁盘和CPU"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if client.request('GET', '/usage')[0] == 200:
+                return True
+        except OSError:
+            client.close()
+        time.sleep(0.5)
+    return False
+
+
+def run_requests(host, port, concurrency, count, make_request):
+    """用 concurrency 个线程共发送 count 个请求
+
+    make_request(client, i) 返回本次传输的字节数。返回 (每个请求的耗时, 总字节数, 总耗时, 失败数)。
+    """
+    local = threading.local()
+    clients = []
+    lock = threading.Lock()
+
+    def worker(i):
+        client = getattr(local, 'client', None)
+        if client is None:
+            client = local.client = HttpClient(host, port)
+            with lock:
+                clients.append(client)
+        started = time.perf_counter()
+        try:
+            nbytes = make_request(client, i)
+        except Exception:
+            client.close()
+            return None, 0
+        return time.perf_counter() - started, nbytes
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(worker, range(count)))
+    elapsed = time.perf_counter() - started
+    for client in clients:
+        client.close()
+    latencies = [r[0] for r in results if r[0] is not None]
+    return latencies, sum(r[1] for r in results), elapsed, count - len(latencies)
+
+
+def _checked(status, nbytes, expected=200):
+    if status != expected:
+        raise RuntimeError(f'HTTP {status}')
+    return nbytes
+
+
+class Benchmark:
+    """各测试场景"""
+
+    def __init__(self, host, port, pid, manifest, args):
+        self.host = host
+        self.port = port
+        self.pid = pid
+        self.manifest = manifest
+        self.args = args
+        self.results = {}
+
+    def measure(self, name, concurrency, count, make_request, throughput=False):
+        with ResourceSampler(self.pid) as sampler:
+            latencies, nbytes, elapsed, errors = run_requests(
+                self.host, self.port, concurrency, count, make_request)
+        result = {'concurrency': concurrency, 'errors': errors, **summarize(latencies),
+                  'req_per_s': round(len(latencies) / elapsed, 2) if elapsed else None,
+                  'elapsed_s': round(elapsed, 3)}
+        if throughput:
+            result['bytes'] = nbytes
+            result['mb_per_s'] = round(nbytes / elapsed / 1024 / 1024, 2) if elapsed else None
+        result.update(sampler.result())
+        self.results[name] = result
+        _print_result(name, result)
+
+    # ================= 目录列表 =================
+    def listing(self):
+        c = self.args.concurrency
+        n = self.args.requests
+        small = self.manifest['small_dir']
+        deep = self.manifest['deep_dir']
+        self.measure('listing_root', c, n,
+                     lambda client, i: _checked(*client.request('GET', '/files')[:2]))
+        self.measure('listing_deep', c, n,
+                     lambda client, i: _checked(*client.request('GET', f'/files/{deep}')[:2]))
+        self.measure('listing_small_page', c, n,
+                     lambda client, i: _checked(*client.request('GET', f'/files/{small}?limit=200&sort=name')[:2]))
+        # 完整列表响应很大，请求数相应减少
+        self.measure('listing_small_full', c, max(c, n // 10),
+                     lambda client, i: _checked(*client.request('GET', f'/files/{small}')[:2]))
+
+    # ================= 上传下载 =================
+    def upload(self):
+        size = self.args.upload_mb * 1024 * 1024
+        block = os.urandom(1024 * 1024)
+        target = self.manifest['upload_dir']
+
+        def upload_one(client, i):
+            status, content = client.upload(target, f'upload_{i}.bin', size, block)
+            return _checked(status, size)
+
+        self.measure('upload', self.args.concurrency, self.args.uploads, upload_one, throughput=True)
+
+    def download(self):
+        path = f"/download/{self.manifest['huge_file']}"
+        self.measure('download', self.args.concurrency, self.args.downloads,
+                     lambda client, i: _checked(*client.request('GET', path)[:2]), throughput=True)
+
+    def view(self):
+        """预览大文件时的随机Range请求（拖动视频进度）"""
+        path = f"/view/{self.manifest['media_file']}"
+        size = self.manifest['params']['media_mb'] * 1024 * 1024
+        length = 1024 * 1024
+        rng = random.Random(1)
+        offsets = [rng.randrange(0, size - length) for _ in range(self.args.requests)]
+
+        def view_range(client, i):
+            start = offsets[i]
+            headers = {'Range': f'bytes={start}-{start + length - 1}'}
+            return _checked(*client.request('GET', path, headers=headers)[:2], expected=206)
+
+        self.measure('view_range', self.args.concurrency, len(offsets), view_range, throughput=True)
+
+    # ================= Socket.IO广播 =================
+    def fanout(self):
+        """多个客户端订阅同一目录，测量目录变化到各客户端收到增量的延迟"""
+        target = self.manifest['fanout_dir']
+        clients = []
+        try:
+            with ThreadPoolExecutor(max_workers=16) as pool:
+                clients = list(pool.map(lambda _: self._subscribed_client(target),
+                                        range(self.args.sockets)))
+        except Exception as e:
+            for client in clients:
+                client.close()
+            print(f"Socket.IO客户端连接失败: {e}")
+            self.results['fanout'] = {'error': str(e)}
+            return
+
+        http = HttpClient(self.host, self.port)
+        latencies = []
+        expected = delivered = 0
+        with ResourceSampler(self.pid) as sampler:
+            for i in range(self.args.events):
+                name = f'event_{i}'
+
+                def match(event, data, name=name):
+                    return event == 'file_delta' and any(
+                        entry.get('name') == name for entry in data.get('added', []))
+
+                started = time.perf_counter()
+                status, _ = http.post_json('/create_folder', {'folder_name': name, 'path': target})
+                if status != 200:
+                    continue
+                for client in clients:
+                    expected += 1
+                    received = client.wait_for(match, 10)
+                    if received is not None:
+                        delivered += 1
+                        latencies.append(received - started)
+        http.close()
+        for client in clients:
+            client.close()
+
+        result = {'clients': len(clients), 'events': self.args.events,
+                  'delivered': round(delivered / expected, 4) if expected else 0,
+                  **summarize(latencies), **sampler.result()}
+        self.results['fanout'] = result
+        _print_result('fanout', result)
+
+    def _subscribed_client(self, target):
+        client = SocketClient(self.host, self.port)
+        client.connect()
+        client.emit('subscribe', {'path': target})
+        if client.wait_for(lambda event, data: event == 'subscribed', 10) is None:
+            client.close()
+            raise RuntimeError('订阅超时')
+        return client
+
+
+SCENARIOS = ('listing', 'upload', 'download', 'view', 'fanout')
+
+
+def _print_result(name, result):
+    parts = [f"{name:<20}"]
+    for key, label in (('p50_ms', 'p50'), ('p99_ms', 'p99')):
+        if result.get(key) is not None:
+            parts.append(f"{label} {result[key]:.1f}ms")
+    for key, fmt in (('req_per_s', '{:.0f} req/s'), ('mb_per_s', '{:.1f} MB/s'),
+                     ('delivered', '送达 {:.1%}'), ('server_cpu_seconds', 'CPU {:.2f}s'),
+                     ('server_rss_max_mb', 'RSS {:.0f}MB')):
+        if result.get(key) is not None:
+            parts.append(fmt.format(result[key]))
+    if result.get('errors'):
+        parts.append(f"失败 {result['errors']}")
+    print('  '.join(parts))
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=PROJECT_DIR,
+                              capture_output=True, text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def run(args):
+    """生成数据、启动服务器、依次运行测试场景并保存JSON结果"""
+    root = os.path.abspath(args.root)
+    os.makedirs(root, exist_ok=True)
+    manifest = build_dataset(root, small_files=args.small_files, deep_depth=args.deep_depth,
+                             huge_mb=args.huge_mb)
+    reset_scratch(root, manifest)
+
+    server = None
+    if args.url:
+        host, _, port = args.url.split('//')[-1].rstrip('/').partition(':')
+        port = int(port or 80)
+        pid = args.pid
+    else:
+        host, port = '127.0.0.1', args.port or _free_port()
+        server = ServerProcess(root, port, args.server_mode)
+        print(f"启动服务器: http://{host}:{port}")
+        server.start()
+        pid = server.process.pid
+
+    results = {}
+    try:
+        if not wait_for_background_scans(HttpClient(host, port), args.settle_timeout):
+            print('启动扫描未在规定时间内完成，结果可能受后台扫描影响')
+        benchmark = Benchmark(host, port, pid, manifest, args)
+        for name in args.scenarios:
+            getattr(benchmark, name)()
+        results = benchmark.results
+    finally:
+        if server is not None:
+            server.stop()
+            reset_scratch(root, manifest)
+
+    report = {
+        'meta': {
+            'time': datetime.now().isoformat(timespec='seconds'),
+            'commit': _git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'memory_mb': round(psutil.virtual_memory().total / 1024 / 1024),
+            'server_mode': args.server_mode or os.environ.get('CLOUD_DISK_SERVER_MODE', 'werkzeug'),
+            'args': {k: v for k, v in vars(args).items() if k != 'func'},
+        },
+        'dataset': manifest,
+        'results': results,
+    }
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"结果已保存: {args.out}")
+    return report
+
+
+def compare(args):
+    """对比两次测试结果的主要指标"""
+    with open(args.base, 'r', encoding='utf-8') as f:
+        base = json.load(f)['results']
+    with open(args.new, 'r', encoding='utf-8') as f:
+        new = json.load(f)['results']
+    print(f"{'场景':<20}{'指标':<20}{'基准':>12}{'本次':>12}{'变化':>10}")
+    for name in sorted(set(base) & set(new)):
+        for metric in COMPARE_METRICS:
+            old_value, new_value = base[name].get(metric), new[name].get(metric)
+            if old_value is None or new_value is None:
+                continue
+            change = ''
+            if old_value:
+                ratio = (new_value - old_value) / old_value
+                better = ratio > 0 if metric in HIGHER_IS_BETTER else ratio < 0
+                change = f"{ratio:+.1%}" + (' ✓' if better and abs(ratio) >= args.threshold else
+                                            ' ✗' if not better and abs(ratio) >= args.threshold else '')
+            print(f"{name:<20}{metric:<20}{old_value:>12}{new_value:>12}{change:>10}")
+    for name in sorted(set(base) ^ set(new)):
+        print(f"{name:<20}只在{'基准' if name in base else '本次'}结果中")
\ No newline at end of file
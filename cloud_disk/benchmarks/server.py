@@ -0,0 +1,24 @@
+"""在独立进程中启动被测服务器（由测试程序调用，便于单独统计服务器的CPU和内存）"""
+import os
+import sys
+import argparse
+
+
+def main():
+    parser = argparse.ArgumentParser(description='启动性能测试用的服务器')
+    parser.add_argument('--share', required=True, help='共享目录')
+    parser.add_argument('--data', required=True, help='程序数据目录')
+    parser.add_argument('--port', type=int, required=True)
+    args = parser.parse_args()
+
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from app.config import Config
+    Config.DATA_FOLDER = os.path.abspath(args.data)
+    if not Config.set_upload_folder(args.share):
+        sys.exit(f"共享目录不存在: {args.share}")
+    from app import run_server
+    run_server(args.port)
+
+
+if __name__ == '__main__':
+    main()
\ No newline at end of file
@@ -0,0 +1,129 @@
+"""启动耗时测试：从启动无界面服务器进程到第一个 /files 请求成功返回的时间
+
+每次测试都启动新的解释器进程（与用户实际启动相同），以很短的间隔轮询 /files，
+并用 python -X importtime 列出导入app包时耗时最多的依赖，便于定位变慢的原因。
+"""
+import os
+import re
+import sys
+import json
+import time
+import shutil
+import platform
+import subprocess
+from datetime import datetime
+from .client import HttpClient
+from .runner import PROJECT_DIR, summarize, _free_port, _git_commit, _print_result
+
+# 轮询 /files 的间隔(秒)
+POLL_INTERVAL = 0.005
+IMPORT_LINE = re.compile(r'import time:\s+(\d+) \|\s+(\d+) \| ( *)(\S+)')
+
+
+def _build_share(folder, files):
+    """生成只含少量小文件的共享目录，启动耗时不受后台扫描影响"""
+    os.makedirs(folder, exist_ok=True)
+    for i in range(files):
+        path = os.path.join(folder, f'file_{i:05d}.txt')
+        if not os.path.exists(path):
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(f'startup benchmark {i}\n')
+
+
+def measure_once(share, data, port, server_mode=None, timeout=60, log_path=os.devnull):
+    """启动一次服务器，返回到第一个 /files 成功返回的秒数"""
+    env = dict(os.environ)
+    if server_mode:
+        env['CLOUD_DISK_SERVER_MODE'] = server_mode
+    # 不读取用户的 cloud_disk.ini，以免端口和共享目录被覆盖
+    cmd = [sys.executable, 'headless.py', '--config', os.devnull,
+           '--share', share, '--data', data, '--port', str(port)]
+    client = HttpClient('127.0.0.1', port, timeout=5)
+    with open(log_path, 'wb') as log:
+        started = time.perf_counter()
+        process = subprocess.Popen(cmd, cwd=PROJECT_DIR, env=env, stdout=log, stderr=subprocess.STDOUT)
+        try:
+            deadline = started + timeout
+            while time.perf_counter() < deadline:
+                if process.poll() is not None:
+                    raise RuntimeError(f"服务器启动失败，详见 {log_path}")
+                try:
+                    if client.request('GET', '/files')[0] == 200:
+                        return time.perf_counter() - started
+                except OSError:
+                    client.close()
+                time.sleep(POLL_INTERVAL)
+            raise RuntimeError('等待服务器启动超时')
+        finally:
+            client.close()
+            process.terminate()
+            try:
+                process.wait(10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+
+def import_profile(top=10):
+    """导入app包的总耗时和累计耗时最多的直接依赖（毫秒）"""
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import app'],
+                            cwd=PROJECT_DIR, capture_output=True, text=True, timeout=60)
+    total = None
+    modules = []
+    for line in result.stderr.splitlines():
+        match = IMPORT_LINE.match(line)
+        if not match:
+            continue
+        cumulative, indent, name = int(match.group(2)), len(match.group(3)), match.group(4)
+        if indent == 0 and name == 'app':
+            total = round(cumulative / 1000, 1)
+        elif indent == 2:
+            modules.append((name, round(cumulative / 1000, 1)))
+    modules.sort(key=lambda item: item[1], reverse=True)
+    return {'total_ms': total, 'top': modules[:top]}
+
+
+def startup(args):
+    """多次冷启动服务器并统计耗时，可选保存JSON结果（可用 compare 对比）"""
+    root = os.path.abspath(args.root)
+    share = os.path.abspath(args.share) if args.share else os.path.join(root, 'startup_share')
+    if not args.share:
+        _build_share(share, args.files)
+    data = os.path.join(root, 'startup_data')
+    log_path = os.path.join(root, 'startup_server.log')
+
+    latencies = []
+    for i in range(args.runs):
+        if not args.warm:
+            # 不保留上次的元数据目录和索引，与第一次运行相同
+            shutil.rmtree(data, ignore_errors=True)
+        elapsed = measure_once(share, data, args.port or _free_port(), args.server_mode, log_path=log_path)
+        latencies.append(elapsed)
+        print(f"第{i + 1}次: {elapsed * 1000:.1f}ms")
+    result = summarize(latencies)
+    _print_result('startup', result)
+
+    profile = import_profile()
+    print(f"\n导入app包: {profile['total_ms']}ms，耗时最多的依赖:")
+    for name, ms in profile['top']:
+        print(f"  {name:<40}{ms:>8.1f}ms")
+
+    report = {
+        'meta': {
+            'time': datetime.now().isoformat(timespec='seconds'),
+            'commit': _git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'server_mode': args.server_mode or os.environ.get('CLOUD_DISK_SERVER_MODE', 'werkzeug'),
+            'args': {k: v for k, v in vars(args).items() if k != 'func'},
+        },
+        'results': {'startup': result},
+        'imports': profile,
+    }
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"结果已保存: {args.out}")
+    if args.max_ms and result['p50_ms'] > args.max_ms:
+        sys.exit(f"启动耗时中位数 {result['p50_ms']:.1f}ms 超过上限 {args.max_ms:g}ms")
+    return report
\ No newline at end of file
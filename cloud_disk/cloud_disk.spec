@@ -17,6 +17,9 @@ a = Analysis(
         ('icon.ico', '.'),
     ],
     hiddenimports=[
+        # run.py 在确定运行方式后才导入
+        'gui',
+        'headless',
         'engineio.async_drivers.threading',
         'socketio',
         'flask_socketio',
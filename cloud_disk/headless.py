@@ -0,0 +1,64 @@
+"""无界面运行（Linux服务器、NAS或作为系统服务），不加载tkinter、托盘图标等图形界面依赖
+
+端口、共享目录和传输限速读取与图形界面控制台相同的 cloud_disk.ini，命令行参数优先。
+
+用法（在cloud_disk目录下运行）:
+    python headless.py [--port 5000] [--share 共享目录] [--data 数据目录] [--config cloud_disk.ini]
+    python run.py --headless [同上参数]
+
+进程保持在前台运行，可直接交给systemd等服务管理器托管，收到SIGTERM后安全退出。
+"""
+import os
+import sys
+import argparse
+import configparser
+
+# 配置文件路径（与图形界面共用）
+CONFIG_FILE = "cloud_disk.ini"
+
+
+def read_config(path=CONFIG_FILE):
+    config = configparser.ConfigParser()
+    config.read(path)
+    return config
+
+
+def apply_transfer_settings(config):
+    """按配置文件设置传输限速（配置文件中以MB/s保存）"""
+    from app import transfer_scheduler
+    from app.config import Config
+    try:
+        transfer_scheduler.configure(
+            rate_total=config.getfloat('transfer', 'rate_total_mb', fallback=0) * 1024 * 1024,
+            rate_per_client=config.getfloat('transfer', 'rate_per_client_mb', fallback=0) * 1024 * 1024,
+            max_per_client=config.getint('transfer', 'max_per_client', fallback=Config.TRANSFER_MAX_PER_CLIENT))
+    except ValueError:
+        print("传输限速配置无效，使用默认设置")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='headless.py', description='无界面启动局域网云盘')
+    parser.add_argument('--config', default=CONFIG_FILE, help='配置文件（与图形界面共用）')
+    parser.add_argument('--port', type=int, help='端口（默认读取配置文件）')
+    parser.add_argument('--share', help='共享目录（默认读取配置文件）')
+    parser.add_argument('--data', help='程序数据目录，保存索引和缓存')
+    args = parser.parse_args(argv)
+    config = read_config(args.config)
+
+    # 参数解析完才导入Flask等依赖，--help和参数错误时立即返回
+    from app import run_server, register_exit_handlers
+    from app.config import Config
+    if args.data:
+        Config.DATA_FOLDER = os.path.abspath(args.data)
+    share = args.share or config.get('settings', 'shared_folder', fallback=Config.DEFAULT_UPLOAD_FOLDER)
+    if not Config.set_upload_folder(share):
+        sys.exit(f"共享目录不存在: {share}")
+    port = args.port or config.getint('settings', 'port', fallback=Config.DEFAULT_PORT)
+    apply_transfer_settings(config)
+
+    register_exit_handlers()
+    run_server(port)
+
+
+if __name__ == '__main__':
+    main()
\ No newline at end of file